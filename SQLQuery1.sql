@@ -15,8 +15,13 @@ CREATE TABLE music (
     artist_name nVARCHAR(255) NOT NULL,                                   -- 歌手名称
     genre nVARCHAR(255),                                                  -- 音乐类型（可以存储多个类型）
     play_count INT DEFAULT 0,                                             -- 播放次数，默认值为0
-    cover_url nVARCHAR(255) DEFAULT '/static/music_img/default_cover.jpg' -- 专辑封面默认地址
+    cover_url nVARCHAR(255) DEFAULT '/static/music_img/default_cover.jpg', -- 专辑封面默认地址
+    updated_at DATETIME                                                   -- 新增或修改歌曲信息的时间（播放次数变化不更新）
 );
+-- 按歌手筛选音乐列表（/music/list?artist=）
+CREATE INDEX ix_music_artist_name ON music (artist_name);
+-- 各进程的歌曲目录按修改时间读入其他进程修改的歌曲
+CREATE INDEX ix_music_updated_at ON music (updated_at);
 
 -- 创建歌单表
 CREATE TABLE playlists (
@@ -42,6 +47,8 @@ CREATE TABLE comments (
     comment_text nvarchar(max),                  -- 评论内容
     created_at   DATETIME DEFAULT GETDATE(),    -- 评论时间，默认当前时间
 );
+-- 按歌曲分页读取评论（按时间和ID的游标）
+CREATE INDEX ix_comments_music_created ON comments (music_id, created_at, id);
 
 -- 创建评分表
 CREATE TABLE ratings (
@@ -59,6 +66,78 @@ CREATE TABLE user_play_history (
     played_at DATETIME DEFAULT GETDATE(), -- 播放时间，默认当前时间
 );
 
+-- 用户-歌曲交互汇总表（由播放和评分接口增量维护，可用 flask rebuild-interactions 从原始记录重建）
+CREATE TABLE user_song_interactions (
+    userid      VARCHAR(255) NOT NULL,       -- 用户ID
+    music_id    INT NOT NULL,                -- 歌曲ID
+    play_count  INT NOT NULL DEFAULT 0,      -- 播放次数
+    last_played DATETIME,                    -- 最近一次播放时间
+    rating      INT,                         -- 评分（1到5），未评分为 NULL
+    PRIMARY KEY (userid, music_id)           -- 复合主键
+);
+CREATE INDEX ix_user_song_interactions_music_id ON user_song_interactions (music_id);
+
+-- 已汇总的原始播放记录归档表（由 flask rollup-play-history 从 user_play_history 移入）
+CREATE TABLE user_play_history_archive (
+    id        INT PRIMARY KEY,               -- 原播放记录ID
+    userid    VARCHAR(255) NOT NULL,         -- 用户ID
+    music_id  INT NOT NULL,                  -- 音乐ID
+    played_at DATETIME                       -- 播放时间
+);
+
+-- 每个用户每天对每首歌的播放次数（超过保留期的原始播放记录汇总而来）
+CREATE TABLE daily_user_song_plays (
+    day         DATE NOT NULL,               -- 日期（UTC）
+    userid      VARCHAR(255) NOT NULL,       -- 用户ID
+    music_id    INT NOT NULL,                -- 音乐ID
+    play_count  INT NOT NULL DEFAULT 0,      -- 当天的播放次数
+    last_played DATETIME,                    -- 当天最后一次播放时间
+    PRIMARY KEY (day, userid, music_id)      -- 复合主键
+);
+CREATE INDEX ix_daily_user_song_plays_userid ON daily_user_song_plays (userid);
+
+-- 每首歌每天的播放次数
+CREATE TABLE daily_song_plays (
+    day        DATE NOT NULL,                -- 日期（UTC）
+    music_id   INT NOT NULL,                 -- 音乐ID
+    play_count INT NOT NULL DEFAULT 0,       -- 当天的播放次数
+    PRIMARY KEY (day, music_id)              -- 复合主键
+);
+
+-- 每首歌每小时的播放次数（日榜、周榜用，只保留最近一周）
+CREATE TABLE song_play_buckets (
+    music_id   INT NOT NULL,                 -- 歌曲ID
+    bucket     INT NOT NULL,                 -- 自1970年起的小时数
+    play_count INT NOT NULL DEFAULT 0,       -- 这一小时内的播放次数
+    PRIMARY KEY (music_id, bucket)           -- 复合主键
+);
+CREATE INDEX ix_song_play_buckets_bucket ON song_play_buckets (bucket);
+
+-- 预先算好的推荐结果表（由 flask precompute-recommendations 批量写入）
+CREATE TABLE user_recommendations (
+    userid       VARCHAR(255) NOT NULL,      -- 用户ID
+    mode         VARCHAR(16) NOT NULL,       -- 推荐方式（user / mf）
+    song_ids     VARCHAR(512) NOT NULL,      -- 推荐歌曲ID，逗号分隔，按推荐顺序
+    generated_at DATETIME NOT NULL,          -- 生成时间
+    PRIMARY KEY (userid, mode)               -- 复合主键
+);
+
+-- 推荐缓存的失效记录（各进程按ID轮询，删除这些用户的推荐缓存；由 flask rollup-play-history 清理）
+CREATE TABLE recommendation_invalidations (
+    id         INT IDENTITY (1,1) PRIMARY KEY,
+    userid     VARCHAR(255) NOT NULL,        -- 用户ID
+    created_at DATETIME NOT NULL             -- 写入时间
+);
+CREATE INDEX ix_recommendation_invalidations_created_at ON recommendation_invalidations (created_at);
+
+-- 按时间衰减的用户口味画像（各音乐类型、歌手的衰减播放量）
+CREATE TABLE user_taste_profiles (
+    userid     VARCHAR(255) PRIMARY KEY,     -- 用户ID
+    profile    NVARCHAR(MAX) NOT NULL,       -- 画像（JSON）
+    version    INT NOT NULL DEFAULT 0,       -- 每次更新加一（乐观锁）
+    updated_at DATETIME NOT NULL             -- 最后更新时间
+);
+
 -- 用户偏好表
 CREATE TABLE user_preferences
 (
@@ -38,4 +38,13 @@ def create_app(config_class=Config):
     app.register_blueprint(rankings_bp)
     app.register_blueprint(search_bp)
 
+    # 注册命令行命令（离线任务）
+    from app.commands import register_commands
+    register_commands(app)
+
+    # 在后台建立搜索补全索引
+    if app.config.get('SUGGEST_BUILD_ON_STARTUP', True):
+        from app.services.suggest import start_suggest_index
+        start_suggest_index(app)
+
     return app
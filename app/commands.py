@@ -0,0 +1,124 @@
+import time
+from datetime import UTC
+
+import click
+
+from app.services.als import ImplicitALS, load_implicit_feedback, train_mf_artifact
+from app.services.cache import prune_recommendation_invalidations
+from app.services.event_log import replay_play_events
+from app.services.interactions import apply_play_batch, insert_play_history, rebuild_play_buckets, reconcile_interactions
+from app.services.play_rollup import rollup_play_history
+from app.services.precompute import PRECOMPUTED_KINDS, CHUNK_SIZE, precompute_recommendations
+from app.services.preference_index import PreferenceIndex
+from app.services.rankings import prune_play_buckets
+from app.services.recommender import UserCFEngine, UserSongMatrix
+from app.services.user_cf_model import build_user_cf_artifact
+
+
+# 推荐缓存失效记录保留的秒数（远长于 RECOMMEND_CACHE_TTL）
+RECOMMENDATION_INVALIDATION_RETENTION = 86400
+
+# 播放日志可以重放到的目标：plays 与在线写入相同（原始记录、播放次数、交互汇总、小时计数），history 只写原始记录
+REPLAY_TARGETS = {
+    'plays': apply_play_batch,
+    'history': insert_play_history,
+}
+
+
+def register_commands(app):
+    """注册 flask 命令行命令，例如：flask --app app build-recommendations"""
+
+    @app.cli.command('build-recommendations')
+    @click.option('--neighbors', default=20, show_default=True, help='每个用户保存的候选相似用户数')
+    def build_recommendations(neighbors):
+        """离线构建用户协同过滤模型，写入 MODEL_DIR 并切换为当前版本"""
+        started = time.time()
+        engine = UserCFEngine(UserSongMatrix.from_db(), PreferenceIndex().load())
+        version = build_user_cf_artifact(engine, app.config['MODEL_DIR'], neighbors)
+        click.echo(f'模型 {version} 已生成：{engine.interactions.user_count} 个用户，'
+                   f'{len(engine.interactions.song_ids)} 首歌曲，耗时 {time.time() - started:.1f} 秒')
+
+    @app.cli.command('train-als')
+    @click.option('--factors', default=64, show_default=True, help='隐因子维数')
+    @click.option('--iterations', default=15, show_default=True, help='迭代轮数')
+    @click.option('--regularization', default=0.1, show_default=True, help='L2 正则系数')
+    @click.option('--alpha', default=40.0, show_default=True, help='置信度系数 c = 1 + alpha × 反馈强度')
+    @click.option('--workers', default=4, show_default=True, help='求解因子的线程数')
+    @click.option('--warm-start/--cold-start', default=True, show_default=True, help='是否从上一版模型的因子开始训练')
+    @click.option('--checkpoint', default=None, help='每轮保存一次因子的 .npz 文件，中断后用同一路径重新运行即可继续')
+    def train_als(factors, iterations, regularization, alpha, workers, warm_start, checkpoint):
+        """训练隐式反馈矩阵分解模型（ALS），写入 MODEL_DIR 并切换为当前版本"""
+        started = time.time()
+        interactions = load_implicit_feedback()
+        model = ImplicitALS(factors, regularization, alpha, iterations, workers)
+
+        def report(iteration):
+            click.echo(f'第 {iteration}/{iterations} 轮完成，已用 {time.time() - started:.1f} 秒')
+
+        version = train_mf_artifact(app, interactions, model, warm_start, checkpoint, report)
+        click.echo(f'模型 {version} 已生成：{interactions.user_count} 个用户，{len(interactions.song_ids)} 首歌曲')
+
+    @app.cli.command('rebuild-interactions')
+    @click.option('--dry-run', is_flag=True, help='只统计与原始记录不一致的行数，不写入')
+    def rebuild_interactions(dry_run):
+        """从原始播放记录和评分重建（或校对）用户-歌曲交互汇总表和最近一周的小时播放计数，首次上线时用于回填"""
+        started = time.time()
+        result = reconcile_interactions(dry_run)
+        action = '需要' if dry_run else '已'
+        click.echo(f'{action}插入 {result["inserted"]} 行，{action}修正 {result["updated"]} 行，'
+                   f'{action}删除 {result["deleted"]} 行，耗时 {time.time() - started:.1f} 秒')
+        if not dry_run:
+            # 日榜、周榜用的小时计数也从原始播放记录重建
+            click.echo(f'最近一周的小时播放计数 {rebuild_play_buckets()} 行')
+
+    @app.cli.command('rollup-play-history')
+    @click.option('--retention-days', default=None, type=int, help='原始播放记录保留的天数，默认为 PLAY_HISTORY_RETENTION_DAYS')
+    @click.option('--archive/--no-archive', default=True, show_default=True,
+                  help='汇总后把原始记录移入 user_play_history_archive，或直接删除')
+    def rollup_plays(retention_days, archive):
+        """把超过保留期的原始播放记录汇总成每日统计并归档，建议每天运行一次"""
+        started = time.time()
+        if retention_days is None:
+            retention_days = app.config.get('PLAY_HISTORY_RETENTION_DAYS', 7)
+        try:
+            result = rollup_play_history(retention_days, archive)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--retention-days')
+        action = '归档' if archive else '删除'
+        click.echo(f'汇总了 {result["days"]} 天的播放记录：{action} {result["rows"]} 条原始记录，'
+                   f'写入 {result["rollups"]} 行每日统计，耗时 {time.time() - started:.1f} 秒')
+        # 推荐缓存的失效记录只需要保留到缓存过期之后，小时播放计数只需要保留最近一周
+        click.echo(f'清理了 {prune_recommendation_invalidations(RECOMMENDATION_INVALIDATION_RETENTION)} 条推荐缓存失效记录，'
+                   f'{prune_play_buckets()} 行超过一周的小时播放计数')
+
+    @app.cli.command('replay-play-log')
+    @click.option('--since', type=click.DateTime(), default=None, help='起始时间（UTC，含），默认从头开始')
+    @click.option('--until', type=click.DateTime(), default=None, help='结束时间（UTC，不含），默认到最后')
+    @click.option('--target', type=click.Choice(sorted(REPLAY_TARGETS)), default='plays', show_default=True,
+                  help='写入的目标')
+    def replay_play_log(since, until, target):
+        """把二进制播放日志中一段时间的播放重新写入数据库；不去重，只重放数据库中缺失的时间段"""
+        started = time.time()
+        since = since.replace(tzinfo=UTC) if since else None
+        until = until.replace(tzinfo=UTC) if until else None
+
+        def report(replayed):
+            click.echo(f'已重放 {replayed} 条')
+
+        replayed = replay_play_events(app.config['PLAY_LOG_DIR'], REPLAY_TARGETS[target], since, until, callback=report)
+        click.echo(f'共重放 {replayed} 条播放记录到 {target}，耗时 {time.time() - started:.1f} 秒')
+
+    @app.cli.command('precompute-recommendations')
+    @click.option('--mode', type=click.Choice(sorted(PRECOMPUTED_KINDS)), default='user', show_default=True,
+                  help='推荐方式，使用对应的当前版本离线模型')
+    @click.option('--days', default=30, show_default=True, help='只为最近多少天内播放过歌曲的用户计算')
+    @click.option('--workers', default=4, show_default=True, help='子进程数')
+    @click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='每个任务的用户数')
+    def precompute(mode, days, workers, chunk_size):
+        """为活跃用户批量计算推荐并写入 user_recommendations，首页直接读取（先运行 build-recommendations 或 train-als）"""
+        def report(done, total, seconds):
+            click.echo(f'{done}/{total} 个用户，{done / seconds if seconds > 0 else 0:.0f} 个用户/秒')
+
+        result = precompute_recommendations(app, mode, days, workers, chunk_size, report)
+        click.echo(f'模型 {result["version"]}：{result["users"]} 个用户，耗时 {result["seconds"]:.1f} 秒，'
+                   f'{result["users_per_second"]:.0f} 个用户/秒')
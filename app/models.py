@@ -19,10 +19,12 @@ class Music(db.Model):
     __tablename__ = 'music'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(Unicode(255), nullable=False)
-    artist_name = db.Column(Unicode(255), nullable=False)
+    artist_name = db.Column(Unicode(255), nullable=False, index=True)
     genre = db.Column(Unicode(255))
     play_count = db.Column(db.Integer, default=0)
     cover_url = db.Column(db.String(255), default='/static/music_img/default_cover.jpg')
+    # 新增或修改歌曲信息的时间（播放次数变化不更新），其他进程的歌曲目录据此读入修改
+    updated_at = db.Column(db.DateTime, index=True)
 
 
 class Playlist(db.Model):
@@ -50,6 +52,9 @@ class Comment(db.Model):
     music_id = db.Column(db.Integer, nullable=False)
     comment_text = db.Column(UnicodeText)
     created_at = db.Column(db.DateTime, default=datetime.now(UTC))  # 数据库已设置默认值
+    __table_args__ = (
+        db.Index('ix_comments_music_created', 'music_id', 'created_at', 'id'),
+    )
 
 
 class Rating(db.Model):
@@ -68,6 +73,92 @@ class UserPlayHistory(db.Model):
     played_at = db.Column(db.DateTime, default=datetime.now(UTC))  # 数据库已设置默认值
 
 
+class UserPlayHistoryArchive(db.Model):
+    """已汇总进每日播放统计的原始播放记录，由 flask rollup-play-history 从 user_play_history 移入"""
+    __tablename__ = 'user_play_history_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    userid = db.Column(db.String(255), nullable=False)
+    music_id = db.Column(db.Integer, nullable=False)
+    played_at = db.Column(db.DateTime)
+
+
+class DailyUserSongPlay(db.Model):
+    """每个用户每天对每首歌的播放次数（UTC 日期），由超过保留期的原始播放记录汇总而来"""
+    __tablename__ = 'daily_user_song_plays'
+    day = db.Column(db.Date, nullable=False)
+    userid = db.Column(db.String(255), nullable=False, index=True)
+    music_id = db.Column(db.Integer, nullable=False)
+    play_count = db.Column(db.Integer, nullable=False, default=0)
+    last_played = db.Column(db.DateTime)
+    __table_args__ = (
+        PrimaryKeyConstraint('day', 'userid', 'music_id'),
+    )
+
+
+class DailySongPlay(db.Model):
+    """每首歌每天的播放次数（UTC 日期），与 daily_user_song_plays 同时写入"""
+    __tablename__ = 'daily_song_plays'
+    day = db.Column(db.Date, nullable=False)
+    music_id = db.Column(db.Integer, nullable=False)
+    play_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        PrimaryKeyConstraint('day', 'music_id'),
+    )
+
+
+class UserSongInteraction(db.Model):
+    """每个用户对每首歌的播放次数、最近播放时间和评分，推荐和排行榜读这张表而不扫描原始播放记录"""
+    __tablename__ = 'user_song_interactions'
+    userid = db.Column(db.String(255), nullable=False)
+    music_id = db.Column(db.Integer, nullable=False, index=True)
+    play_count = db.Column(db.Integer, nullable=False, default=0)
+    last_played = db.Column(db.DateTime)
+    rating = db.Column(db.Integer, CheckConstraint('rating BETWEEN 1 AND 5'))
+    __table_args__ = (
+        PrimaryKeyConstraint('userid', 'music_id'),
+    )
+
+
+class SongPlayBucket(db.Model):
+    """每首歌每小时的播放次数，只保留最近一周，用于日榜和周榜"""
+    __tablename__ = 'song_play_buckets'
+    music_id = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False, index=True)  # 自1970年起的小时数
+    play_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        PrimaryKeyConstraint('music_id', 'bucket'),
+    )
+
+
+class UserRecommendation(db.Model):
+    """批量任务预先算好的推荐歌曲（逗号分隔的歌曲ID，按推荐顺序）"""
+    __tablename__ = 'user_recommendations'
+    userid = db.Column(db.String(255), nullable=False)
+    mode = db.Column(db.String(16), nullable=False)
+    song_ids = db.Column(db.String(512), nullable=False)
+    generated_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('userid', 'mode'),
+    )
+
+
+class RecommendationInvalidation(db.Model):
+    """推荐缓存的失效记录：用户的评分、播放、偏好变化时在同一事务中写入一行，各进程按ID轮询后删除该用户的缓存"""
+    __tablename__ = 'recommendation_invalidations'
+    id = db.Column(db.Integer, primary_key=True)
+    userid = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class UserTasteProfile(db.Model):
+    """按时间衰减的用户口味画像（各音乐类型、歌手的衰减播放量），JSON 格式，version 用于并发更新时的乐观锁"""
+    __tablename__ = 'user_taste_profiles'
+    userid = db.Column(db.String(255), primary_key=True)
+    profile = db.Column(UnicodeText, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
 class UserPreference(db.Model):
     __tablename__ = 'user_preferences'
     id = db.Column(db.Integer, primary_key=True)
@@ -6,6 +6,7 @@ from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db
 from app.models import User
+from app.services.cache import invalidate_username
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -103,6 +104,7 @@ def change_username():
         # 更新用户名
         user.username = new_username
         db.session.commit()
+        invalidate_username(userid)
         return jsonify({
             'success': True,
             'message': '用户名修改成功',
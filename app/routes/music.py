@@ -1,28 +1,123 @@
+import base64
+import binascii
 import os
 import shutil
 from datetime import datetime, UTC
-from flask import Blueprint, jsonify, request
-from sqlalchemy import func
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import and_, func, or_, select
 from app import db
-from app.models import Music, Comment, User, Rating, UserPlayHistory
+from app.models import Music, Comment, User, Rating
+from app.services.cache import (get_song_cache, get_username_cache, invalidate_recommendations, invalidate_songs,
+                                record_recommendation_invalidations)
+from app.services.catalog import catalog_song, get_song_details, get_songs
+from app.services.interactions import record_rating_interaction
+from app.services.item_cf import record_item_interaction
+from app.services.play_queue import submit_play
+from app.services.play_rollup import recent_plays
+from app.services.precompute import discard_precomputed
+from app.services.recommender import record_user_interaction
+from app.services.fuzzy_index import fuzzy_index_song
+from app.services.search_index import index_song
+from app.services.search_results import LIKE_ESCAPE, escape_like
+from app.services.suggest import suggest_song
 
 music_bp = Blueprint('music', __name__)
 
 
+# 音乐列表可以返回的字段，以及不指定 fields 时默认返回的字段
+MUSIC_LIST_FIELDS = {
+    'id': Music.id,
+    'title': Music.title,
+    'artist_name': Music.artist_name,
+    'genre': Music.genre,
+    'play_count': Music.play_count,
+    'cover_url': Music.cover_url,
+}
+MUSIC_LIST_DEFAULT_FIELDS = ['id', 'title', 'artist_name', 'genre', 'cover_url']
+
+
 @music_bp.route('/list', methods=['GET'])
 def get_music_list():
+    """按歌曲ID分页的音乐列表
+
+    参数：limit 每页条数；after_id 上一页返回的 next_after_id（按ID继续，不用 OFFSET）；
+    genre、artist 筛选；fields 逗号分隔的返回字段。只查询需要的列，结果是元组而不是 ORM 对象。
+    """
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or MUSIC_LIST_DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in MUSIC_LIST_FIELDS]
+    if unknown:
+        return jsonify({'success': False, 'message': f'未知的字段: {",".join(unknown)}'})
+    try:
+        limit = min(max(int(request.args.get('limit', current_app.config.get('MUSIC_LIST_PAGE_SIZE', 50))), 1),
+                    current_app.config.get('MUSIC_LIST_MAX_PAGE_SIZE', 500))
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的分页参数'})
+
     try:
-        musics = Music.query.all()
+        # 分页需要ID，没有请求时也查出来，返回前去掉
+        columns = [MUSIC_LIST_FIELDS[f] for f in fields if f != 'id']
+        query = select(Music.id, *columns).where(Music.id > after_id)
+        genre = request.args.get('genre')
+        if genre:
+            # genre 列可能是逗号分隔的多个类型；类型中的 %、_ 等按普通字符匹配
+            escaped = escape_like(genre)
+            query = query.where(or_(
+                Music.genre == genre,
+                Music.genre.like(f'{escaped},%', escape=LIKE_ESCAPE),
+                Music.genre.like(f'%,{escaped}', escape=LIKE_ESCAPE),
+                Music.genre.like(f'%,{escaped},%', escape=LIKE_ESCAPE)
+            ))
+        artist = request.args.get('artist')
+        if artist:
+            query = query.where(Music.artist_name == artist)
+        # 多取一行判断是否还有下一页
+        rows = db.session.execute(query.order_by(Music.id).limit(limit + 1)).all()
+
+        names = [f for f in fields if f != 'id']
+        include_id = 'id' in fields
         music_list = []
-        for music in musics:
-            music_list.append({
-                'id': music.id,
-                'title': music.title,
-                'artist_name': music.artist_name,
-                'genre': music.genre,
-                'cover_url': music.cover_url
-            })
-        return jsonify({'success': True, 'data': music_list})
+        for row in rows[:limit]:
+            item = {'id': row[0]} if include_id else {}
+            item.update(zip(names, row[1:]))
+            music_list.append(item)
+        return jsonify({
+            'success': True,
+            'data': music_list,
+            'next_after_id': rows[limit - 1][0] if len(rows) > limit else None
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+
+@music_bp.route('/batch', methods=['GET'])
+def get_music_batch():
+    """一次获取多首歌的详情：ids 为逗号分隔的歌曲ID，按请求的顺序返回，不存在的歌曲列在 missing 中"""
+    try:
+        song_ids = [int(song_id) for song_id in request.args.get('ids', '').split(',') if song_id.strip()]
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的歌曲ID'})
+    song_ids = list(dict.fromkeys(song_ids))
+    max_ids = current_app.config.get('MUSIC_BATCH_MAX_IDS', 200)
+    if len(song_ids) > max_ids:
+        return jsonify({'success': False, 'message': f'一次最多查询{max_ids}首歌'})
+
+    try:
+        details = get_song_details(song_ids)
+        return jsonify({
+            'success': True,
+            'data': [details[song_id] for song_id in song_ids if song_id in details],
+            'missing': [song_id for song_id in song_ids if song_id not in details]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+
+@music_bp.route('/cache/stats', methods=['GET'])
+def get_song_cache_stats():
+    """歌曲详情缓存的大小、命中率、淘汰等计数，用于确定缓存容量"""
+    try:
+        return jsonify({'success': True, 'data': get_song_cache().stats()})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -30,18 +125,10 @@ def get_music_list():
 @music_bp.route('/<int:music_id>', methods=['GET'])
 def get_music_detail(music_id):
     try:
-        music = Music.query.get(music_id)
-        if not music:
+        music_data = get_song_details([music_id]).get(music_id)
+        if not music_data:
             return jsonify({'success': False, 'message': '音乐不存在'})
 
-        music_data = {
-            'id': music.id,
-            'title': music.title,
-            'artist_name': music.artist_name,
-            'genre': music.genre,
-            'play_count': music.play_count,
-            'cover_url': music.cover_url
-        }
         return jsonify({'success': True, 'data': music_data})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -49,22 +136,77 @@ def get_music_detail(music_id):
 
 @music_bp.route('/<int:music_id>/comments', methods=['GET'])
 def get_music_comments(music_id):
+    """按时间从新到旧分页返回评论，用上一页返回的 next_cursor 继续
+
+    按 (created_at, id) 定位下一页（有索引），作者用户名在同一个查询中关联得到，
+    每页的耗时与评论总数无关。
+    """
     try:
-        comments = Comment.query.filter_by(music_id=music_id).order_by(Comment.created_at.desc()).all()
+        limit = min(max(int(request.args.get('limit', current_app.config.get('COMMENTS_PAGE_SIZE', 20))), 1),
+                    current_app.config.get('COMMENTS_MAX_PAGE_SIZE', 100))
+        cursor = request.args.get('cursor')
+        after = decode_comment_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的分页参数'})
+
+    try:
+        query = select(Comment.id, Comment.userid, Comment.comment_text, Comment.created_at, User.username) \
+            .outerjoin(User, User.userid == Comment.userid) \
+            .where(Comment.music_id == music_id)
+        if after:
+            created_at, comment_id = after
+            query = query.where(or_(
+                Comment.created_at < created_at,
+                and_(Comment.created_at == created_at, Comment.id < comment_id)
+            ))
+        # 多取一行判断是否还有下一页
+        rows = db.session.execute(
+            query.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(limit + 1)
+        ).all()
+
+        usernames = get_username_cache()
         comments_list = []
-        for comment in comments:
-            user = User.query.filter_by(userid=comment.userid).first()
+        for comment_id, userid, comment_text, created_at, username in rows[:limit]:
+            if username is not None:
+                usernames.put(userid, username)
             comments_list.append({
-                'id': comment.id,
-                'username': user.username if user else '未知用户',
-                'comment_text': comment.comment_text,
-                'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                'id': comment_id,
+                'username': username if username is not None else '未知用户',
+                'comment_text': comment_text,
+                'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S')
             })
-        return jsonify({'success': True, 'data': comments_list})
+        next_cursor = encode_comment_cursor(rows[limit - 1].created_at, rows[limit - 1].id) \
+            if len(rows) > limit else None
+        return jsonify({'success': True, 'data': comments_list, 'next_cursor': next_cursor})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 
+def encode_comment_cursor(created_at, comment_id):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{comment_id}'.encode()).decode().rstrip('=')
+
+
+def decode_comment_cursor(cursor):
+    """返回 (created_at, 评论ID)，格式不对时抛出 ValueError"""
+    try:
+        created_at, comment_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+    except (UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+    return datetime.fromisoformat(created_at), int(comment_id)
+
+
+def get_username(userid):
+    """先查用户名缓存，未命中时读数据库并放入缓存；用户不存在时返回 None"""
+    usernames = get_username_cache()
+    username = usernames.get(userid)
+    if username is None:
+        user = db.session.get(User, userid)
+        if user is not None:
+            username = user.username
+            usernames.put(userid, username)
+    return username
+
+
 @music_bp.route('/<int:music_id>/comments', methods=['POST'])
 def add_comment(music_id):
     try:
@@ -84,7 +226,7 @@ def add_comment(music_id):
             'success': True,
             'data': {
                 'id': new_comment.id,
-                'username': '当前用户',  # 临时使用
+                'username': get_username(userid) or '未知用户',
                 'comment_text': comment_text,
                 'created_at': new_comment.created_at.strftime('%Y-%m-%d %H:%M:%S')
             }
@@ -138,7 +280,15 @@ def submit_rating(music_id):
             )
             db.session.add(new_rating)
 
+        # 同一事务中更新用户-歌曲交互汇总，删除预计算的推荐，并通知其他进程删除推荐缓存
+        record_rating_interaction(userid, music_id, rating_value)
+        discard_precomputed(userid)
+        record_recommendation_invalidations([userid])
         db.session.commit()
+        # 增量更新相似歌曲表，并让该用户的推荐缓存失效
+        record_item_interaction(userid, music_id)
+        record_user_interaction(userid)
+        invalidate_recommendations(userid)
 
         rating_stats = db.session.query(
             func.avg(Rating.rating_value).label('average'),
@@ -166,29 +316,15 @@ def record_play(music_id):
         if not userid:
             return jsonify({'success': False, 'message': '未登录用户'})
 
-        # 更新音乐播放次数
-        music = Music.query.get(music_id)
-        if not music:
+        # 按歌曲目录检查歌曲是否存在，不存在的歌曲不进入队列和播放日志
+        if not get_songs([music_id]):
             return jsonify({'success': False, 'message': '音乐不存在'})
 
-        music.play_count += 1
+        # 播放事件放入写入队列后立即返回，由后台线程批量写入播放记录、累加播放次数并更新各项统计
+        if not submit_play(userid, music_id):
+            return jsonify({'success': False, 'message': '播放记录过多，请稍后重试'})
 
-        # 添加播放记录
-        play_history = UserPlayHistory(
-            userid=userid,
-            music_id=music_id,
-            played_at=datetime.now(UTC)
-        )
-
-        db.session.add(play_history)
-        db.session.commit()
-
-        return jsonify({
-            'success': True,
-            'data': {
-                'play_count': music.play_count
-            }
-        })
+        return jsonify({'success': True, 'message': '播放已记录'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
@@ -197,22 +333,19 @@ def record_play(music_id):
 @music_bp.route('/play-history/<string:userid>', methods=['GET'])
 def get_play_history(userid):
     try:
-        # 获取用户最近的20条播放记录
-        history = UserPlayHistory.query \
-            .filter_by(userid=userid) \
-            .order_by(UserPlayHistory.played_at.desc()) \
-            .limit(20) \
-            .all()
+        # 获取用户最近的20条播放记录（原始记录已归档时从每日统计补充）
+        plays = recent_plays(userid, 20)
+        songs = get_songs(music_id for music_id, _ in plays)
 
         history_list = []
-        for record in history:
-            music = Music.query.get(record.music_id)
+        for music_id, played_at in plays:
+            music = songs.get(music_id)
             if music:
                 history_list.append({
                     'id': music.id,
                     'title': music.title,
                     'artist_name': music.artist_name,
-                    'played_at': record.played_at.strftime('%Y-%m-%d %H:%M:%S')
+                    'played_at': played_at.strftime('%Y-%m-%d %H:%M:%S')
                 })
 
         return jsonify({'success': True, 'data': history_list})
@@ -272,6 +405,7 @@ def update_music(music_id):
         music.title = data.get('title', music.title)
         music.artist_name = data.get('artist_name', music.artist_name)
         music.genre = data.get('genre', music.genre)
+        music.updated_at = datetime.now(UTC)
         
         # 处理封面图片
         cover_url = data.get('cover_url')
@@ -299,6 +433,11 @@ def update_music(music_id):
                 print("Temp file not found:", temp_path)  # 调试日志
         
         db.session.commit()
+        invalidate_songs([music.id])
+        catalog_song(music)
+        index_song(music)
+        fuzzy_index_song(music)
+        suggest_song(music)
         
         return jsonify({
             'success': True,
@@ -359,12 +498,17 @@ def create_music():
             title=data['title'],
             artist_name=data['artist_name'],
             genre=data.get('genre', ''),
-            cover_url=data.get('cover_url')
+            cover_url=data.get('cover_url'),
+            updated_at=datetime.now(UTC)
         )
         if new_music.cover_url == '':
             new_music.cover_url = '/static/music_img/default_cover.jpg'
         db.session.add(new_music)
         db.session.commit()
+        catalog_song(new_music)
+        index_song(new_music)
+        fuzzy_index_song(new_music)
+        suggest_song(new_music)
 
         return jsonify({'success': True, 'message': '音乐创建成功'})
     except Exception as e:
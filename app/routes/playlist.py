@@ -4,7 +4,8 @@ from zoneinfo import ZoneInfo
 
 from flask import Blueprint, jsonify, request
 from app import db
-from app.models import Playlist, Music, PlaylistSongs
+from app.models import Playlist, PlaylistSongs
+from app.services.catalog import get_songs
 
 playlist_bp = Blueprint('playlist', __name__)
 
@@ -87,14 +88,13 @@ def get_playlist_detail(playlist_id):
         if not playlist:
             return jsonify({'success': False, 'message': '歌单不存在'})
 
-        # 修改查询方式，明确指定join条件
-        songs = db.session.query(Music) \
-            .join(PlaylistSongs, Music.id == PlaylistSongs.music_id) \
-            .filter(PlaylistSongs.playlist_id == playlist_id) \
-            .all()
+        # 只查询歌单中的歌曲ID，歌曲信息从常驻内存的歌曲目录中读取
+        song_ids = [row.music_id for row in db.session.query(PlaylistSongs.music_id)
+                    .filter(PlaylistSongs.playlist_id == playlist_id)]
+        songs = get_songs(song_ids)
 
         songs_list = []
-        for song in songs:
+        for song in (songs[song_id] for song_id in song_ids if song_id in songs):
             songs_list.append({
                 'id': song.id,
                 'title': song.title,
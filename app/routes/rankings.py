@@ -1,43 +1,32 @@
-from flask import Blueprint, jsonify
-from sqlalchemy import func
-from app import db
-from app.models import UserPlayHistory, Music
+from flask import Blueprint, jsonify, request
+from app.services.catalog import get_songs
+from app.services.rankings import RANKING_WINDOWS, get_ranking_board
+from app.services.trending import get_trending_chart
 
 rankings_bp = Blueprint('rankings', __name__)
 
 
 @rankings_bp.route('/rankings', methods=['GET'])
 def get_rankings():
+    # 时间范围：day 为最近24小时，week 为最近7天，all 为全部时间
+    window = request.args.get('window', 'all')
+    if window not in RANKING_WINDOWS:
+        return jsonify({'success': False, 'message': '不支持的排行榜时间范围'})
+
     try:
-        # 歌手排行榜
-        artist_rankings = db.session.query(
-            Music.artist_name,
-            func.count(UserPlayHistory.id).label('play_count')
-        ).join(
-            UserPlayHistory, UserPlayHistory.music_id == Music.id
-        ).group_by(
-            Music.artist_name
-        ).order_by(
-            func.count(UserPlayHistory.id).desc()
-        ).limit(10).all()
-
-        # 热歌排行榜
-        pop_index_rankings = db.session.query(
-            Music.id,
-            Music.title,
-            Music.artist_name,
-            Music.genre,
-            func.count(UserPlayHistory.id).label('play_count')
-        ).join(
-            UserPlayHistory, UserPlayHistory.music_id == Music.id
-        ).group_by(
-            Music.id, Music.title, Music.artist_name, Music.genre
-        ).order_by(
-            func.count(UserPlayHistory.id).desc()
-        ).limit(10).all()
+        # 歌手排行榜和热歌排行榜都从常驻内存、随播放增量更新的排行榜中读取
+        artist_rankings, song_rankings = get_ranking_board().top(window, 10)
+
+        # 只查询上榜歌曲的详细信息
+        songs = get_songs(song_id for song_id, _ in song_rankings)
+        pop_index_rankings = [
+            (song_id, songs[song_id].title, songs[song_id].artist_name, songs[song_id].genre, count)
+            for song_id, count in song_rankings if song_id in songs
+        ]
 
         return jsonify({
             'success': True,
+            'window': window,
             'rankings': {
                 'artists': [
                     {'name': artist, 'popularity': count}
@@ -53,3 +42,37 @@ def get_rankings():
     except Exception as e:
         print(f"Error in get_rankings: {str(e)}")
         return jsonify({'success': False, 'message': f'获取排行榜失败: {str(e)}'})
+
+
+@rankings_bp.route('/rankings/trending', methods=['GET'])
+def get_trending():
+    """实时热门：按衰减后的播放量排序，越近的播放权重越大（半衰期 TRENDING_HALF_LIFE 秒）"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的数量'})
+
+    try:
+        song_rankings, artist_rankings, song_error, artist_error = get_trending_chart().top(limit)
+        songs = get_songs(song_id for song_id, _, _ in song_rankings)
+
+        return jsonify({
+            'success': True,
+            'trending': {
+                'artists': [
+                    {'name': artist, 'score': round(score, 3), 'error': round(error, 3)}
+                    for artist, score, error in artist_rankings
+                ],
+                'songs': [
+                    {'id': song_id, 'title': songs[song_id].title, 'artist': songs[song_id].artist_name,
+                     'genre': songs[song_id].genre, 'score': round(score, 3), 'error': round(error, 3)}
+                    for song_id, score, error in song_rankings if song_id in songs
+                ],
+                # 任何一项分数的最大高估量（总衰减播放量 / 计数器个数）
+                'error_bound': {'songs': round(song_error, 3), 'artists': round(artist_error, 3)}
+            }
+        })
+
+    except Exception as e:
+        print(f"Error in get_trending: {str(e)}")
+        return jsonify({'success': False, 'message': f'获取实时热门失败: {str(e)}'})
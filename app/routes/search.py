@@ -1,13 +1,19 @@
-from flask import Blueprint, request, jsonify
-from app import db
+from flask import Blueprint, current_app, request, jsonify
 from app.models import Music
-from sqlalchemy import or_
+from app.services.catalog import get_songs
+from app.services.search_results import LIKE_ESCAPE, SEARCH_ORDERS, escape_like, search_page
+from app.services.suggest import get_suggest_index
 
 search_bp = Blueprint('search', __name__)
 
 
 @search_bp.route('/search', methods=['GET'])
 def search():
+    """搜索歌名和歌手，按相关度（relevance）或播放次数（popularity）排序分页返回
+
+    第一页之后用上一页返回的 next_cursor 继续，游标对应的候选结果保存在短期缓存中，不会重新检索。
+    total 为命中总数，total_estimated 为 true 时是估计值。fuzzy=1 时容忍拼写错误（按编辑距离匹配歌名、歌手名）。
+    """
     query = request.args.get('query', '')
     if not query:
         return jsonify({
@@ -15,14 +21,27 @@ def search():
             'message': '搜索关键词不能为空'
         })
 
+    order = request.args.get('order', 'relevance')
+    if order not in SEARCH_ORDERS:
+        return jsonify({'success': False, 'message': '无效的排序方式'})
+    try:
+        config = current_app.config
+        limit = min(max(int(request.args.get('limit', config.get('SEARCH_PAGE_SIZE', 20))), 1),
+                    config.get('SEARCH_MAX_PAGE_SIZE', 100))
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的数量'})
+
+    fuzzy = request.args.get('fuzzy', '0').lower() in ('1', 'true')
+
     try:
-        # 使用 LIKE 进行模糊查询，同时搜索歌名和歌手
-        results = Music.query.filter(
-            or_(
-                Music.title.like(f'%{query}%'),
-                Music.artist_name.like(f'%{query}%')
-            )
-        ).all()
+        try:
+            song_ids, candidates, next_cursor = search_page(query, order, limit, request.args.get('cursor'), fuzzy)
+        except ValueError:
+            return jsonify({'success': False, 'message': '无效的游标'})
+
+        # 只查询当前页的歌曲，按候选顺序返回
+        songs = get_songs(song_ids)
+        results = [songs[song_id] for song_id in song_ids if song_id in songs]
 
         return jsonify({
             'success': True,
@@ -31,7 +50,10 @@ def search():
                 'title': song.title,
                 'artist': song.artist_name,
                 'cover': song.cover_url
-            } for song in results]
+            } for song in results],
+            'total': candidates.total,
+            'total_estimated': candidates.estimated,
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
@@ -40,3 +62,38 @@ def search():
             'success': False,
             'message': f'搜索失败: {str(e)}'
         })
+
+
+@search_bp.route('/search/suggest', methods=['GET'])
+def suggest():
+    """搜索框输入时的补全：按歌名、歌手名（以及拼音、拼音首字母）的前缀匹配，播放次数多的在前"""
+    prefix = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 20)
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的数量'})
+    if not prefix:
+        return jsonify({'success': True, 'suggestions': []})
+
+    try:
+        index = get_suggest_index()
+        if index is not None:
+            suggestions = index.suggest(prefix, limit)
+        else:
+            # 索引还在建立，暂时按歌名前缀查询数据库
+            songs = Music.query.filter(
+                Music.title.like(f'{escape_like(prefix)}%', escape=LIKE_ESCAPE)
+            ).order_by(Music.play_count.desc()).limit(limit).all()
+            suggestions = [('song', song.title, song.id) for song in songs]
+
+        return jsonify({
+            'success': True,
+            'suggestions': [
+                {'type': kind, 'text': text, 'id': song_id}
+                for kind, text, song_id in suggestions
+            ]
+        })
+
+    except Exception as e:
+        print(f"Error in suggest: {str(e)}")
+        return jsonify({'success': False, 'message': f'获取搜索建议失败: {str(e)}'})
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models import UserPreference
+from app.services.cache import invalidate_recommendations, record_recommendation_invalidations
+from app.services.precompute import discard_precomputed
+from app.services.preference_index import get_preference_index
 
 user_pref_bp = Blueprint('user_preferences', __name__)
 
@@ -33,7 +36,13 @@ def update_preferences():
         pref.favorite_artists = ','.join(favorite_artists) if favorite_artists else ''
         pref.listening_times = ','.join(listening_times) if listening_times else ''
 
+        # 偏好变化后预计算的推荐和其他进程中的推荐缓存都不再准确
+        discard_precomputed(userid)
+        record_recommendation_invalidations([userid])
         db.session.commit()
+        # 增量更新推荐用的偏好索引，并让该用户的推荐缓存失效
+        get_preference_index().update(pref)
+        invalidate_recommendations(userid)
         return jsonify({'success': True, 'message': '偏好设置已更新',
                         'data': {'favorite_genres': pref.favorite_genres, 'favorite_artists': pref.favorite_artists,
                                  'listening_times': pref.listening_times}})
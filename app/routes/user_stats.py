@@ -1,8 +1,10 @@
+import heapq
+import time
 from flask import Blueprint, request, jsonify
-from sqlalchemy import func
-from datetime import datetime, timedelta, UTC
-from app import db
-from app.models import UserPlayHistory, Music
+from datetime import timedelta
+from app.services.catalog import get_songs
+from app.services.play_rollup import recent_plays
+from app.services.taste_profiles import get_taste_features, get_taste_profiles
 
 user_stats_bp = Blueprint('user_stats', __name__)
 
@@ -14,57 +16,25 @@ def get_music_stats():
         return jsonify({'success': False, 'message': '未提供用户ID'})
 
     try:
-        # 获取最近30天的播放记录
-        thirty_days_ago = datetime.now(UTC) - timedelta(days=30)
-
-        # 1. 最常听的音乐类型统计
-        genre_stats = db.session.query(
-            Music.genre,
-            func.count(UserPlayHistory.id).label('play_count')
-        ).join(
-            UserPlayHistory, UserPlayHistory.music_id == Music.id
-        ).filter(
-            UserPlayHistory.userid == userid,
-            UserPlayHistory.played_at >= thirty_days_ago
-        ).group_by(
-            Music.genre
-        ).order_by(
-            func.count(UserPlayHistory.id).desc()
-        ).limit(5).all()
-
-        # 2. 最常听的艺术家统计
-        artist_stats = db.session.query(
-            Music.artist_name,
-            func.count(UserPlayHistory.id).label('play_count')
-        ).join(
-            UserPlayHistory, UserPlayHistory.music_id == Music.id
-        ).filter(
-            UserPlayHistory.userid == userid,
-            UserPlayHistory.played_at >= thirty_days_ago
-        ).group_by(
-            Music.artist_name
-        ).order_by(
-            func.count(UserPlayHistory.id).desc()
-        ).limit(5).all()
-
-        # 3. 总播放次数
-        total_plays = UserPlayHistory.query.filter(
-            UserPlayHistory.userid == userid,
-            UserPlayHistory.played_at >= thirty_days_ago
-        ).count()
+        # 从按时间衰减的口味画像读取（半衰期 TASTE_PROFILE_HALF_LIFE_DAYS 天，越近的播放权重越大），不再扫描播放记录
+        profiles = get_taste_profiles()
+        total_plays, genres, artists = profiles.get(userid).decayed(time.time(), profiles.half_life)
+        genre_stats = heapq.nlargest(5, genres.items(), key=lambda x: x[1])
+        artist_stats = heapq.nlargest(5, artists.items(), key=lambda x: x[1])
 
+        # 衰减后的次数不是整数，三项统一保留一位小数
         return jsonify({
             'success': True,
             'stats': {
                 'genre_stats': [
-                    {'genre': genre, 'count': int(count)}
+                    {'genre': genre, 'count': round(count, 1)}
                     for genre, count in genre_stats
                 ],
                 'artist_stats': [
-                    {'artist': artist, 'count': int(count)}
+                    {'artist': artist, 'count': round(count, 1)}
                     for artist, count in artist_stats
                 ],
-                'total_plays': total_plays
+                'total_plays': round(total_plays, 1)
             }
         })
 
@@ -76,6 +46,29 @@ def get_music_stats():
         })
 
 
+@user_stats_bp.route('/stats/taste', methods=['GET'])
+def get_taste():
+    """用户口味特征：衰减后的总播放量，以及各音乐类型、歌手所占的比例，供推荐等模块作为用户特征使用"""
+    userid = request.args.get('userid')
+    if not userid:
+        return jsonify({'success': False, 'message': '未提供用户ID'})
+
+    try:
+        features = get_taste_features(userid)
+        return jsonify({
+            'success': True,
+            'taste': {
+                'total': round(features['total'], 3),
+                'genres': {genre: round(share, 4) for genre, share in features['genres'].items()},
+                'artists': {artist: round(share, 4) for artist, share in features['artists'].items()}
+            }
+        })
+
+    except Exception as e:
+        print(f"Error in get_taste: {str(e)}")
+        return jsonify({'success': False, 'message': f'获取口味特征失败: {str(e)}'})
+
+
 @user_stats_bp.route('/stats/recent', methods=['GET'])
 def get_recent_stats():
     userid = request.args.get('userid')
@@ -83,18 +76,13 @@ def get_recent_stats():
         return jsonify({'success': False, 'message': '未提供用户ID'})
 
     try:
-        # 获取最近播放的10首歌
-        recent_plays = db.session.query(
-            Music.title,
-            Music.artist_name,
-            UserPlayHistory.played_at
-        ).join(
-            Music, Music.id == UserPlayHistory.music_id
-        ).filter(
-            UserPlayHistory.userid == userid
-        ).order_by(
-            UserPlayHistory.played_at.desc()
-        ).limit(10).all()
+        # 获取最近播放的10首歌（原始记录已归档时从每日统计补充）
+        plays = recent_plays(userid, 10)
+        songs = get_songs(music_id for music_id, _ in plays)
+        recent_plays_list = [
+            (songs[music_id].title, songs[music_id].artist_name, played_at)
+            for music_id, played_at in plays if music_id in songs
+        ]
 
         return jsonify({
             'success': True,
@@ -104,7 +92,7 @@ def get_recent_stats():
                     'artist': artist,
                     'played_at': (played_at+timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')
                 }
-                for title, artist, played_at in recent_plays
+                for title, artist, played_at in recent_plays_list
             ]
         })
 
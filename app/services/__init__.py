@@ -0,0 +1 @@
+# 推荐、索引、缓存等与具体路由无关的服务模块
@@ -0,0 +1,188 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from app.models import UserSongInteraction
+from app.services.model_store import write_artifact, get_artifact_store, id_lookup_arrays, find_row
+from app.services.recommender import UserSongMatrix
+
+ARTIFACT_KIND = 'mf'
+
+# 每次返回的推荐歌曲数，与首页展示的15首一致
+MF_RECOMMEND_COUNT = 15
+
+
+def load_implicit_feedback():
+    """隐式反馈强度 = 播放次数 + 评分，返回 UserSongMatrix"""
+    interactions = db.session.query(
+        UserSongInteraction.userid,
+        UserSongInteraction.music_id,
+        UserSongInteraction.play_count,
+        UserSongInteraction.rating
+    ).all()
+
+    strength = {}
+    for i in interactions:
+        value = i.play_count + (i.rating or 0)
+        if value > 0:
+            strength[(i.userid, i.music_id)] = value
+    return UserSongMatrix.from_scores(strength)
+
+
+class ImplicitALS:
+    """隐式反馈矩阵分解（Hu, Koren, Volinsky 2008 的交替最小二乘）
+
+    置信度 c = 1 + alpha × 反馈强度，偏好 p = 1（有交互）或 0。固定一侧因子时，另一侧每一行都是一个
+    factors×factors 的线性方程组，只有有交互的元素需要单独累加，其余部分共用 YᵀY。
+    各行互不依赖，按块分给线程池求解（numpy 的矩阵运算会释放 GIL）。
+    """
+
+    def __init__(self, factors=64, regularization=0.1, alpha=40.0, iterations=15, workers=4,
+                 block_size=2048, seed=0):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.workers = workers
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+        self.user_factors = None
+        self.item_factors = None
+
+    def _initial(self, rows, previous=None):
+        factors = self.rng.normal(scale=0.01, size=(rows, self.factors))
+        if previous is not None:
+            known = previous[0] >= 0
+            factors[known] = previous[1][previous[0][known]]
+        return factors
+
+    def _solve(self, matrix, fixed, out):
+        """固定 fixed，求解 matrix 每一行对应的因子，写入 out"""
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors)
+        indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+
+        def solve_block(start):
+            for row in range(start, min(start + self.block_size, matrix.shape[0])):
+                columns = indices[indptr[row]:indptr[row + 1]]
+                if len(columns) == 0:
+                    out[row] = 0
+                    continue
+                confidence = self.alpha * data[indptr[row]:indptr[row + 1]]
+                factors = fixed[columns]
+                a = gram + (factors.T * confidence) @ factors
+                b = factors.T @ (1 + confidence)
+                out[row] = np.linalg.solve(a, b)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(solve_block, range(0, matrix.shape[0], self.block_size)))
+
+    def fit(self, matrix, previous_users=None, previous_items=None, checkpoint=None, callback=None):
+        """matrix: 用户×歌曲 的反馈强度 CSR 矩阵
+
+        previous_users / previous_items：热启动用的 (旧行号数组, 旧因子矩阵)，旧行号为 -1 表示新出现的用户/歌曲。
+        checkpoint：每轮结束后保存因子的 .npz 路径；文件已存在且形状一致时从中断的那一轮继续。
+        """
+        matrix = matrix.tocsr()
+        matrix_t = matrix.T.tocsr()
+        self.user_factors = self._initial(matrix.shape[0], previous_users)
+        self.item_factors = self._initial(matrix.shape[1], previous_items)
+
+        start = 0
+        if checkpoint and os.path.exists(checkpoint):
+            saved = np.load(checkpoint)
+            if saved['user_factors'].shape == self.user_factors.shape and \
+                    saved['item_factors'].shape == self.item_factors.shape:
+                self.user_factors = saved['user_factors']
+                self.item_factors = saved['item_factors']
+                start = int(saved['iteration'])
+
+        for iteration in range(start, self.iterations):
+            self._solve(matrix, self.item_factors, self.user_factors)
+            self._solve(matrix_t, self.user_factors, self.item_factors)
+            if checkpoint:
+                temp = checkpoint + '.tmp.npz'
+                np.savez(temp, user_factors=self.user_factors, item_factors=self.item_factors,
+                         iteration=iteration + 1)
+                os.replace(temp, checkpoint)
+            if callback:
+                callback(iteration + 1)
+        return self
+
+
+def previous_factors(artifact, ids, name, factors_name):
+    """把上一版模型中的因子按ID对齐到新的行号，返回 (旧行号数组, 旧因子矩阵)"""
+    if artifact is None:
+        return None
+    old_index = {value: i for i, value in enumerate(artifact[f'{name}_ids'].tolist())}
+    rows = np.array([old_index.get(value, -1) for value in ids], dtype=np.int64)
+    return rows, np.asarray(artifact[factors_name], dtype=np.float64)
+
+
+def train_mf_artifact(app, interactions, model, warm_start=True, checkpoint=None, callback=None):
+    """训练并写出新版本的矩阵分解模型，返回版本号"""
+    previous_users = previous_items = None
+    if warm_start:
+        artifact = get_artifact_store(app, ARTIFACT_KIND).get()
+        previous_users = previous_factors(artifact, interactions.user_ids, 'user', 'user_factors')
+        previous_items = previous_factors(artifact, [str(s) for s in interactions.song_ids.tolist()],
+                                          'song', 'item_factors')
+
+    model.fit(interactions.matrix, previous_users, previous_items, checkpoint, callback)
+    arrays = {
+        'user_factors': model.user_factors.astype(np.float32),
+        'item_factors': model.item_factors.astype(np.float32),
+        'song_ids': interactions.song_ids,
+        **id_lookup_arrays([str(s) for s in interactions.song_ids.tolist()], 'song'),
+        **id_lookup_arrays(interactions.user_ids),
+        # 每个用户交互过的歌曲，推荐时排除
+        'seen_indptr': interactions.matrix.indptr.astype(np.int64),
+        'seen_indices': interactions.matrix.indices.astype(np.int32),
+    }
+    meta = {
+        'user_count': interactions.user_count,
+        'song_count': len(interactions.song_ids),
+        'factors': model.factors,
+        'regularization': model.regularization,
+        'alpha': model.alpha,
+        'iterations': model.iterations,
+    }
+    version = write_artifact(app.config['MODEL_DIR'], ARTIFACT_KIND, arrays, meta)
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return version
+
+
+class MFModel:
+    """矩阵分解模型的在线打分：用户因子与全部歌曲因子做一次矩阵向量乘"""
+
+    def __init__(self, artifact):
+        self.artifact = artifact
+
+    def recommend(self, userid, n=MF_RECOMMEND_COUNT):
+        """返回排序后的歌曲ID；用户不在模型中时返回 None"""
+        row = find_row(self.artifact, userid)
+        if row is None:
+            return None
+
+        scores = self.artifact['item_factors'] @ self.artifact['user_factors'][row]
+        # 跳过用户已经听过的歌
+        indptr = self.artifact['seen_indptr']
+        scores[self.artifact['seen_indices'][indptr[row]:indptr[row + 1]]] = -np.inf
+
+        n = min(n, int(np.isfinite(scores).sum()))
+        if n <= 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [int(song_id) for song_id in self.artifact['song_ids'][top]]
+
+
+def get_mf_model():
+    """当前版本的矩阵分解模型，还没有训练过时返回 None"""
+    artifact = get_artifact_store(current_app, ARTIFACT_KIND).get()
+    if artifact is None:
+        return None
+    return MFModel(artifact)
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class RandomProjectionLSH:
+    """用户向量的近似最近邻索引（随机超平面 LSH，近似余弦相似度）
+
+    每张哈希表用 n_bits 个随机超平面把向量映射成一个 n_bits 位的桶编号，余弦相似度越高的两个向量
+    落进同一个桶的概率越大。查询时取出各张表中同桶的用户作为候选，再由调用方精确计算相似度。
+
+    召回率和速度的调节参数：
+      n_tables 越多召回率越高，查询和内存开销线性增加；
+      n_bits   越多每个桶越小、查询越快，但召回率下降；
+      probes   每张表额外探查的相邻桶数（翻转最接近超平面的那几位），用较少的表换取召回率。
+    用户数增长后桶会变大，n_bits 大致随 log2(用户数) 增加；可用 python -m benchmarks.ann_recall 比较各组参数。
+    """
+
+    def __init__(self, n_tables=8, n_bits=8, probes=1, seed=0):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.probes = probes
+        self.rng = np.random.default_rng(seed)
+        # 每首歌（矩阵列）一行随机超平面分量，新歌曲出现时追加
+        self.planes = np.zeros((0, n_tables * n_bits))
+        self.bit_values = 1 << np.arange(n_bits, dtype=np.int64)
+        self.buckets = [{} for _ in range(n_tables)]
+        self.size = 0
+
+    def _ensure_planes(self, column_count):
+        if column_count > len(self.planes):
+            extra = self.rng.standard_normal((column_count - len(self.planes), self.planes.shape[1]))
+            self.planes = np.vstack([self.planes, extra])
+
+    def _project(self, vectors):
+        """vectors: CSR 矩阵（行是用户），返回 (行数, n_tables, n_bits) 的投影值"""
+        self._ensure_planes(vectors.shape[1])
+        projected = np.asarray(vectors @ self.planes[:vectors.shape[1]])
+        return projected.reshape(vectors.shape[0], self.n_tables, self.n_bits)
+
+    def _codes(self, projected):
+        return (projected > 0).astype(np.int64) @ self.bit_values
+
+    def build(self, vectors):
+        """用 CSR 矩阵的全部行建立索引，行号即用户编号"""
+        codes = self._codes(self._project(vectors))
+        self.buckets = []
+        for table in range(self.n_tables):
+            order = np.argsort(codes[:, table], kind='stable')
+            sorted_codes = codes[order, table]
+            keys, starts = np.unique(sorted_codes, return_index=True)
+            self.buckets.append(dict(zip(keys.tolist(), np.split(order, starts[1:]))))
+        self.size = vectors.shape[0]
+        return self
+
+    def insert(self, row, vector):
+        """增量加入一个用户，vector 为 1×歌曲数 的 CSR 行"""
+        codes = self._codes(self._project(vector))[0]
+        for table, code in enumerate(codes.tolist()):
+            bucket = self.buckets[table].get(code)
+            self.buckets[table][code] = np.append(bucket, row) if bucket is not None else np.array([row])
+        self.size = max(self.size, row + 1)
+
+    def query(self, vector):
+        """返回候选用户行号（已去重），vector 为 1×歌曲数 的 CSR 行"""
+        projected = self._project(vector)[0]
+        codes = self._codes(projected[None])[0]
+        found = []
+        for table, code in enumerate(codes.tolist()):
+            # 先查自己的桶，再按离超平面由近到远翻转一位探查相邻的桶
+            probe_codes = [code]
+            for bit in np.argsort(np.abs(projected[table]))[:self.probes].tolist():
+                probe_codes.append(code ^ (1 << bit))
+            for probe_code in probe_codes:
+                bucket = self.buckets[table].get(probe_code)
+                if bucket is not None:
+                    found.append(bucket)
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, UTC
+
+from flask import current_app
+from sqlalchemy import func, insert
+
+from app import db
+from app.models import RecommendationInvalidation
+
+
+class LRUCache:
+    """线程安全的有界 LRU 缓存，可选过期时间（秒），并统计命中、未命中、淘汰等次数"""
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (value, 过期时间戳或 None)
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, key):
+        """从缓存中删除一项，子类可以覆盖以维护自己的附加索引"""
+        return self.entries.pop(key, None)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.time() + ttl if ttl else None)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if self._remove(key) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+class RecommendationCache(LRUCache):
+    """推荐结果缓存，键为 (userid, mode)
+
+    用户自己的评分、播放、偏好变化时立即删除该用户的所有缓存；
+    作为别人的相似用户发生变化时，只把那些缓存的过期时间提前到 staleness 秒之后。
+    每个用户有一个代数，每次失效加一：计算前读取代数，put 时代数已经变了说明计算期间发生了失效，结果不放入缓存。
+    其他进程中的失效通过 recommendation_invalidations 表传过来，由 poll 定期读取。
+    """
+
+    def __init__(self, max_size=10000, ttl=600, staleness=60):
+        super().__init__(max_size, ttl)
+        self.staleness = staleness
+        self.user_keys = defaultdict(set)
+        # 相似用户 -> 用到了该用户的缓存键
+        self.neighbor_keys = defaultdict(set)
+        self.entry_neighbors = {}
+        self.generations = {}
+        # 已经处理过的最大失效记录ID，None 表示还没有读过
+        self.invalidation_id = None
+        self.polled_at = 0
+
+    def _remove(self, key):
+        entry = super()._remove(key)
+        self._discard(self.user_keys, key[0], key)
+        for neighbor in self.entry_neighbors.pop(key, ()):
+            self._discard(self.neighbor_keys, neighbor, key)
+        return entry
+
+    @staticmethod
+    def _discard(index, name, key):
+        keys = index.get(name)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[name]
+
+    def generation(self, userid):
+        with self.lock:
+            return self.generations.get(userid, 0)
+
+    def put(self, key, value, ttl=None, neighbors=(), generation=None):
+        """generation 为计算前 generation(userid) 的返回值，不为 None 且已经变化时不放入"""
+        with self.lock:
+            if generation is not None and self.generations.get(key[0], 0) != generation:
+                return
+            super().put(key, value, ttl)
+            if key in self.entries:
+                self.user_keys[key[0]].add(key)
+                self.entry_neighbors[key] = tuple(neighbors)
+                for neighbor in neighbors:
+                    self.neighbor_keys[neighbor].add(key)
+
+    def invalidate_user(self, userid):
+        with self.lock:
+            self.generations[userid] = self.generations.get(userid, 0) + 1
+            for key in list(self.user_keys.get(userid, ())):
+                self.invalidate(key)
+
+            deadline = time.time() + self.staleness
+            for key in self.neighbor_keys.get(userid, ()):
+                value, expires_at = self.entries[key]
+                if expires_at is None or expires_at > deadline:
+                    self.entries[key] = (value, deadline)
+
+    def poll(self, interval):
+        """距上次检查超过 interval 秒时，读入新的失效记录并使这些用户失效（包括本进程写入的，重复失效没有影响）"""
+        with self.lock:
+            if time.time() - self.polled_at < interval:
+                return
+            self.polled_at = time.time()
+            last_id = self.invalidation_id
+        if last_id is None:
+            # 第一次：缓存还是空的，之前的记录与本进程无关
+            self.invalidation_id = db.session.query(func.max(RecommendationInvalidation.id)).scalar() or 0
+            return
+        rows = db.session.query(RecommendationInvalidation.id, RecommendationInvalidation.userid) \
+            .filter(RecommendationInvalidation.id > last_id).all()
+        for userid in {userid for _, userid in rows}:
+            self.invalidate_user(userid)
+        if rows:
+            self.invalidation_id = max(row_id for row_id, _ in rows)
+
+
+_recommendation_cache = None
+_recommendation_cache_lock = threading.Lock()
+
+
+def get_recommendation_cache():
+    """进程内共享的推荐结果缓存，容量和时间按应用配置；每隔 RECOMMEND_INVALIDATION_POLL_INTERVAL 秒读入其他进程的失效记录"""
+    global _recommendation_cache
+    with _recommendation_cache_lock:
+        if _recommendation_cache is None:
+            _recommendation_cache = RecommendationCache(
+                current_app.config.get('RECOMMEND_CACHE_SIZE', 10000),
+                current_app.config.get('RECOMMEND_CACHE_TTL', 600),
+                current_app.config.get('RECOMMEND_NEIGHBOR_STALENESS', 60)
+            )
+        cache = _recommendation_cache
+    cache.poll(current_app.config.get('RECOMMEND_INVALIDATION_POLL_INTERVAL', 2))
+    return cache
+
+
+def record_recommendation_invalidations(userids):
+    """与评分、播放或偏好的修改在同一事务中调用，写入失效记录，让其他进程也删除这些用户的推荐缓存"""
+    now = datetime.now(UTC)
+    rows = [{'userid': userid, 'created_at': now} for userid in userids]
+    if rows:
+        db.session.execute(insert(RecommendationInvalidation), rows)
+
+
+def prune_recommendation_invalidations(max_age):
+    """删除超过 max_age 秒的失效记录（早已超过推荐缓存的过期时间），返回删除的行数"""
+    cutoff = datetime.now(UTC) - timedelta(seconds=max_age)
+    deleted = RecommendationInvalidation.query.filter(RecommendationInvalidation.created_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def invalidate_recommendations(userid):
+    """用户的评分、播放或偏好发生变化并提交后调用，删除本进程中的缓存"""
+    with _recommendation_cache_lock:
+        cache = _recommendation_cache
+    if cache is not None:
+        cache.invalidate_user(userid)
+
+
+_song_cache = None
+_song_cache_lock = threading.Lock()
+
+
+def get_song_cache():
+    """进程内共享的歌曲详情缓存（歌曲ID -> 接口返回的字典），容量和过期时间按 SONG_CACHE_SIZE、SONG_CACHE_TTL"""
+    global _song_cache
+    with _song_cache_lock:
+        if _song_cache is None:
+            _song_cache = LRUCache(current_app.config.get('SONG_CACHE_SIZE', 50000),
+                                   current_app.config.get('SONG_CACHE_TTL', 300))
+        return _song_cache
+
+
+def invalidate_songs(song_ids):
+    """歌曲信息或播放次数变化并提交后调用"""
+    with _song_cache_lock:
+        cache = _song_cache
+    if cache is not None:
+        for song_id in song_ids:
+            cache.invalidate(song_id)
+
+
+_username_cache = None
+_username_cache_lock = threading.Lock()
+
+
+def get_username_cache():
+    """进程内共享的用户名缓存（userid -> 用户名），只保存常用的作者，容量和过期时间按 USERNAME_CACHE_SIZE、USERNAME_CACHE_TTL"""
+    global _username_cache
+    with _username_cache_lock:
+        if _username_cache is None:
+            _username_cache = LRUCache(current_app.config.get('USERNAME_CACHE_SIZE', 10000),
+                                       current_app.config.get('USERNAME_CACHE_TTL', 600))
+        return _username_cache
+
+
+def invalidate_username(userid):
+    """修改用户名并提交后调用"""
+    with _username_cache_lock:
+        cache = _username_cache
+    if cache is not None:
+        cache.invalidate(userid)
@@ -0,0 +1,241 @@
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import or_, select
+
+from app import db
+from app.models import Music
+from app.services.cache import get_song_cache
+
+# 目录中保存的列（播放次数变化太频繁，不在其中）
+CATALOG_COLUMNS = (Music.id, Music.title, Music.artist_name, Music.genre, Music.cover_url)
+# 按修改时间读入修改时多往前读的秒数：updated_at 在提交之前就已确定，提交晚的修改不会被漏掉
+POLL_OVERLAP = 30
+
+
+class SongView:
+    """一首歌的只读视图，属性与 Music 相同，供各接口拼装返回数据"""
+
+    __slots__ = ('id', 'title', 'artist_name', 'genre', 'cover_url')
+
+    def __init__(self, id, title, artist_name, genre, cover_url):
+        self.id = id
+        self.title = title
+        self.artist_name = artist_name
+        self.genre = genre
+        self.cover_url = cover_url
+
+
+class _Dictionary:
+    """重复很多的字符串列（歌手、类型、封面）：每个不同的值只存一份（并 intern），每行只存一个编号"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        return code
+
+    def nbytes(self):
+        return sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values) \
+            + sys.getsizeof(self.codes)
+
+
+class CatalogStore:
+    """按列保存 music 表，按歌曲ID取一行是 O(1) 的数组下标
+
+    歌名按 UTF-8 拼成一整块 bytes 加偏移数组，歌手、类型、封面按字典编码；按ID定位的数组下标即行号，
+    100 万首歌约占 80MB（见 benchmarks/catalog_memory.py），同样的数据作为 ORM 对象约 1.2GB、作为行元组约 500MB。
+    建立之后新增或修改的歌曲放在 overlay 中，查找时优先；定期整体重建把它们并入数组。
+    其他进程新增或修改的歌曲由 poll 按ID和 updated_at 读入。
+    """
+
+    def __init__(self):
+        self.positions = np.zeros(0, dtype=np.int32)
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.titles = b''
+        self.title_offsets = np.zeros(1, dtype=np.int64)
+        self.artists = _Dictionary()
+        self.genres = _Dictionary()
+        self.covers = _Dictionary()
+        self.artist_codes = np.zeros(0, dtype=np.int32)
+        self.genre_codes = np.zeros(0, dtype=np.int32)
+        self.cover_codes = np.zeros(0, dtype=np.int32)
+        self.overlay = {}
+        self.max_id = 0
+        # 下次按修改时间读入的起点，None 表示只按ID读入新歌
+        self.changed_since = None
+        self.loaded_at = 0
+        self.polled_at = 0
+        self.lock = threading.Lock()
+
+    def build(self, rows):
+        """rows: [(歌曲ID, 歌名, 歌手, 类型, 封面)]"""
+        rows = list(rows)
+        titles = [(title or '').encode('utf-8') for _, title, _, _, _ in rows]
+        self.ids = np.fromiter((row[0] for row in rows), dtype=np.int32, count=len(rows))
+        self.max_id = int(self.ids.max()) if len(rows) else 0
+        self.positions = np.full(self.max_id + 1, -1, dtype=np.int32)
+        self.positions[self.ids] = np.arange(len(rows), dtype=np.int32)
+        self.titles = b''.join(titles)
+        self.title_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(title) for title in titles), dtype=np.int64, count=len(rows)),
+                  out=self.title_offsets[1:])
+        self.artist_codes = np.fromiter((self.artists.code(row[2]) for row in rows), dtype=np.int32, count=len(rows))
+        self.genre_codes = np.fromiter((self.genres.code(row[3]) for row in rows), dtype=np.int32, count=len(rows))
+        self.cover_codes = np.fromiter((self.covers.code(row[4]) for row in rows), dtype=np.int32, count=len(rows))
+        self.loaded_at = self.polled_at = time.time()
+        return self
+
+    def load(self):
+        started = datetime.now(UTC)
+        self.build(db.session.execute(select(*CATALOG_COLUMNS)).all())
+        self.changed_since = started - timedelta(seconds=POLL_OVERLAP)
+        return self
+
+    def put(self, rows):
+        """新增或修改的歌曲：rows 为 [(歌曲ID, 歌名, 歌手, 类型, 封面)]"""
+        with self.lock:
+            for row in rows:
+                self.overlay[row[0]] = SongView(*row)
+                self.max_id = max(self.max_id, row[0])
+
+    def get(self, song_id):
+        view = self.overlay.get(song_id)
+        if view is not None or not 0 <= song_id < len(self.positions):
+            return view
+        position = self.positions[song_id]
+        if position < 0:
+            return None
+        return SongView(
+            song_id,
+            self.titles[self.title_offsets[position]:self.title_offsets[position + 1]].decode('utf-8'),
+            self.artists.values[self.artist_codes[position]],
+            self.genres.values[self.genre_codes[position]],
+            self.covers.values[self.cover_codes[position]],
+        )
+
+    def poll(self, interval):
+        """距上次检查超过 interval 秒时，读入ID大于已知最大ID的新歌，以及上次检查以来修改过的歌曲（其他进程的修改）"""
+        with self.lock:
+            if time.time() - self.polled_at < interval:
+                return
+            self.polled_at = time.time()
+            max_id = self.max_id
+            since = self.changed_since
+            if since is not None:
+                self.changed_since = datetime.now(UTC) - timedelta(seconds=POLL_OVERLAP)
+        condition = Music.id > max_id if since is None else or_(Music.id > max_id, Music.updated_at >= since)
+        self.put(db.session.execute(select(*CATALOG_COLUMNS).where(condition)).all())
+
+    def nbytes(self):
+        arrays = (self.positions, self.ids, self.title_offsets, self.artist_codes, self.genre_codes, self.cover_codes)
+        return sum(array.nbytes for array in arrays) + len(self.titles) \
+            + self.artists.nbytes() + self.genres.nbytes() + self.covers.nbytes()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_rebuilding = False
+# 后台重建期间的修改，重建完成后补到新目录上
+_updates_during_rebuild = []
+
+
+def _rebuild(app):
+    global _catalog, _rebuilding
+    try:
+        with app.app_context():
+            catalog = CatalogStore().load()
+            db.session.remove()
+        with _catalog_lock:
+            catalog.put(_updates_during_rebuild)
+            _catalog = catalog
+    except Exception as e:
+        print(f"Error rebuilding catalog: {str(e)}")
+    finally:
+        with _catalog_lock:
+            _rebuilding = False
+            _updates_during_rebuild.clear()
+
+
+def get_catalog():
+    """进程内共享的歌曲目录，还没有建好时返回 None
+
+    首次使用或超过 CATALOG_MAX_AGE 秒后在后台线程建立；每隔 CATALOG_POLL_INTERVAL 秒读入其他进程新增和修改的歌曲。
+    """
+    global _rebuilding
+    config = current_app.config
+    with _catalog_lock:
+        catalog = _catalog
+        if (catalog is None or time.time() - catalog.loaded_at > config.get('CATALOG_MAX_AGE', 3600)) \
+                and not _rebuilding:
+            _rebuilding = True
+            threading.Thread(target=_rebuild, args=(current_app._get_current_object(),), daemon=True).start()
+    if catalog is not None:
+        catalog.poll(config.get('CATALOG_POLL_INTERVAL', 5))
+    return catalog
+
+
+def get_songs(song_ids):
+    """歌曲ID -> SongView，不存在的歌曲不在结果中；目录中没有的（还没建好或刚新增）从数据库读取"""
+    song_ids = set(song_ids)
+    catalog = get_catalog()
+    songs = {}
+    if catalog is not None:
+        for song_id in song_ids:
+            view = catalog.get(song_id)
+            if view is not None:
+                songs[song_id] = view
+    missing = song_ids - songs.keys()
+    if missing:
+        rows = db.session.execute(select(*CATALOG_COLUMNS).where(Music.id.in_(missing))).all()
+        if catalog is not None:
+            catalog.put(rows)
+        songs.update((row[0], SongView(*row)) for row in rows)
+    return songs
+
+
+def get_song_details(song_ids):
+    """歌曲ID -> 歌曲详情字典（含播放次数），先查缓存，未命中的在一次 IN 查询中读取并放入缓存"""
+    cache = get_song_cache()
+    details = {}
+    missing = []
+    for song_id in dict.fromkeys(song_ids):
+        detail = cache.get(song_id)
+        if detail is None:
+            missing.append(song_id)
+        else:
+            details[song_id] = detail
+    if missing:
+        rows = db.session.execute(select(*CATALOG_COLUMNS, Music.play_count).where(Music.id.in_(missing))).all()
+        for song_id, title, artist_name, genre, cover_url, play_count in rows:
+            detail = {
+                'id': song_id,
+                'title': title,
+                'artist_name': artist_name,
+                'genre': genre,
+                'play_count': play_count,
+                'cover_url': cover_url
+            }
+            cache.put(song_id, detail)
+            details[song_id] = detail
+    return details
+
+
+def catalog_song(music):
+    """新增或修改歌曲并提交后调用"""
+    row = (music.id, music.title, music.artist_name, music.genre, music.cover_url)
+    with _catalog_lock:
+        catalog = _catalog
+        if _rebuilding:
+            _updates_during_rebuild.append(row)
+    if catalog is not None:
+        catalog.put([row])
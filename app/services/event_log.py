@@ -0,0 +1,212 @@
+import atexit
+import mmap
+import os
+import threading
+import time
+from datetime import datetime, UTC
+
+import numpy as np
+from flask import current_app
+
+from app import db
+
+# 一条播放记录：段内用户编号、歌曲ID、播放时间（UTC 毫秒），定长 16 字节
+RECORD_DTYPE = np.dtype([('user', '<u4'), ('music_id', '<i4'), ('ts', '<i8')])
+SEGMENT_SUFFIX = '.seg'
+USERS_SUFFIX = '.users'
+
+
+class PlayEventLog:
+    """只追加的二进制播放日志，写入端
+
+    日志由若干段文件组成，每段预先分配 segment_records 条记录的空间并以内存映射方式写入，写满后换下一段。
+    段文件名为 <第一条记录的毫秒时间>-<进程号>.seg，每个进程只写自己的段，多个 worker 不会互相覆盖；
+    用户ID是字符串，段内按出现顺序编号，编号对应的用户ID按行写在同名的 .users 文件中。
+    写入只改内存映射的页，每攒够 fsync_batch 条或距上次同步超过 fsync_interval 秒才同步到磁盘一次：
+    先同步 .users 再同步段文件，记录引用的用户编号总是已经落盘。进程崩溃时已写入的记录仍在页缓存中，
+    只有机器掉电才会丢失最后一个同步周期内的记录。段内时间单调不减，读取时可以二分查找时间范围。
+    """
+
+    def __init__(self, log_dir, segment_records=1 << 20, fsync_interval=1.0, fsync_batch=1000):
+        self.log_dir = log_dir
+        self.segment_records = segment_records
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.lock = threading.Lock()
+        self.path = None
+        self.records = None
+        self.count = 0
+        self.last_ts = 0
+        self.unsynced = 0
+        self.synced_at = time.time()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _open_segment(self, ts):
+        name = f'{ts:013d}-{os.getpid()}'
+        self.path = os.path.join(self.log_dir, name + SEGMENT_SUFFIX)
+        with open(self.path, 'wb') as f:
+            f.truncate(self.segment_records * RECORD_DTYPE.itemsize)
+        self.file = open(self.path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.records = np.frombuffer(self.mmap, dtype=RECORD_DTYPE)
+        self.users_file = open(os.path.join(self.log_dir, name + USERS_SUFFIX), 'a', encoding='utf-8')
+        self.user_index = {}
+        self.count = 0
+
+    def _sync(self):
+        self.users_file.flush()
+        os.fsync(self.users_file.fileno())
+        self.mmap.flush()
+        self.unsynced = 0
+        self.synced_at = time.time()
+
+    def _close_segment(self):
+        """同步后把段文件截断到实际写入的长度"""
+        self._sync()
+        self.records = None
+        self.mmap.close()
+        self.file.truncate(self.count * RECORD_DTYPE.itemsize)
+        self.file.close()
+        self.users_file.close()
+        self.path = None
+
+    def append(self, userid, music_id, played_at):
+        ts = int(played_at.timestamp() * 1000)
+        with self.lock:
+            # 时钟回拨时沿用上一条的时间，保证段内有序
+            ts = max(ts, self.last_ts)
+            if self.path is None or self.count == self.segment_records:
+                if self.path is not None:
+                    self._close_segment()
+                self._open_segment(ts)
+
+            user = self.user_index.get(userid)
+            if user is None:
+                user = self.user_index[userid] = len(self.user_index)
+                self.users_file.write(userid + '\n')
+            # 时间最后写入：读取端以时间为 0 判断记录是否写完
+            self.records['user'][self.count] = user
+            self.records['music_id'][self.count] = music_id
+            self.records['ts'][self.count] = ts
+            self.count += 1
+            self.last_ts = ts
+
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_batch or time.time() - self.synced_at >= self.fsync_interval:
+                self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.path is not None:
+                self._close_segment()
+
+
+def list_segments(log_dir):
+    """按第一条记录的时间排序的段文件路径"""
+    if not os.path.isdir(log_dir):
+        return []
+    names = sorted(
+        (name for name in os.listdir(log_dir) if name.endswith(SEGMENT_SUFFIX)),
+        key=lambda name: (int(name.split('-')[0]), name)
+    )
+    return [os.path.join(log_dir, name) for name in names]
+
+
+def read_segment(path):
+    """返回 (记录数组, 用户ID列表)；记录数组是对段文件的只读内存映射，不复制数据
+
+    正在写入的段末尾是尚未使用的全零空间，只返回已写完、且用户编号已同步到 .users 的部分。
+    """
+    users_path = path[:-len(SEGMENT_SUFFIX)] + USERS_SUFFIX
+    with open(users_path, encoding='utf-8') as f:
+        userids = f.read().splitlines()
+    if os.path.getsize(path) < RECORD_DTYPE.itemsize:
+        return np.zeros(0, dtype=RECORD_DTYPE), userids
+
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+    ts = records['ts']
+    # 已写入的记录时间都大于0且排在前面，二分查找第一个空位
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if ts[middle] > 0:
+            low = middle + 1
+        else:
+            high = middle
+    records = records[:low]
+    # 崩溃时 .users 可能比段文件少同步几行，丢弃引用了未知用户的记录
+    if low and int(records['user'].max()) >= len(userids):
+        records = records[:int(np.argmax(records['user'] >= len(userids)))]
+    return records, userids
+
+
+def iter_segments(log_dir, since=None, until=None):
+    """按段依次返回时间在 [since, until) 内的 (记录数组, 用户ID列表)，记录数组是段文件映射的切片
+
+    since、until 为带时区的 datetime，None 表示不限。适合离线任务直接用 NumPy 统计，例如
+    np.bincount(records['music_id']) 即为每首歌的播放次数。
+    """
+    since_ms = int(since.timestamp() * 1000) if since else None
+    until_ms = int(until.timestamp() * 1000) if until else None
+    for path in list_segments(log_dir):
+        if until_ms is not None and int(os.path.basename(path).split('-')[0]) >= until_ms:
+            break
+        records, userids = read_segment(path)
+        ts = records['ts']
+        start = int(np.searchsorted(ts, since_ms)) if since_ms is not None else 0
+        end = int(np.searchsorted(ts, until_ms)) if until_ms is not None else len(records)
+        if start < end:
+            yield records[start:end], userids
+
+
+def iter_play_events(log_dir, since=None, until=None, batch_size=5000):
+    """把日志中的记录还原成 [(userid, music_id, played_at)]，每批最多 batch_size 条"""
+    for records, userids in iter_segments(log_dir, since, until):
+        for start in range(0, len(records), batch_size):
+            chunk = records[start:start + batch_size]
+            yield [
+                (userids[user], music_id, datetime.fromtimestamp(ts / 1000, UTC))
+                for user, music_id, ts in zip(chunk['user'].tolist(), chunk['music_id'].tolist(), chunk['ts'].tolist())
+            ]
+
+
+def replay_play_events(log_dir, apply, since=None, until=None, batch_size=5000, callback=None):
+    """把日志中 [since, until) 的播放按批交给 apply(events) 写入并提交，返回重放的记录数
+
+    apply 可以是写原始播放记录的函数，也可以是任何只更新某个汇总表的函数。重放不会去重，
+    区间应只覆盖数据库中缺失的那段时间（例如数据库故障期间）。
+    """
+    replayed = 0
+    for events in iter_play_events(log_dir, since, until, batch_size):
+        apply(events)
+        db.session.commit()
+        replayed += len(events)
+        if callback:
+            callback(replayed)
+    return replayed
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_play_event_log():
+    """进程内共享的日志写入端，首次使用时打开新的段，进程退出时截断并关闭"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            config = current_app.config
+            _log = PlayEventLog(
+                config['PLAY_LOG_DIR'],
+                config.get('PLAY_LOG_SEGMENT_RECORDS', 1 << 20),
+                config.get('PLAY_LOG_FSYNC_INTERVAL', 1.0),
+                config.get('PLAY_LOG_FSYNC_BATCH', 1000)
+            )
+            atexit.register(_log.close)
+        return _log
+
+
+def append_play_event(userid, music_id, played_at):
+    """PLAY_LOG_ENABLED 时把一次播放追加到日志"""
+    if current_app.config.get('PLAY_LOG_ENABLED', True):
+        get_play_event_log().append(userid, music_id, played_at)
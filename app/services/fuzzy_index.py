@@ -0,0 +1,281 @@
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from app.models import Music
+
+# 名字首尾的填充字符，使首尾的字也各出现在两个二元组中
+PAD_START = '\x02'
+PAD_END = '\x03'
+
+
+def normalize(text):
+    return ' '.join(unicodedata.normalize('NFKC', text or '').lower().split())
+
+
+def name_entries(text):
+    """一个歌名或歌手名参与模糊匹配的字符串：完整的名字，以及多个词时其中每个不少于3个字符的词"""
+    name = normalize(text)
+    if not name:
+        return []
+    entries = [name]
+    words = name.split(' ')
+    if len(words) > 1:
+        entries.extend(word for word in dict.fromkeys(words) if len(word) >= 3)
+    return entries
+
+
+def bigrams(text):
+    padded = PAD_START + text + PAD_END
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def max_distance(text, limit=2):
+    """允许的编辑距离随长度增加：不到3个字符必须完全一致，3-5个字符允许错1个，更长允许错 limit 个"""
+    if len(text) < 3:
+        return 0
+    if len(text) < 6:
+        return min(1, limit)
+    return limit
+
+
+def bounded_levenshtein(a, b, k):
+    """编辑距离不超过 k 时返回距离，否则返回 None；只计算对角线两侧 k 格以内，一行都超过 k 就提前结束"""
+    if abs(len(a) - len(b)) > k:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    big = k + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        low, high = max(1, i - k), min(len(b), i + k)
+        current = [big] * (len(b) + 1)
+        current[0] = i if i <= k else big
+        row_min = current[0]
+        char = a[i - 1]
+        for j in range(low, high + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != b[j - 1]))
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > k:
+            return None
+        previous = current
+    return previous[len(b)] if previous[len(b)] <= k else None
+
+
+class FuzzyIndex:
+    """歌名、歌手名的模糊匹配索引，容忍拼写错误
+
+    每个名字（以及名字中的词）切成带首尾填充的二元组，建立 二元组（取 hash 后排序）-> 名字编号 的倒排表，
+    布局与 SearchIndex 相同。编辑距离为 k 时，一处修改最多破坏两个二元组，所以匹配的名字至少与查询共有
+    （二元组数 - 2k）个二元组：候选名字只需从最少见的 2k+1 个二元组的倒排表中取，再按共有的二元组数和长度筛选，
+    最后对剩下的少数候选计算有上限的编辑距离，不需要和每一行比较。
+    新增或修改的歌曲放在小的增量部分中逐个比较，修改前的歌曲标记为删除；定期整体重建。
+    """
+
+    def __init__(self, max_candidates=1000):
+        self.max_candidates = max_candidates
+        self.hashes = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.entry_ids = np.zeros(0, dtype=np.int32)
+        # 名字：UTF-8 拼接成一块，偏移、字符数；以及每个名字对应的歌曲（CSR）
+        self.blob = b''
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.int32)
+        self.song_indptr = np.zeros(1, dtype=np.int64)
+        self.song_ids = np.zeros(0, dtype=np.int32)
+        self.play_counts = np.zeros(0, dtype=np.float64)
+        # 增量部分：名字 -> {歌曲ID}；以及主体中已失效的歌曲
+        self.delta = {}
+        self.delta_songs = {}
+        self.removed = set()
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def build(self, rows):
+        """rows: [(歌曲ID, 歌名, 歌手, 播放次数)]"""
+        names = {}
+        max_id = -1
+        play_counts = {}
+        for song_id, title, artist, play_count in rows:
+            max_id = max(max_id, song_id)
+            play_counts[song_id] = play_count or 0
+            for entry in dict.fromkeys(name_entries(title) + name_entries(artist)):
+                names.setdefault(entry, []).append(song_id)
+
+        hashes, entry_ids = [], []
+        blob, lengths, song_counts, song_ids = [], [], [], []
+        for entry_id, (name, songs) in enumerate(names.items()):
+            grams = bigrams(name)
+            hashes.extend(hash(gram) for gram in grams)
+            entry_ids.extend([entry_id] * len(grams))
+            blob.append(name.encode('utf-8'))
+            lengths.append(len(name))
+            song_counts.append(len(songs))
+            song_ids.extend(songs)
+
+        hashes = np.array(hashes, dtype=np.int64)
+        entry_ids = np.array(entry_ids, dtype=np.int32)
+        order = np.lexsort((entry_ids, hashes))
+        hashes = hashes[order]
+        unique, starts = np.unique(hashes, return_index=True)
+        self.hashes = unique
+        self.indptr = np.append(starts, len(hashes)).astype(np.int64)
+        self.entry_ids = entry_ids[order]
+
+        self.blob = b''.join(blob)
+        self.offsets = np.concatenate([[0], np.cumsum([len(name) for name in blob], dtype=np.int64)])
+        self.lengths = np.array(lengths, dtype=np.int32)
+        self.song_indptr = np.concatenate([[0], np.cumsum(song_counts, dtype=np.int64)])
+        self.song_ids = np.array(song_ids, dtype=np.int32)
+        self.play_counts = np.zeros(max_id + 1, dtype=np.float64)
+        for song_id, play_count in play_counts.items():
+            self.play_counts[song_id] = play_count
+        self.loaded_at = time.time()
+        return self
+
+    def load(self):
+        return self.build(db.session.query(Music.id, Music.title, Music.artist_name, Music.play_count).all())
+
+    def update(self, song_id, title, artist, play_count=0):
+        """新增或修改一首歌后调用"""
+        with self.lock:
+            self.removed.add(song_id)
+            old_names, _ = self.delta_songs.pop(song_id, ((), 0))
+            for name in old_names:
+                songs = self.delta[name]
+                songs.discard(song_id)
+                if not songs:
+                    del self.delta[name]
+            names = list(dict.fromkeys(name_entries(title) + name_entries(artist)))
+            for name in names:
+                self.delta.setdefault(name, set()).add(song_id)
+            self.delta_songs[song_id] = (names, play_count or 0)
+
+    def _name(self, entry_id):
+        return self.blob[self.offsets[entry_id]:self.offsets[entry_id + 1]].decode('utf-8')
+
+    def _postings(self, gram_hash):
+        position = int(np.searchsorted(self.hashes, gram_hash))
+        if position < len(self.hashes) and self.hashes[position] == gram_hash:
+            return self.entry_ids[self.indptr[position]:self.indptr[position + 1]]
+        return self.entry_ids[:0]
+
+    def _candidates(self, query, k):
+        """共有的二元组数不少于 (二元组数 - 2k)、长度相差不超过 k 的名字编号，共有的二元组多的在前"""
+        postings = sorted((self._postings(hash(gram)) for gram in bigrams(query)), key=len)
+        threshold = max(len(postings) - 2 * k, 1)
+        # 少于 threshold 个共有二元组的名字，不可能出现在最少见的 (len - threshold + 1) 个倒排表中的任何一个
+        prefix = postings[:len(postings) - threshold + 1]
+        candidates = np.unique(np.concatenate(prefix)) if prefix else self.entry_ids[:0]
+        if not len(candidates):
+            return candidates
+        candidates = candidates[np.abs(self.lengths[candidates] - len(query)) <= k]
+        shared = np.zeros(len(candidates), dtype=np.int32)
+        for entries in postings:
+            position = np.minimum(np.searchsorted(entries, candidates), max(len(entries) - 1, 0))
+            if len(entries):
+                shared += entries[position] == candidates
+        keep = shared >= threshold
+        candidates, shared = candidates[keep], shared[keep]
+        if len(candidates) > self.max_candidates:
+            top = np.argpartition(-shared, self.max_candidates - 1)[:self.max_candidates]
+            candidates, shared = candidates[top], shared[top]
+        return candidates[np.argsort(-shared, kind='stable')]
+
+    def search(self, query, limit=1000, distance_limit=2, order='relevance'):
+        """返回 ([歌曲ID] 按编辑距离从小到大、距离相同时按播放次数从高到低、最多 limit 个, 命中总数)；
+        查询为空时返回 None。order 为 popularity 时先按播放次数、再按编辑距离排序后截取"""
+        query = normalize(query)
+        if not query:
+            return None
+        k = max_distance(query, distance_limit)
+
+        with self.lock:
+            # 主体中匹配的名字：每个名字的歌曲按名字的编辑距离一起取出，用数组合并
+            songs, distances = [self.song_ids[:0]], [np.zeros(0, dtype=np.int32)]
+            for entry_id in self._candidates(query, k).tolist():
+                distance = bounded_levenshtein(query, self._name(entry_id), k)
+                if distance is not None:
+                    entry_songs = self.song_ids[self.song_indptr[entry_id]:self.song_indptr[entry_id + 1]]
+                    songs.append(entry_songs)
+                    distances.append(np.full(len(entry_songs), distance, dtype=np.int32))
+            songs, distances = np.concatenate(songs), np.concatenate(distances)
+            weights = self.play_counts[songs]
+            if self.removed:
+                keep = ~np.isin(songs, np.fromiter(self.removed, dtype=np.int32, count=len(self.removed)))
+                songs, distances, weights = songs[keep], distances[keep], weights[keep]
+            # 增量部分的名字很少，逐个比较
+            delta = [
+                (song_id, distance, self.delta_songs[song_id][1])
+                for name, name_songs in self.delta.items()
+                for distance in [bounded_levenshtein(query, name, k)] if distance is not None
+                for song_id in name_songs
+            ]
+        if delta:
+            songs = np.concatenate([songs, np.array([d[0] for d in delta], dtype=np.int32)])
+            distances = np.concatenate([distances, np.array([d[1] for d in delta], dtype=np.int32)])
+            weights = np.concatenate([weights, np.array([d[2] for d in delta], dtype=np.float64)])
+
+        # 同一首歌可能匹配多个名字，取距离最小的一个；再按 (距离, -播放次数, 歌曲ID) 或 (-播放次数, 距离, 歌曲ID) 排序
+        by_song = np.lexsort((distances, songs))
+        songs, distances, weights = songs[by_song], distances[by_song], weights[by_song]
+        first = np.ones(len(songs), dtype=bool)
+        first[1:] = songs[1:] != songs[:-1]
+        songs, distances, weights = songs[first], distances[first], weights[first]
+        total = len(songs)
+        keys = (songs, distances, -weights) if order == 'popularity' else (songs, -weights, distances)
+        top = np.lexsort(keys)[:limit]
+        return songs[top].tolist(), total
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+# 后台重建期间的修改，重建完成后补到新索引上
+_updates_during_rebuild = []
+
+
+def _rebuild(app):
+    global _index, _rebuilding
+    try:
+        with app.app_context():
+            index = FuzzyIndex(app.config.get('SEARCH_FUZZY_MAX_CANDIDATES', 1000)).load()
+            db.session.remove()
+        with _index_lock:
+            for update in _updates_during_rebuild:
+                index.update(*update)
+            _index = index
+    except Exception as e:
+        print(f"Error rebuilding fuzzy index: {str(e)}")
+    finally:
+        with _index_lock:
+            _rebuilding = False
+            _updates_during_rebuild.clear()
+
+
+def get_fuzzy_index():
+    """进程内共享的模糊匹配索引，还没有建好时返回 None；首次使用或超过 SEARCH_INDEX_MAX_AGE 秒后在后台线程建立"""
+    global _rebuilding
+    max_age = current_app.config.get('SEARCH_INDEX_MAX_AGE', 3600)
+    with _index_lock:
+        if (_index is None or time.time() - _index.loaded_at > max_age) and not _rebuilding:
+            _rebuilding = True
+            threading.Thread(target=_rebuild, args=(current_app._get_current_object(),), daemon=True).start()
+        return _index
+
+
+def fuzzy_index_song(music):
+    """新增或修改歌曲并提交后调用；索引还没有建立时不做任何事（建立时会从数据库读到）"""
+    update = (music.id, music.title, music.artist_name, music.play_count)
+    with _index_lock:
+        index = _index
+        if _rebuilding:
+            _updates_during_rebuild.append(update)
+    if index is not None:
+        index.update(*update)
@@ -0,0 +1,262 @@
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import bindparam, case, func, insert, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import DailySongPlay, DailyUserSongPlay, Music, Rating, SongPlayBucket, UserPlayHistory, UserSongInteraction
+
+# 重建汇总表时每批写入的行数
+BATCH_SIZE = 5000
+
+
+def _upsert(model, keys, changes, initial):
+    """先尝试 UPDATE，没有这一行时再 INSERT；与调用方的播放/评分写入在同一个事务中提交"""
+    query = model.query.filter_by(**keys)
+    if query.update(changes, synchronize_session=False):
+        return
+    try:
+        # 用保存点插入，并发请求抢先插入同一行时只回滚这一步，再改为 UPDATE
+        with db.session.begin_nested():
+            db.session.add(model(**keys, **initial))
+    except IntegrityError:
+        query.update(changes, synchronize_session=False)
+
+
+def record_play_interaction(userid, music_id, played_at):
+    """播放次数加一并更新最近播放时间"""
+    _upsert(UserSongInteraction, {'userid': userid, 'music_id': music_id},
+            {'play_count': UserSongInteraction.play_count + 1, 'last_played': played_at},
+            {'play_count': 1, 'last_played': played_at})
+
+
+def record_rating_interaction(userid, music_id, rating_value):
+    _upsert(UserSongInteraction, {'userid': userid, 'music_id': music_id},
+            {'rating': rating_value}, {'play_count': 0, 'rating': rating_value})
+
+
+def play_bucket(played_at):
+    """播放时间所在的小时编号（自1970年起的小时数）；数据库读出的不带时区的时间按 UTC 处理"""
+    if played_at.tzinfo is None:
+        played_at = played_at.replace(tzinfo=UTC)
+    return int(played_at.timestamp() // 3600)
+
+
+def record_song_play_bucket(music_id, played_at):
+    """歌曲在这一小时内的播放次数加一，日榜、周榜由这些小时计数汇总"""
+    bucket = play_bucket(played_at)
+    _upsert(SongPlayBucket, {'music_id': music_id, 'bucket': bucket},
+            {'play_count': SongPlayBucket.play_count + 1}, {'play_count': 1})
+
+
+def apply_play_batch(events):
+    """把一批播放事件 [(userid, music_id, played_at)] 写入数据库（不提交），返回实际写入的事件
+
+    播放记录用一条批量 INSERT 写入；music.play_count 按歌曲汇总后用一条 UPDATE 累加；
+    交互汇总表和小时播放计数先查出已有的行，已有的批量 UPDATE，没有的批量 INSERT。
+    不存在的歌曲的事件被丢弃。
+    """
+    song_ids = {music_id for _, music_id, _ in events}
+    known = {row.id for row in db.session.query(Music.id).filter(Music.id.in_(song_ids))}
+    events = [event for event in events if event[1] in known]
+    if not events:
+        return []
+
+    db.session.execute(insert(UserPlayHistory), [
+        {'userid': userid, 'music_id': music_id, 'played_at': played_at}
+        for userid, music_id, played_at in events
+    ])
+
+    increments = Counter(music_id for _, music_id, _ in events)
+    db.session.execute(
+        update(Music).where(Music.id.in_(increments)).values(
+            play_count=func.coalesce(Music.play_count, 0) + case(increments, value=Music.id, else_=0)
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+    pairs = {}
+    buckets = Counter()
+    for userid, music_id, played_at in events:
+        count, last_played = pairs.get((userid, music_id), (0, played_at))
+        pairs[(userid, music_id)] = (count + 1, max(last_played, played_at))
+        buckets[(music_id, play_bucket(played_at))] += 1
+
+    interactions = UserSongInteraction.__table__
+    existing = {
+        (row.userid, row.music_id)
+        for row in db.session.query(UserSongInteraction.userid, UserSongInteraction.music_id).filter(
+            UserSongInteraction.userid.in_({userid for userid, _ in pairs}),
+            UserSongInteraction.music_id.in_(known)
+        )
+    }
+    _update_or_insert(
+        interactions, pairs, existing,
+        interactions.update().where(
+            interactions.c.userid == bindparam('key_userid'),
+            interactions.c.music_id == bindparam('key_music_id')
+        ).values(
+            play_count=interactions.c.play_count + bindparam('count'),
+            last_played=case(
+                (interactions.c.last_played.is_(None), bindparam('played_at')),
+                (interactions.c.last_played < bindparam('played_at'), bindparam('played_at')),
+                else_=interactions.c.last_played
+            )
+        ),
+        lambda key, value: {'key_userid': key[0], 'key_music_id': key[1], 'count': value[0], 'played_at': value[1]},
+        lambda key, value: {'userid': key[0], 'music_id': key[1], 'play_count': value[0], 'last_played': value[1]}
+    )
+
+    play_buckets = SongPlayBucket.__table__
+    existing = {
+        (row.music_id, row.bucket)
+        for row in db.session.query(SongPlayBucket.music_id, SongPlayBucket.bucket).filter(
+            SongPlayBucket.music_id.in_(known),
+            SongPlayBucket.bucket.in_({bucket for _, bucket in buckets})
+        )
+    }
+    _update_or_insert(
+        play_buckets, buckets, existing,
+        play_buckets.update().where(
+            play_buckets.c.music_id == bindparam('key_music_id'),
+            play_buckets.c.bucket == bindparam('key_bucket')
+        ).values(play_count=play_buckets.c.play_count + bindparam('count')),
+        lambda key, value: {'key_music_id': key[0], 'key_bucket': key[1], 'count': value},
+        lambda key, value: {'music_id': key[0], 'bucket': key[1], 'play_count': value}
+    )
+    return events
+
+
+def insert_play_history(events):
+    """只把播放事件 [(userid, music_id, played_at)] 写入原始播放记录（不提交），不更新任何计数"""
+    db.session.execute(insert(UserPlayHistory), [
+        {'userid': userid, 'music_id': music_id, 'played_at': played_at}
+        for userid, music_id, played_at in events
+    ])
+    return events
+
+
+def _update_or_insert(table, values, existing, update_statement, update_params, insert_params):
+    """已有的行用一条语句批量 UPDATE（executemany），其余的批量 INSERT"""
+    updates = [update_params(key, value) for key, value in values.items() if key in existing]
+    inserts = [insert_params(key, value) for key, value in values.items() if key not in existing]
+    if updates:
+        db.session.execute(update_statement, updates)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def play_counts_since(since):
+    """since 以来每首歌的播放次数，返回列为 music_id、play_count 的子查询
+
+    已汇总的部分读每日统计（按天对齐，包含 since 当天的全部播放），其余读原始播放记录。
+    """
+    rollups = select(DailySongPlay.music_id, DailySongPlay.play_count).where(
+        DailySongPlay.day >= since.date()
+    )
+    raw = select(UserPlayHistory.music_id, func.count(UserPlayHistory.id)).where(
+        UserPlayHistory.played_at >= since
+    ).group_by(UserPlayHistory.music_id)
+    plays = union_all(rollups, raw).subquery()
+    music_id, play_count = plays.c
+    return select(
+        music_id.label('music_id'),
+        func.sum(play_count).label('play_count')
+    ).group_by(music_id).subquery()
+
+
+def aggregate_raw_interactions():
+    """从原始播放记录、已归档部分的每日统计和评分表汇总，返回 {(userid, music_id): (播放次数, 最近播放时间, 评分)}"""
+    play_history = db.session.query(
+        UserPlayHistory.userid,
+        UserPlayHistory.music_id,
+        func.count(UserPlayHistory.id),
+        func.max(UserPlayHistory.played_at)
+    ).group_by(
+        UserPlayHistory.userid,
+        UserPlayHistory.music_id
+    ).all()
+    daily_plays = db.session.query(
+        DailyUserSongPlay.userid,
+        DailyUserSongPlay.music_id,
+        func.sum(DailyUserSongPlay.play_count),
+        func.max(DailyUserSongPlay.last_played)
+    ).group_by(
+        DailyUserSongPlay.userid,
+        DailyUserSongPlay.music_id
+    ).all()
+    ratings = db.session.query(
+        Rating.userid,
+        Rating.music_id,
+        Rating.rating_value
+    ).all()
+
+    aggregate = {}
+    for userid, music_id, play_count, last_played in daily_plays + play_history:
+        previous_count, previous_played, _ = aggregate.get((userid, music_id), (0, None, None))
+        if previous_played is not None and (last_played is None or previous_played > last_played):
+            last_played = previous_played
+        aggregate[(userid, music_id)] = (previous_count + int(play_count), last_played, None)
+    for userid, music_id, rating_value in ratings:
+        play_count, last_played, _ = aggregate.get((userid, music_id), (0, None, None))
+        aggregate[(userid, music_id)] = (play_count, last_played, rating_value)
+    return aggregate
+
+
+def reconcile_interactions(dry_run=False):
+    """让汇总表与原始记录一致：只插入缺少的行、修正不一致的行、删除多余的行
+
+    返回 {'inserted': ..., 'updated': ..., 'deleted': ...}；dry_run 时只统计不写入。
+    """
+    expected = aggregate_raw_interactions()
+    current = {
+        (row.userid, row.music_id): (row.play_count, row.last_played, row.rating)
+        for row in db.session.query(
+            UserSongInteraction.userid,
+            UserSongInteraction.music_id,
+            UserSongInteraction.play_count,
+            UserSongInteraction.last_played,
+            UserSongInteraction.rating
+        )
+    }
+
+    missing = [key for key in expected if key not in current]
+    changed = [key for key in expected if key in current and current[key] != expected[key]]
+    extra = [key for key in current if key not in expected]
+    result = {'inserted': len(missing), 'updated': len(changed), 'deleted': len(extra)}
+    if dry_run:
+        return result
+
+    for key in changed + extra:
+        UserSongInteraction.query.filter_by(userid=key[0], music_id=key[1]).delete(synchronize_session=False)
+    rows = [
+        {'userid': key[0], 'music_id': key[1], 'play_count': expected[key][0],
+         'last_played': expected[key][1], 'rating': expected[key][2]}
+        for key in missing + changed
+    ]
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(UserSongInteraction), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+    return result
+
+
+def rebuild_play_buckets(hours=7 * 24):
+    """从最近 hours 小时的原始播放记录重建每首歌每小时的播放次数，返回写入的行数"""
+    since = datetime.now(UTC) - timedelta(hours=hours)
+    counts = Counter(
+        (row.music_id, play_bucket(row.played_at))
+        for row in db.session.query(
+            UserPlayHistory.music_id,
+            UserPlayHistory.played_at
+        ).filter(
+            UserPlayHistory.played_at >= since
+        )
+    )
+    SongPlayBucket.query.delete(synchronize_session=False)
+    rows = [{'music_id': music_id, 'bucket': bucket, 'play_count': count}
+            for (music_id, bucket), count in counts.items()]
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(SongPlayBucket), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from flask import current_app
+from scipy import sparse
+
+from app import db
+from app.models import Rating
+from app.services.play_rollup import recent_plays
+from app.services.recommender import UserSongMatrix
+
+# 每首歌保存的相似歌曲数
+ITEM_NEIGHBOR_COUNT = 20
+# 作为推荐种子的最近播放记录数，以及“高分”的评分下限
+RECENT_PLAY_COUNT = 50
+HIGH_RATING = 4
+
+
+class ItemNeighborTable:
+    """歌曲 -> 前 K 首相似歌曲的表
+
+    两首歌的相似度为共现余弦：同时听过/评过两首歌的用户数 / sqrt(两首歌各自的用户数)。
+    共现次数保存为构建时的 CSR 矩阵加上之后的增量（delta），新增交互只更新相关的行，
+    并把受影响的歌曲标记为脏，查询时才重新计算它们的前 K 个邻居，避免整体重建。
+    """
+
+    def __init__(self, k=ITEM_NEIGHBOR_COUNT, compact_threshold=100000):
+        self.k = k
+        self.compact_threshold = compact_threshold
+        self.song_ids = np.zeros(0, dtype=np.int64)
+        self.song_index = {}
+        self.base = None
+        self.delta = defaultdict(Counter)
+        self.delta_size = 0
+        self.song_counts = Counter()
+        self.user_songs = defaultdict(set)
+        self.neighbors = {}
+        self.dirty = set()
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_matrix(cls, interactions, k=ITEM_NEIGHBOR_COUNT):
+        table = cls(k)
+        table._build(interactions)
+        return table
+
+    def _build(self, interactions):
+        indicator = interactions.indicator
+        self.song_ids = interactions.song_ids
+        self.song_index = interactions.song_index
+        self.base = (indicator.T @ indicator).tocsr()
+        self.base.setdiag(0)
+        self.base.eliminate_zeros()
+
+        counts = np.asarray(indicator.sum(axis=0)).ravel()
+        self.song_counts = Counter({int(song_id): int(c) for song_id, c in zip(self.song_ids, counts)})
+        self.user_songs = defaultdict(set)
+        for userid, u in interactions.user_index.items():
+            row = indicator.indices[indicator.indptr[u]:indicator.indptr[u + 1]]
+            self.user_songs[userid] = set(self.song_ids[row].tolist())
+
+        self.delta = defaultdict(Counter)
+        self.delta_size = 0
+        self.neighbors = {}
+        for song_id in self.song_ids.tolist():
+            self.neighbors[song_id] = self._top_k(song_id)
+        self.dirty = set()
+        self.loaded_at = time.time()
+
+    def _cooccurrence(self, song_id):
+        """song_id 与其他歌曲的共现次数 {song_id: 次数}"""
+        row = Counter()
+        j = self.song_index.get(song_id)
+        if j is not None:
+            start, end = self.base.indptr[j], self.base.indptr[j + 1]
+            row.update(dict(zip(self.song_ids[self.base.indices[start:end]].tolist(),
+                                self.base.data[start:end].tolist())))
+        row.update(self.delta.get(song_id, {}))
+        return row
+
+    def _top_k(self, song_id):
+        row = self._cooccurrence(song_id)
+        if not row:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        others = np.fromiter(row.keys(), dtype=np.int64, count=len(row))
+        counts = np.fromiter(row.values(), dtype=np.float64, count=len(row))
+        other_counts = np.fromiter((self.song_counts[o] for o in others.tolist()), dtype=np.float64,
+                                   count=len(others))
+        similarities = counts / np.sqrt(max(self.song_counts[song_id], 1) * np.maximum(other_counts, 1))
+
+        k = min(self.k, len(others))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        return others[top], similarities[top]
+
+    def add_interaction(self, userid, song_id):
+        """用户第一次播放或评价某首歌时调用，增量更新共现次数"""
+        with self.lock:
+            songs = self.user_songs[userid]
+            if song_id in songs:
+                return
+            for other in songs:
+                self.delta[song_id][other] += 1
+                self.delta[other][song_id] += 1
+            self.delta_size += 2 * len(songs)
+            self.song_counts[song_id] += 1
+            # 只重新计算直接受影响的歌曲；其他歌曲中与 song_id 的相似度在下次重算时更新
+            self.dirty.add(song_id)
+            self.dirty.update(songs)
+            songs.add(song_id)
+
+            if self.delta_size > self.compact_threshold:
+                self._compact()
+
+    def _compact(self):
+        """把增量合并进 CSR 矩阵（新歌曲追加在末尾）"""
+        new_songs = [s for s in self.delta if s not in self.song_index]
+        song_ids = np.concatenate([self.song_ids, np.array(new_songs, dtype=np.int64)])
+        song_index = dict(self.song_index)
+        for song_id in new_songs:
+            song_index[song_id] = len(song_index)
+
+        rows, cols, data = [], [], []
+        for song_id, others in self.delta.items():
+            for other, count in others.items():
+                rows.append(song_index[song_id])
+                cols.append(song_index[other])
+                data.append(count)
+        delta = sparse.csr_matrix((data, (rows, cols)), shape=(len(song_ids), len(song_ids)))
+        base = self.base.copy()
+        base.resize((len(song_ids), len(song_ids)))
+        self.base = (base + delta).tocsr()
+        self.song_ids, self.song_index = song_ids, song_index
+        self.delta = defaultdict(Counter)
+        self.delta_size = 0
+
+    def similar_songs(self, song_id):
+        """返回 (相似歌曲ID数组, 相似度数组)"""
+        with self.lock:
+            if song_id in self.dirty or song_id not in self.neighbors:
+                self.neighbors[song_id] = self._top_k(song_id)
+                self.dirty.discard(song_id)
+            return self.neighbors[song_id]
+
+    def recommend(self, userid, seeds):
+        """seeds: {种子歌曲ID: 权重}，按 相似度×权重 汇总种子歌曲的相似歌曲，返回排序后的歌曲ID"""
+        scores = Counter()
+        for seed, weight in seeds.items():
+            others, similarities = self.similar_songs(seed)
+            for other, similarity in zip(others.tolist(), similarities.tolist()):
+                scores[other] += similarity * weight
+
+        # 跳过用户已经听过的歌
+        with self.lock:
+            heard = set(self.user_songs.get(userid, ()))
+        heard.update(seeds)
+        ranked = sorted((item for item in scores.items() if item[0] not in heard),
+                        key=lambda x: x[1], reverse=True)
+        return [song_id for song_id, _ in ranked]
+
+
+def load_seed_songs(userid):
+    """用户最近播放的歌曲和打了高分的歌曲，返回 {歌曲ID: 权重}"""
+    seeds = Counter()
+    for music_id, _ in recent_plays(userid, RECENT_PLAY_COUNT):
+        # 与用户-歌曲矩阵一致，播放次数映射到1-5分
+        seeds[music_id] = min(5, seeds[music_id] + 1)
+
+    high_ratings = db.session.query(
+        Rating.music_id,
+        Rating.rating_value
+    ).filter(
+        Rating.userid == userid,
+        Rating.rating_value >= HIGH_RATING
+    ).all()
+    for rating in high_ratings:
+        seeds[rating.music_id] = rating.rating_value
+    return seeds
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_item_neighbor_table():
+    """进程内共享的相似歌曲表，首次使用或超过 ITEM_CF_MAX_AGE 秒后从数据库重建"""
+    global _table
+    max_age = current_app.config.get('ITEM_CF_MAX_AGE', 3600)
+    with _table_lock:
+        if _table is None or time.time() - _table.loaded_at > max_age:
+            _table = ItemNeighborTable.from_matrix(UserSongMatrix.from_db())
+        return _table
+
+
+def record_item_interaction(userid, song_id):
+    """播放或评分后增量更新相似歌曲表；表还没有建立时不做任何事（建立时会从数据库读到这条记录）"""
+    with _table_lock:
+        table = _table
+    if table is not None:
+        table.add_interaction(userid, song_id)
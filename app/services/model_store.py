@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, UTC
+
+import numpy as np
+
+# 每类模型保留的历史版本数，便于回滚
+KEEP_VERSIONS = 3
+
+
+class Artifact:
+    """磁盘上一个版本的模型：若干 .npy 数组（以内存映射方式打开）加 meta.json
+
+    多个 worker 进程映射同一组文件时共享操作系统的页缓存，物理内存中只有一份数据。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = os.path.basename(path)
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.arrays = {}
+        for filename in os.listdir(path):
+            name, ext = os.path.splitext(filename)
+            if ext == '.npy':
+                self.arrays[name] = np.load(os.path.join(path, filename), mmap_mode='r')
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+
+def id_lookup_arrays(ids, name='user'):
+    """字符串ID数组及其排好序的副本，写入模型后可用 find_row 二分查找行号，不需要在每个进程里建字典"""
+    ids = np.array(ids, dtype=str)
+    order = np.argsort(ids, kind='stable').astype(np.int32)
+    return {f'{name}_ids': ids, f'{name}_ids_sorted': ids[order], f'{name}_sort': order}
+
+
+def find_row(artifact, value, name='user'):
+    """在 id_lookup_arrays 写入的数组中查找 value 对应的行号，找不到返回 None"""
+    sorted_ids = artifact[f'{name}_ids_sorted']
+    position = int(np.searchsorted(sorted_ids, value))
+    if position < len(sorted_ids) and sorted_ids[position] == value:
+        return int(artifact[f'{name}_sort'][position])
+    return None
+
+
+def write_artifact(root, kind, arrays, meta=None):
+    """把数组写成新版本目录，写完后原子地切换 CURRENT 指针，返回版本号
+
+    目录结构：<root>/<kind>/<version>/*.npy、meta.json，以及 <root>/<kind>/CURRENT
+    """
+    kind_dir = os.path.join(root, kind)
+    os.makedirs(kind_dir, exist_ok=True)
+    version = datetime.now(UTC).strftime('%Y%m%d%H%M%S%f')
+
+    # 先写到临时目录，完整写完后再改名，读者不会看到写了一半的版本
+    temp_dir = os.path.join(kind_dir, f'.{version}.tmp')
+    os.makedirs(temp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_dir, f'{name}.npy'), np.ascontiguousarray(array))
+    meta = dict(meta or {}, kind=kind, version=version, created_at=datetime.now(UTC).isoformat())
+    with open(os.path.join(temp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.rename(temp_dir, os.path.join(kind_dir, version))
+
+    pointer = os.path.join(kind_dir, 'CURRENT')
+    with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + '.tmp', pointer)
+
+    _remove_old_versions(kind_dir, version)
+    return version
+
+
+def _remove_old_versions(kind_dir, current):
+    versions = sorted(name for name in os.listdir(kind_dir)
+                      if not name.startswith('.') and os.path.isdir(os.path.join(kind_dir, name)))
+    for name in versions[:-KEEP_VERSIONS]:
+        if name != current:
+            # Windows 下仍被映射的文件删不掉，留到下次再删
+            shutil.rmtree(os.path.join(kind_dir, name), ignore_errors=True)
+
+
+class ArtifactStore:
+    """读取某类模型的当前版本，CURRENT 变化后自动换成新版本（不需要重启应用）"""
+
+    def __init__(self, root, kind, reload_interval=10):
+        self.kind_dir = os.path.join(root, kind)
+        self.reload_interval = reload_interval
+        self.artifact = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def _current_version(self):
+        try:
+            with open(os.path.join(self.kind_dir, 'CURRENT'), encoding='utf-8') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """返回当前版本的 Artifact，没有任何版本时返回 None"""
+        now = time.time()
+        if now - self.checked_at < self.reload_interval:
+            return self.artifact
+
+        with self.lock:
+            if now - self.checked_at >= self.reload_interval:
+                version = self._current_version()
+                if version is None:
+                    self.artifact = None
+                elif self.artifact is None or self.artifact.version != version:
+                    # 只替换引用，正在使用旧版本的请求不受影响
+                    self.artifact = Artifact(os.path.join(self.kind_dir, version))
+                self.checked_at = now
+        return self.artifact
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_artifact_store(app, kind):
+    """按应用配置返回某类模型的进程内共享 ArtifactStore"""
+    key = (app.config['MODEL_DIR'], kind)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ArtifactStore(app.config['MODEL_DIR'], kind,
+                                         app.config.get('MODEL_RELOAD_INTERVAL', 10))
+        return _stores[key]
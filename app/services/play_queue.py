@@ -0,0 +1,232 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, UTC
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Music, UserPlayHistory, UserRecommendation
+from app.services.cache import invalidate_recommendations, invalidate_songs, record_recommendation_invalidations
+from app.services.event_log import append_play_event
+from app.services.interactions import apply_play_batch, record_play_interaction, record_song_play_bucket
+from app.services.item_cf import record_item_interaction
+from app.services.popularity import record_popularity_play
+from app.services.rankings import record_ranking_play
+from app.services.recommender import record_user_interaction
+from app.services.taste_profiles import flush_taste_profiles, record_taste_plays
+from app.services.trending import record_trending_play
+
+
+def write_play_batch(events):
+    """在一个事务中写入一批播放事件，提交后再更新各个进程内的索引和缓存，返回写入的事件数
+
+    只有事务没有提交时才抛出异常（调用方可以重写这一批）；提交之后的内存更新失败只记录日志，
+    重写会让播放记录和各项计数重复。
+    """
+    try:
+        written = apply_play_batch(events)
+        # 这些用户预计算的推荐和其他进程中的推荐缓存不再准确
+        users = {userid for userid, _, _ in written}
+        if users:
+            UserRecommendation.query.filter(UserRecommendation.userid.in_(users)).delete(synchronize_session=False)
+            record_recommendation_invalidations(users)
+        db.session.commit()
+    except IntegrityError:
+        # 其他进程同时插入了同一条汇总记录，改为逐条写入
+        db.session.rollback()
+        written = _write_rowwise(events)
+
+    try:
+        _apply_written_plays(written)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error updating in-memory state after play batch: {str(e)}")
+    return len(written)
+
+
+def _apply_written_plays(written):
+    """播放已经提交后，更新相似歌曲表、协同过滤矩阵、热门、排行榜、实时热门榜、口味画像和各个缓存"""
+    songs = {
+        song.id: song
+        for song in db.session.query(Music.id, Music.genre, Music.artist_name).filter(
+            Music.id.in_({music_id for _, music_id, _ in written})
+        )
+    } if written else {}
+    for userid, music_id, _ in written:
+        song = songs[music_id]
+        record_item_interaction(userid, music_id)
+        record_user_interaction(userid)
+        record_popularity_play(music_id, song.genre)
+        record_ranking_play(music_id, song.artist_name)
+        record_trending_play(music_id, song.artist_name)
+    record_taste_plays([
+        (userid, songs[music_id].genre, songs[music_id].artist_name, played_at)
+        for userid, music_id, played_at in written
+    ])
+    for userid in {userid for userid, _, _ in written}:
+        invalidate_recommendations(userid)
+    # 播放次数变了
+    invalidate_songs({music_id for _, music_id, _ in written})
+
+
+def _write_rowwise(events):
+    written = []
+    for userid, music_id, played_at in events:
+        music = db.session.get(Music, music_id)
+        if music is None:
+            continue
+        music.play_count = (music.play_count or 0) + 1
+        db.session.add(UserPlayHistory(userid=userid, music_id=music_id, played_at=played_at))
+        record_play_interaction(userid, music_id, played_at)
+        record_song_play_bucket(music_id, played_at)
+        UserRecommendation.query.filter_by(userid=userid).delete(synchronize_session=False)
+        written.append((userid, music_id, played_at))
+    record_recommendation_invalidations({userid for userid, _, _ in written})
+    db.session.commit()
+    return written
+
+
+class PlayEventQueue:
+    """播放事件的写后队列：接口把事件放入队列后立即返回，后台线程按批写入数据库
+
+    每攒够 batch_size 条或距上次写入超过 flush_interval 秒写一批。队列满（max_size）时
+    put 最多等待 put_timeout 秒，仍然放不进去就返回 False，由接口提示客户端稍后重试。
+    写入失败的一批保留下来，等 flush_interval 秒后重写，连续失败 max_retries 次才放弃
+    （这些事件仍在播放日志中，可以用 flask replay-play-log 补回）。
+    进程退出时先停止接收，再把队列中剩余的事件全部写完，最后写入口味画像的增量。
+    """
+
+    def __init__(self, app, batch_size=500, flush_interval=1.0, max_size=10000, put_timeout=0.5, max_retries=5):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.queue = queue.Queue(max_size)
+        # 写入失败、等待重写的一批，以及它已经失败的次数
+        self.failed = []
+        self.failures = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='play-event-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def put(self, userid, music_id, played_at=None):
+        if self.stopping.is_set():
+            return False
+        try:
+            self.queue.put((userid, music_id, played_at or datetime.now(UTC)), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _next_batch(self):
+        """等到第一条事件后，再在 flush_interval 内尽量凑满一批"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        with self.app.app_context():
+            try:
+                write_play_batch(batch)
+                self.failures = 0
+            except Exception as e:
+                db.session.rollback()
+                self.failures += 1
+                if self.failures < self.max_retries:
+                    print(f"Error in play event writer, will retry {len(batch)} events: {str(e)}")
+                    self.failed = batch
+                else:
+                    print(f"Error in play event writer, dropping {len(batch)} events: {str(e)}")
+                    self.failures = 0
+            finally:
+                db.session.remove()
+
+    def _take_failed(self):
+        batch, self.failed = self.failed, []
+        return batch
+
+    def _run(self):
+        while not self.stopping.is_set():
+            if self.failed:
+                self.stopping.wait(self.flush_interval)
+                batch = self._take_failed()
+            else:
+                batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def drain(self):
+        """把队列中已有的事件（以及等待重写的一批）全部写入（测试和退出时使用）"""
+        while True:
+            batch = self._take_failed()
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        self.thread.join(timeout)
+        # 写入线程还没有退出（如卡在数据库上）时不 drain，避免两个线程同时写入
+        if self.thread.is_alive():
+            print(f"Play event writer did not stop in {timeout}s, {self.queue.qsize()} events left in queue")
+        else:
+            self.drain()
+        with self.app.app_context():
+            flush_taste_profiles()
+
+
+_play_queue = None
+_play_queue_lock = threading.Lock()
+
+
+def get_play_queue():
+    """进程内共享的播放事件队列，首次使用时启动后台写入线程"""
+    global _play_queue
+    with _play_queue_lock:
+        if _play_queue is None:
+            config = current_app.config
+            _play_queue = PlayEventQueue(
+                current_app._get_current_object(),
+                config.get('PLAY_QUEUE_BATCH_SIZE', 500),
+                config.get('PLAY_QUEUE_FLUSH_INTERVAL', 1.0),
+                config.get('PLAY_QUEUE_MAX_SIZE', 10000),
+                config.get('PLAY_QUEUE_PUT_TIMEOUT', 0.5)
+            )
+        return _play_queue
+
+
+def submit_play(userid, music_id):
+    """记录一次播放；队列满时返回 False。关闭 PLAY_QUEUE_ENABLED 时在当前请求中直接写入
+
+    被接受的播放同时追加到二进制播放日志，数据库写入失败时可以用 flask replay-play-log 补回。
+    """
+    played_at = datetime.now(UTC)
+    if not current_app.config.get('PLAY_QUEUE_ENABLED', True):
+        append_play_event(userid, music_id, played_at)
+        write_play_batch([(userid, music_id, played_at)])
+        return True
+    if not get_play_queue().put(userid, music_id, played_at):
+        return False
+    append_play_event(userid, music_id, played_at)
+    return True
@@ -0,0 +1,135 @@
+from datetime import datetime, time, timedelta, UTC
+
+from sqlalchemy import bindparam, case, func, insert, select
+
+from app import db
+from app.models import DailySongPlay, DailyUserSongPlay, UserPlayHistory, UserPlayHistoryArchive
+from app.services.interactions import _update_or_insert
+from app.services.rankings import RANKING_WINDOWS
+
+
+def rollup_play_history(retention_days, archive=True, now=None):
+    """把 retention_days 天以前的原始播放记录汇总进每日统计表，再移入归档表（archive=False 时直接删除）
+
+    按天处理，每天一个事务：汇总、归档和删除同时提交，任何时刻一次播放只会出现在原始记录或每日统计
+    其中之一，查询两边合并时不会重复计算。汇总时已有同一天的行（迟到的播放）则累加。
+    返回 {'days': 处理的天数, 'rows': 移出的原始记录数, 'rollups': 写入的每日统计行数}。
+    """
+    longest = max(hours for hours in RANKING_WINDOWS.values() if hours)
+    if retention_days * 24 < longest:
+        # 日榜、周榜的小时计数要从保留期内的原始记录重建
+        raise ValueError(f'保留天数不能少于 {longest // 24} 天')
+
+    now = now or datetime.now(UTC)
+    cutoff_day = now.date() - timedelta(days=retention_days)
+    result = {'days': 0, 'rows': 0, 'rollups': 0}
+    oldest = db.session.query(func.min(UserPlayHistory.played_at)).scalar()
+    if oldest is None:
+        return result
+
+    day = oldest.date()
+    while day < cutoff_day:
+        start = datetime.combine(day, time.min, UTC)
+        end = start + timedelta(days=1)
+        in_day = (UserPlayHistory.played_at >= start, UserPlayHistory.played_at < end)
+        rows = db.session.query(
+            UserPlayHistory.userid,
+            UserPlayHistory.music_id,
+            func.count(UserPlayHistory.id),
+            func.max(UserPlayHistory.played_at)
+        ).filter(*in_day).group_by(
+            UserPlayHistory.userid,
+            UserPlayHistory.music_id
+        ).all()
+        if rows:
+            result['rollups'] += _rollup_day(day, rows)
+            if archive:
+                columns = [UserPlayHistory.id, UserPlayHistory.userid, UserPlayHistory.music_id, UserPlayHistory.played_at]
+                db.session.execute(insert(UserPlayHistoryArchive).from_select(
+                    ['id', 'userid', 'music_id', 'played_at'], select(*columns).where(*in_day)
+                ))
+            result['rows'] += UserPlayHistory.query.filter(*in_day).delete(synchronize_session=False)
+            result['days'] += 1
+            db.session.commit()
+        day += timedelta(days=1)
+    return result
+
+
+def _rollup_day(day, rows):
+    """rows: [(userid, music_id, 播放次数, 最后播放时间)]，返回新写入或更新的行数"""
+    pairs = {(userid, music_id): (count, last_played) for userid, music_id, count, last_played in rows}
+    songs = {}
+    for (_, music_id), (count, _) in pairs.items():
+        songs[music_id] = songs.get(music_id, 0) + count
+
+    user_plays = DailyUserSongPlay.__table__
+    existing = {
+        (row.userid, row.music_id)
+        for row in db.session.query(DailyUserSongPlay.userid, DailyUserSongPlay.music_id).filter(
+            DailyUserSongPlay.day == day
+        )
+    }
+    _update_or_insert(
+        user_plays, pairs, existing,
+        user_plays.update().where(
+            user_plays.c.day == bindparam('key_day'),
+            user_plays.c.userid == bindparam('key_userid'),
+            user_plays.c.music_id == bindparam('key_music_id')
+        ).values(
+            play_count=user_plays.c.play_count + bindparam('count'),
+            last_played=case(
+                (user_plays.c.last_played.is_(None), bindparam('played_at')),
+                (user_plays.c.last_played < bindparam('played_at'), bindparam('played_at')),
+                else_=user_plays.c.last_played
+            )
+        ),
+        lambda key, value: {'key_day': day, 'key_userid': key[0], 'key_music_id': key[1],
+                            'count': value[0], 'played_at': value[1]},
+        lambda key, value: {'day': day, 'userid': key[0], 'music_id': key[1],
+                            'play_count': value[0], 'last_played': value[1]}
+    )
+
+    song_plays = DailySongPlay.__table__
+    existing = {row.music_id for row in db.session.query(DailySongPlay.music_id).filter(DailySongPlay.day == day)}
+    _update_or_insert(
+        song_plays, songs, existing,
+        song_plays.update().where(
+            song_plays.c.day == bindparam('key_day'),
+            song_plays.c.music_id == bindparam('key_music_id')
+        ).values(play_count=song_plays.c.play_count + bindparam('count')),
+        lambda key, value: {'key_day': day, 'key_music_id': key, 'count': value},
+        lambda key, value: {'day': day, 'music_id': key, 'play_count': value}
+    )
+    return len(pairs) + len(songs)
+
+
+def recent_plays(userid, limit):
+    """用户最近的 limit 次播放 [(歌曲ID, 播放时间)]，从新到旧
+
+    原始记录不够时再从每日统计补充，已汇总的每一天每首歌只算一次（时间取当天最后一次播放）。
+    """
+    plays = [
+        (row.music_id, row.played_at)
+        for row in db.session.query(
+            UserPlayHistory.music_id,
+            UserPlayHistory.played_at
+        ).filter(
+            UserPlayHistory.userid == userid
+        ).order_by(
+            UserPlayHistory.played_at.desc()
+        ).limit(limit)
+    ]
+    if len(plays) < limit:
+        plays.extend(
+            (row.music_id, row.last_played)
+            for row in db.session.query(
+                DailyUserSongPlay.music_id,
+                DailyUserSongPlay.last_played
+            ).filter(
+                DailyUserSongPlay.userid == userid
+            ).order_by(
+                DailyUserSongPlay.day.desc(),
+                DailyUserSongPlay.last_played.desc()
+            ).limit(limit - len(plays))
+        )
+    return plays
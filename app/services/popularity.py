@@ -0,0 +1,175 @@
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.models import Music
+from app.services.interactions import play_counts_since
+from app.services.preference_index import split_terms
+
+
+class RankedCounter:
+    """按计数从高到低排好序的列表，计数加一时 O(1) 调整位置
+
+    计数相同的元素连续存放（一个“桶”），记录每个桶的起点和大小。某个元素加一时，
+    把它与所在桶的第一个元素交换，再把桶的起点后移一位，它就成了上一个桶（计数+1）的最后一个元素。
+    """
+
+    def __init__(self, items=()):
+        """items: 已按计数从高到低排好序的 (元素, 计数)"""
+        self.ranked = []
+        self.position = {}
+        self.counts = {}
+        self.bucket_start = {}
+        self.bucket_size = {}
+        for item, count in items:
+            self.add(item, count)
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def add(self, item, count=0):
+        """追加一个新元素，count 不能大于当前最后一个元素的计数"""
+        self.position[item] = len(self.ranked)
+        self.ranked.append(item)
+        self.counts[item] = count
+        if count in self.bucket_size:
+            self.bucket_size[count] += 1
+        else:
+            self.bucket_start[count] = len(self.ranked) - 1
+            self.bucket_size[count] = 1
+
+    def increment(self, item):
+        if item not in self.position:
+            # 新元素从0开始，计数不会大于任何已有元素，直接追加到末尾
+            self.add(item)
+        count = self.counts[item]
+        i = self.position[item]
+        j = self.bucket_start[count]
+        self.ranked[i], self.ranked[j] = self.ranked[j], self.ranked[i]
+        self.position[self.ranked[i]] = i
+        self.position[item] = j
+
+        self.bucket_start[count] += 1
+        self.bucket_size[count] -= 1
+        if self.bucket_size[count] == 0:
+            del self.bucket_start[count]
+            del self.bucket_size[count]
+        if count + 1 in self.bucket_size:
+            self.bucket_size[count + 1] += 1
+        else:
+            self.bucket_start[count + 1] = j
+            self.bucket_size[count + 1] = 1
+        self.counts[item] = count + 1
+
+    def decrement(self, item):
+        """与 increment 对称：与所在桶的最后一个元素交换，它就成了下一个桶（计数-1）的第一个元素"""
+        count = self.counts[item]
+        i = self.position[item]
+        j = self.bucket_start[count] + self.bucket_size[count] - 1
+        self.ranked[i], self.ranked[j] = self.ranked[j], self.ranked[i]
+        self.position[self.ranked[i]] = i
+        self.position[item] = j
+
+        self.bucket_size[count] -= 1
+        if self.bucket_size[count] == 0:
+            del self.bucket_start[count]
+            del self.bucket_size[count]
+        if count - 1 in self.bucket_size:
+            self.bucket_start[count - 1] -= 1
+            self.bucket_size[count - 1] += 1
+        else:
+            self.bucket_start[count - 1] = j
+            self.bucket_size[count - 1] = 1
+        self.counts[item] = count - 1
+
+    def top(self, n, exclude=(), min_count=None):
+        """计数最高的 n 个元素（跳过 exclude 和计数小于 min_count 的），代价与 n + len(exclude) 成正比，与总元素数无关"""
+        result = []
+        for item in self.ranked:
+            if len(result) >= n or (min_count is not None and self.counts[item] < min_count):
+                break
+            if item not in exclude:
+                result.append(item)
+        return result
+
+
+class PopularityList:
+    """全局和按音乐类型的热门歌曲（按最近 days 天的播放次数排序），常驻内存
+
+    启动时和每隔 POPULARITY_MAX_AGE 秒全量加载一次（已归档的播放从每日统计读取），期间由播放接口增量加一。
+    """
+
+    def __init__(self):
+        self.songs = RankedCounter()
+        self.genres = {}
+        self.song_genres = {}
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def load(self, days):
+        plays = play_counts_since(datetime.now(UTC) - timedelta(days=days))
+        rows = db.session.query(
+            Music.id,
+            Music.genre,
+            func.coalesce(plays.c.play_count, 0).label('play_count')
+        ).outerjoin(
+            plays, plays.c.music_id == Music.id
+        ).all()
+        rows.sort(key=lambda row: (-row.play_count, row.id))
+
+        songs = RankedCounter((row.id, int(row.play_count)) for row in rows)
+        genre_items = {}
+        song_genres = {}
+        for row in rows:
+            song_genres[row.id] = split_terms(row.genre)
+            for genre in song_genres[row.id]:
+                genre_items.setdefault(genre, []).append((row.id, int(row.play_count)))
+
+        with self.lock:
+            self.songs = songs
+            self.genres = {genre: RankedCounter(items) for genre, items in genre_items.items()}
+            self.song_genres = song_genres
+            self.loaded_at = time.time()
+        return self
+
+    def record_play(self, song_id, genre=None):
+        """播放次数加一；genre 用于加载之后才新增的歌曲"""
+        with self.lock:
+            if song_id not in self.song_genres:
+                self.song_genres[song_id] = split_terms(genre)
+            self.songs.increment(song_id)
+            for g in self.song_genres[song_id]:
+                self.genres.setdefault(g, RankedCounter()).increment(song_id)
+
+    def top(self, n, exclude=(), genre=None):
+        """最热门的 n 首歌曲ID；genre 不为空时只取该类型"""
+        exclude = set(exclude)
+        with self.lock:
+            counter = self.songs if genre is None else self.genres.get(genre)
+            return counter.top(n, exclude) if counter is not None else []
+
+
+_popularity = None
+_popularity_lock = threading.Lock()
+
+
+def get_popularity_list():
+    """进程内共享的热门歌曲列表，首次使用或超过 POPULARITY_MAX_AGE 秒后从数据库重新加载"""
+    global _popularity
+    max_age = current_app.config.get('POPULARITY_MAX_AGE', 3600)
+    with _popularity_lock:
+        if _popularity is None or time.time() - _popularity.loaded_at > max_age:
+            _popularity = PopularityList().load(current_app.config.get('POPULARITY_DAYS', 30))
+        return _popularity
+
+
+def record_popularity_play(song_id, genre=None):
+    """只在列表已经加载时增量更新，否则等下次加载时从数据库读取"""
+    with _popularity_lock:
+        popularity = _popularity
+    if popularity is not None:
+        popularity.record_play(song_id, genre)
@@ -0,0 +1,116 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, UTC
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app import db
+from app.models import UserRecommendation, UserSongInteraction
+from app.services import als, user_cf_model
+from app.services.model_store import Artifact, get_artifact_store
+
+# 可以预计算的推荐方式及其使用的离线模型；item 方式依赖实时更新的相似歌曲表，不预计算
+PRECOMPUTED_KINDS = {'user': user_cf_model.ARTIFACT_KIND, 'mf': als.ARTIFACT_KIND}
+
+# 每个用户保存的推荐歌曲数，与首页展示的15首一致
+PRECOMPUTED_COUNT = 15
+
+# 每个任务分给子进程的用户数，也是每批写入数据库的行数
+CHUNK_SIZE = 500
+
+
+def load_active_users(days):
+    """最近 days 天内播放过歌曲的用户ID"""
+    since = datetime.now(UTC) - timedelta(days=days)
+    rows = db.session.query(
+        UserSongInteraction.userid
+    ).filter(
+        UserSongInteraction.last_played >= since
+    ).distinct().all()
+    return sorted(row.userid for row in rows)
+
+
+# 子进程中的模型；各子进程以内存映射方式打开同一版本的模型文件，共享页缓存而不复制矩阵
+_worker_model = None
+
+
+def _init_worker(path, mode):
+    global _worker_model
+    artifact = Artifact(path)
+    if mode == 'user':
+        # 不连接数据库，直接使用构建模型时算好的相似度
+        _worker_model = user_cf_model.UserCFModel(artifact, None)
+    else:
+        _worker_model = als.MFModel(artifact)
+
+
+def _recommend_chunk(userids):
+    return [(userid, (_worker_model.recommend(userid) or [])[:PRECOMPUTED_COUNT]) for userid in userids]
+
+
+def _write_chunk(mode, results, generated_at):
+    """先删除这批用户的旧结果再批量插入，每批一个事务"""
+    UserRecommendation.query.filter(
+        UserRecommendation.mode == mode,
+        UserRecommendation.userid.in_([userid for userid, _ in results])
+    ).delete(synchronize_session=False)
+    rows = [
+        {'userid': userid, 'mode': mode, 'song_ids': ','.join(str(song_id) for song_id in song_ids),
+         'generated_at': generated_at}
+        for userid, song_ids in results
+    ]
+    if rows:
+        db.session.execute(insert(UserRecommendation), rows)
+    db.session.commit()
+
+
+def precompute_recommendations(app, mode='user', days=30, workers=4, chunk_size=CHUNK_SIZE, callback=None):
+    """用进程池为活跃用户批量计算推荐并写入 user_recommendations
+
+    callback(已完成用户数, 总用户数, 已用秒数) 在每批写入后调用；返回 {'users', 'seconds', 'users_per_second', 'version'}
+    """
+    artifact = get_artifact_store(app, PRECOMPUTED_KINDS[mode]).get()
+    if artifact is None:
+        raise RuntimeError(f'还没有生成 {PRECOMPUTED_KINDS[mode]} 模型')
+
+    started = time.time()
+    userids = load_active_users(days)
+    chunks = [userids[i:i + chunk_size] for i in range(0, len(userids), chunk_size)]
+    generated_at = datetime.now(UTC)
+    done = 0
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(artifact.path, mode)) as pool:
+        for results in pool.map(_recommend_chunk, chunks):
+            _write_chunk(mode, results, generated_at)
+            done += len(results)
+            if callback:
+                callback(done, len(userids), time.time() - started)
+
+    seconds = time.time() - started
+    return {
+        'users': done,
+        'seconds': seconds,
+        'users_per_second': done / seconds if seconds > 0 else 0,
+        'version': artifact.version,
+    }
+
+
+def load_precomputed(userid, mode):
+    """返回批量任务为该用户算好且未过期的推荐歌曲ID，没有时返回 None"""
+    if mode not in PRECOMPUTED_KINDS:
+        return None
+    row = db.session.get(UserRecommendation, (userid, mode))
+    if row is None:
+        return None
+    max_age = current_app.config.get('RECOMMEND_PRECOMPUTED_MAX_AGE', 36 * 3600)
+    generated_at = row.generated_at
+    if generated_at.tzinfo is None:
+        generated_at = generated_at.replace(tzinfo=UTC)
+    if datetime.now(UTC) - generated_at > timedelta(seconds=max_age):
+        return None
+    return [int(song_id) for song_id in row.song_ids.split(',')] if row.song_ids else []
+
+
+def discard_precomputed(userid):
+    """用户自己的评分、播放、偏好变化后，预计算的结果不再准确，与这次修改在同一事务中删除"""
+    UserRecommendation.query.filter_by(userid=userid).delete(synchronize_session=False)
@@ -0,0 +1,184 @@
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+from scipy import sparse
+
+from app import db
+from app.models import UserPreference
+
+# 偏好字段及其在偏好相似度中的权重
+PREFERENCE_FIELDS = ('favorite_genres', 'favorite_artists', 'listening_times')
+PREFERENCE_WEIGHTS = (0.4, 0.4, 0.2)
+
+
+def split_terms(value):
+    return list(dict.fromkeys(value.split(','))) if value else []
+
+
+class PreferenceIndex:
+    """所有用户偏好的多热编码索引
+
+    流派、艺术家、时段分别映射为整数词表，每个字段保存一个 用户×词表 的 CSR 0/1 矩阵。
+    某个用户与所有用户的 Jaccard 相似度 = 交集 / (双方大小之和 - 交集)，交集由一次稀疏矩阵向量乘得到。
+    偏好更新时只记录在 overrides 中，累积到一定数量后再合并进 CSR 矩阵。
+    """
+
+    def __init__(self, compact_threshold=256):
+        self.compact_threshold = compact_threshold
+        self.user_index = {}
+        self.vocabularies = [{} for _ in PREFERENCE_FIELDS]
+        self.matrices = [sparse.csr_matrix((0, 0)) for _ in PREFERENCE_FIELDS]
+        self.sizes = [np.zeros(0) for _ in PREFERENCE_FIELDS]
+        # 行号 -> 各字段的词ID数组，覆盖 CSR 中的旧数据（新用户也先放在这里）
+        self.overrides = {}
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    @property
+    def user_count(self):
+        return len(self.user_index)
+
+    def _intern(self, field, terms):
+        vocabulary = self.vocabularies[field]
+        return np.array([vocabulary.setdefault(term, len(vocabulary)) for term in terms], dtype=np.int64)
+
+    def _encode(self, pref):
+        return tuple(self._intern(field, split_terms(getattr(pref, name)))
+                     for field, name in enumerate(PREFERENCE_FIELDS))
+
+    def _build(self, rows):
+        """rows: 按行号排列的 [(各字段词ID数组)]，重建各字段的 CSR 矩阵"""
+        for field in range(len(PREFERENCE_FIELDS)):
+            terms = [row[field] for row in rows]
+            lengths = np.fromiter((len(t) for t in terms), dtype=np.int64, count=len(terms))
+            indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            indices = np.concatenate(terms) if terms else np.zeros(0, dtype=np.int64)
+            self.matrices[field] = sparse.csr_matrix(
+                (np.ones(len(indices)), indices, indptr),
+                shape=(len(terms), len(self.vocabularies[field]))
+            )
+            self.sizes[field] = lengths.astype(np.float64)
+        self.overrides = {}
+
+    def load(self):
+        """一次查询读取所有偏好并重建索引"""
+        prefs = db.session.query(
+            UserPreference.userid,
+            UserPreference.favorite_genres,
+            UserPreference.favorite_artists,
+            UserPreference.listening_times
+        ).all()
+
+        with self.lock:
+            self.user_index = {}
+            self.vocabularies = [{} for _ in PREFERENCE_FIELDS]
+            rows = []
+            for pref in prefs:
+                if pref.userid in self.user_index:
+                    rows[self.user_index[pref.userid]] = self._encode(pref)
+                    continue
+                self.user_index[pref.userid] = len(rows)
+                rows.append(self._encode(pref))
+            self._build(rows)
+            self.loaded_at = time.time()
+        return self
+
+    def _row_terms(self, row):
+        if row in self.overrides:
+            return self.overrides[row]
+        terms = []
+        for matrix in self.matrices:
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            terms.append(matrix.indices[start:end])
+        return tuple(terms)
+
+    def _compact(self):
+        self._build([self._row_terms(r) for r in range(self.user_count)])
+
+    def update(self, pref):
+        """用户修改偏好后调用，pref 为带有三个偏好字段的对象"""
+        with self.lock:
+            row = self.user_index.setdefault(pref.userid, len(self.user_index))
+            self.overrides[row] = self._encode(pref)
+            if len(self.overrides) > self.compact_threshold:
+                self._compact()
+
+    def pair_similarities(self, userid, other_userids):
+        """目标用户与少量指定用户的偏好相似度，用于对候选邻居重排"""
+        with self.lock:
+            similarities = np.zeros(len(other_userids))
+            row = self.user_index.get(userid)
+            if row is None:
+                return similarities
+            target = [set(terms.tolist()) for terms in self._row_terms(row)]
+            for i, other_userid in enumerate(other_userids):
+                other_row = self.user_index.get(other_userid)
+                if other_row is None:
+                    continue
+                for field, weight in enumerate(PREFERENCE_WEIGHTS):
+                    other = set(self._row_terms(other_row)[field].tolist())
+                    union = len(target[field] | other)
+                    similarities[i] += weight * len(target[field] & other) / max(union, 1)
+            return similarities
+
+    def similarity_block(self, rows):
+        """一批用户（行号）与所有用户的偏好相似度，返回 len(rows)×用户数 的稠密矩阵，离线批量计算使用"""
+        with self.lock:
+            if self.overrides:
+                self._compact()
+            similarities = np.zeros((len(rows), self.user_count))
+            for field, weight in enumerate(PREFERENCE_WEIGHTS):
+                matrix = self.matrices[field]
+                intersection = (matrix[rows] @ matrix.T).toarray()
+                sizes = self.sizes[field]
+                union = np.maximum(sizes[rows][:, None] + sizes[None, :] - intersection, 1)
+                similarities += weight * intersection / union
+            return similarities
+
+    def similarities(self, userid):
+        """目标用户与索引中每个用户的偏好相似度，按行号排列；用户没有偏好时返回 None"""
+        with self.lock:
+            row = self.user_index.get(userid)
+            if row is None:
+                return None
+            target = self._row_terms(row)
+            similarities = np.zeros(self.user_count)
+
+            for field, weight in enumerate(PREFERENCE_WEIGHTS):
+                matrix = self.matrices[field]
+                terms = target[field]
+                base_rows = matrix.shape[0]
+
+                intersection = np.zeros(self.user_count)
+                sizes = np.zeros(self.user_count)
+                query = np.zeros(matrix.shape[1])
+                query[terms[terms < matrix.shape[1]]] = 1
+                intersection[:base_rows] = matrix @ query
+                sizes[:base_rows] = self.sizes[field]
+
+                # 尚未合并的更新逐个修正
+                term_set = set(terms.tolist())
+                for other_row, other_terms in self.overrides.items():
+                    intersection[other_row] = len(term_set.intersection(other_terms[field].tolist()))
+                    sizes[other_row] = len(other_terms[field])
+
+                union = np.maximum(sizes + len(terms) - intersection, 1)
+                similarities += weight * intersection / union
+            return similarities
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_preference_index():
+    """进程内共享的偏好索引，首次使用或超过 PREFERENCE_INDEX_MAX_AGE 秒后从数据库重新加载"""
+    global _index
+    max_age = current_app.config.get('PREFERENCE_INDEX_MAX_AGE', 300)
+    with _index_lock:
+        if _index is None or time.time() - _index.loaded_at > max_age:
+            _index = PreferenceIndex().load()
+        return _index
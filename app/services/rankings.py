@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import Counter, deque
+
+from flask import current_app
+
+from app import db
+from app.models import Music, SongPlayBucket
+from app.services.popularity import RankedCounter
+
+# 排行榜时间范围 -> 覆盖的小时数（None 表示全部时间）
+RANKING_WINDOWS = {'day': 24, 'week': 7 * 24, 'all': None}
+
+
+class WindowCounter:
+    """一个时间范围内歌曲和歌手的播放次数排名
+
+    播放次数按小时分桶保存，新的播放记入当前小时的桶并在排名中加一；
+    时间前进后，移出范围的桶里的次数再逐一减掉，因此每次播放的均摊代价是常数。
+    桶里按 (歌曲ID, 歌手) 计数，移出时减掉的是当时加上的歌手，歌手改名后也不会减错。
+    """
+
+    def __init__(self, hours=None):
+        self.hours = hours
+        self.songs = RankedCounter()
+        self.artists = RankedCounter()
+        # (小时编号, Counter((歌曲ID, 歌手) -> 次数))，按时间先后排列
+        self.buckets = deque()
+
+    def load(self, song_counts, song_artists, buckets=()):
+        """song_counts: {歌曲ID: 范围内的播放次数}；buckets: [(小时编号, {歌曲ID: 次数})]"""
+        artist_counts = Counter()
+        for song_id, count in song_counts.items():
+            artist_counts[song_artists.get(song_id)] += count
+        self.songs = RankedCounter(sorted(song_counts.items(), key=lambda x: (-x[1], x[0])))
+        self.artists = RankedCounter(sorted(artist_counts.items(), key=lambda x: (-x[1], str(x[0]))))
+        self.buckets = deque(
+            (bucket, Counter({(song_id, song_artists.get(song_id)): count for song_id, count in counts.items()}))
+            for bucket, counts in sorted(buckets, key=lambda x: x[0])
+        )
+
+    def expire(self, current_bucket):
+        """移出已经不在范围内的小时桶"""
+        if self.hours is None:
+            return
+        while self.buckets and self.buckets[0][0] <= current_bucket - self.hours:
+            _, counts = self.buckets.popleft()
+            for (song_id, artist), count in counts.items():
+                for _ in range(count):
+                    self.songs.decrement(song_id)
+                    self.artists.decrement(artist)
+
+    def record(self, song_id, artist, bucket):
+        if self.hours is not None:
+            if not self.buckets or self.buckets[-1][0] < bucket:
+                self.buckets.append((bucket, Counter()))
+            self.buckets[-1][1][song_id, artist] += 1
+        self.songs.increment(song_id)
+        self.artists.increment(artist)
+
+
+class RankingBoard:
+    """日榜、周榜、总榜，常驻内存
+
+    加载时日榜和周榜来自最近一周的小时计数表（song_play_buckets），总榜来自 music.play_count；
+    之后由播放接口增量更新，每隔 RANKINGS_MAX_AGE 秒重新加载一次以同步其他进程的播放。
+    """
+
+    def __init__(self):
+        self.windows = {name: WindowCounter(hours) for name, hours in RANKING_WINDOWS.items()}
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        current_bucket = int(time.time() // 3600)
+        longest = max(hours for hours in RANKING_WINDOWS.values() if hours)
+        songs = db.session.query(Music.id, Music.artist_name, Music.play_count).all()
+        rows = db.session.query(
+            SongPlayBucket.bucket,
+            SongPlayBucket.music_id,
+            SongPlayBucket.play_count
+        ).filter(
+            SongPlayBucket.bucket > current_bucket - longest
+        ).all()
+
+        song_artists = {song.id: song.artist_name for song in songs}
+        buckets = {}
+        for row in rows:
+            buckets.setdefault(row.bucket, {})[row.music_id] = row.play_count
+
+        windows = {}
+        for name, hours in RANKING_WINDOWS.items():
+            window = WindowCounter(hours)
+            if hours is None:
+                window.load({song.id: song.play_count or 0 for song in songs}, song_artists)
+            else:
+                recent = [(bucket, counts) for bucket, counts in buckets.items() if bucket > current_bucket - hours]
+                totals = Counter()
+                for _, counts in recent:
+                    totals.update(counts)
+                window.load(totals, song_artists, recent)
+            windows[name] = window
+
+        with self.lock:
+            self.windows = windows
+            self.loaded_at = time.time()
+        return self
+
+    def record_play(self, song_id, artist):
+        bucket = int(time.time() // 3600)
+        with self.lock:
+            for window in self.windows.values():
+                window.expire(bucket)
+                window.record(song_id, artist, bucket)
+
+    def top(self, window, n=10):
+        """返回 ([(歌手, 播放次数)], [(歌曲ID, 播放次数)])，只包含播放次数大于0的"""
+        with self.lock:
+            counter = self.windows[window]
+            counter.expire(int(time.time() // 3600))
+            artists = [(artist, counter.artists.counts[artist])
+                       for artist in counter.artists.top(n, exclude={None}, min_count=1)]
+            songs = [(song_id, counter.songs.counts[song_id]) for song_id in counter.songs.top(n, min_count=1)]
+        return artists, songs
+
+
+_board = None
+_board_lock = threading.Lock()
+
+
+def get_ranking_board():
+    """进程内共享的排行榜，首次使用或超过 RANKINGS_MAX_AGE 秒后从数据库重新加载
+
+    加载时只读最近一周的小时计数，更早的行由 flask rollup-play-history 删除。
+    """
+    global _board
+    max_age = current_app.config.get('RANKINGS_MAX_AGE', 300)
+    with _board_lock:
+        if _board is None or time.time() - _board.loaded_at > max_age:
+            _board = RankingBoard().load()
+        return _board
+
+
+def record_ranking_play(song_id, artist):
+    """只在排行榜已经加载时增量更新，否则等下次加载时从数据库读取"""
+    with _board_lock:
+        board = _board
+    if board is not None:
+        board.record_play(song_id, artist)
+
+
+def prune_play_buckets():
+    """删除已经超出最长时间范围（一周）的小时计数，返回删除的行数"""
+    longest = max(hours for hours in RANKING_WINDOWS.values() if hours)
+    deleted = SongPlayBucket.query.filter(
+        SongPlayBucket.bucket <= int(time.time() // 3600) - longest
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
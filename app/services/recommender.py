@@ -0,0 +1,362 @@
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+from flask import current_app
+
+from app import db
+from app.models import UserSongInteraction
+from app.services.ann import RandomProjectionLSH
+from app.services.preference_index import get_preference_index
+
+# 相似用户个数
+NEIGHBOR_COUNT = 5
+
+
+def load_interaction_scores(userids=None):
+    """读取用户-歌曲交互汇总表（或其中指定用户的部分），返回 {(userid, music_id): 分数}"""
+    query = db.session.query(
+        UserSongInteraction.userid,
+        UserSongInteraction.music_id,
+        UserSongInteraction.play_count,
+        UserSongInteraction.rating
+    )
+    if userids is not None:
+        query = query.filter(UserSongInteraction.userid.in_(userids))
+    interactions = query.all()
+
+    # 已评分的歌曲以评分为准，否则将播放次数（隐式反馈）映射到1-5分
+    scores = {}
+    for i in interactions:
+        if i.rating is not None:
+            scores[(i.userid, i.music_id)] = i.rating
+        elif i.play_count > 0:
+            scores[(i.userid, i.music_id)] = min(5, i.play_count)
+    return scores
+
+
+class UserSongMatrix:
+    """用户×歌曲的 CSR 稀疏矩阵，行列通过 user_index / song_index 与数据库ID对应"""
+
+    def __init__(self, user_ids, song_ids, matrix, sequence=None):
+        self.user_ids = list(user_ids)
+        self.song_ids = np.asarray(song_ids, dtype=np.int64)
+        self.user_index = {userid: i for i, userid in enumerate(self.user_ids)}
+        self.song_index = {int(song_id): j for j, song_id in enumerate(self.song_ids)}
+        self.matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        # 与 matrix.data 一一对应的写入顺序，推荐分数相同时按它排序
+        if sequence is None:
+            sequence = np.arange(self.matrix.nnz)
+        self.sequence = np.asarray(sequence, dtype=np.int64)
+        # 0/1 指示矩阵和平方矩阵，用于只在共同歌曲上计算余弦相似度
+        self.indicator = self.matrix.copy()
+        self.indicator.data = np.ones_like(self.indicator.data)
+        self.squared = self.matrix.multiply(self.matrix).tocsr()
+
+    @classmethod
+    def from_scores(cls, scores):
+        # 按首次出现的顺序编号，相似度相同时保持与原先逐个遍历一致的先后顺序
+        user_ids = list(dict.fromkeys(userid for userid, _ in scores))
+        song_ids = list(dict.fromkeys(music_id for _, music_id in scores))
+        user_index = {userid: i for i, userid in enumerate(user_ids)}
+        song_index = {music_id: j for j, music_id in enumerate(song_ids)}
+
+        rows = np.fromiter((user_index[u] for u, _ in scores), dtype=np.int64, count=len(scores))
+        cols = np.fromiter((song_index[m] for _, m in scores), dtype=np.int64, count=len(scores))
+        data = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+
+        # 按 (行, 列) 排序后直接构造 CSR，并记下每个元素原来的写入顺序
+        sequence = np.lexsort((cols, rows))
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(user_ids)), out=indptr[1:])
+        matrix = sparse.csr_matrix((data[sequence], cols[sequence], indptr),
+                                   shape=(len(user_ids), len(song_ids)))
+        return cls(user_ids, song_ids, matrix, sequence)
+
+    @classmethod
+    def from_db(cls):
+        return cls.from_scores(load_interaction_scores())
+
+    @property
+    def user_count(self):
+        return self.matrix.shape[0]
+
+    def rating_similarities(self, userid, rows=None):
+        """目标用户与所有用户（或指定的 rows）在共同歌曲上的余弦相似度（与 scipy cosine 的结果一致）"""
+        u = self.user_index.get(userid)
+        if u is None:
+            return np.zeros(self.user_count if rows is None else len(rows))
+
+        matrix, squared, indicator = self.matrix, self.squared, self.indicator
+        if rows is not None:
+            matrix, squared, indicator = matrix[rows], squared[rows], indicator[rows]
+
+        # 共同歌曲上的点积，以及双方在共同歌曲上的平方和
+        dot = (matrix @ self.matrix[u].T).toarray().ravel()
+        other_norm = (squared @ self.indicator[u].T).toarray().ravel()
+        self_norm = (indicator @ self.squared[u].T).toarray().ravel()
+
+        denom = np.sqrt(other_norm * self_norm)
+        similarities = np.zeros(len(dot))
+        np.divide(dot, denom, out=similarities, where=denom > 0)
+        return similarities
+
+    def rating_similarity_block(self, rows):
+        """rating_similarities 的批量版本，返回 len(rows)×用户数 的稠密矩阵"""
+        dot = (self.matrix[rows] @ self.matrix.T).toarray()
+        other_norm = (self.indicator[rows] @ self.squared.T).toarray()
+        self_norm = (self.squared[rows] @ self.indicator.T).toarray()
+
+        denom = np.sqrt(other_norm * self_norm)
+        similarities = np.zeros(dot.shape)
+        np.divide(dot, denom, out=similarities, where=denom > 0)
+        return similarities
+
+    def with_user_rows(self, scores):
+        """返回把 scores（{(userid, music_id): 分数}）中出现的用户整行替换后的新矩阵，不修改自身
+
+        新用户、新歌曲追加在末尾，原有行列号不变；替换前已有的元素保留原来的写入顺序，新元素排在所有元素之后。
+        """
+        user_ids, song_ids = list(self.user_ids), [int(song_id) for song_id in self.song_ids]
+        user_index, song_index = dict(self.user_index), dict(self.song_index)
+        for userid, music_id in scores:
+            if userid not in user_index:
+                user_index[userid] = len(user_ids)
+                user_ids.append(userid)
+            if music_id not in song_index:
+                song_index[music_id] = len(song_ids)
+                song_ids.append(music_id)
+
+        matrix = self.matrix
+        counts = np.diff(matrix.indptr)
+        rows = np.repeat(np.arange(self.user_count, dtype=np.int64), counts)
+        replaced = np.array(sorted({user_index[userid] for userid, _ in scores}), dtype=np.int64)
+        keep = ~np.isin(rows, replaced)
+
+        old_sequence = {}
+        for row in replaced[replaced < self.user_count].tolist():
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            old_sequence.update(((row, int(col)), int(seq)) for col, seq in
+                                zip(matrix.indices[start:end], self.sequence[start:end]))
+        next_sequence = int(self.sequence.max()) + 1 if len(self.sequence) else 0
+        new_rows, new_cols, new_data, new_sequence = [], [], [], []
+        for (userid, music_id), score in scores.items():
+            row, col = user_index[userid], song_index[music_id]
+            sequence = old_sequence.get((row, col))
+            if sequence is None:
+                sequence, next_sequence = next_sequence, next_sequence + 1
+            new_rows.append(row)
+            new_cols.append(col)
+            new_data.append(score)
+            new_sequence.append(sequence)
+
+        rows = np.concatenate([rows[keep], np.array(new_rows, dtype=np.int64)])
+        cols = np.concatenate([matrix.indices[keep].astype(np.int64), np.array(new_cols, dtype=np.int64)])
+        data = np.concatenate([matrix.data[keep], np.array(new_data, dtype=np.float64)])
+        sequence = np.concatenate([self.sequence[keep], np.array(new_sequence, dtype=np.int64)])
+
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(user_ids)), out=indptr[1:])
+        matrix = sparse.csr_matrix((data[order], cols[order], indptr), shape=(len(user_ids), len(song_ids)))
+        return UserSongMatrix(user_ids, song_ids, matrix, sequence[order])
+
+
+class UserCFEngine:
+    """基于用户的协同过滤：评分余弦相似度与偏好相似度加权融合"""
+
+    def __init__(self, interactions, preferences, ann_index=None):
+        self.interactions = interactions
+        self.preferences = preferences
+        # 可选的近似最近邻索引，有索引时只在它给出的候选用户中精确计算相似度
+        self.ann_index = ann_index
+        # 交互矩阵行号 -> 偏好索引行号（没有偏好为 -1），偏好索引的行号只增不变
+        self.preference_rows = np.array(
+            [preferences.user_index.get(userid, -1) for userid in interactions.user_ids],
+            dtype=np.int64
+        )
+        self.preference_count = preferences.user_count
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_db(cls):
+        interactions = UserSongMatrix.from_db()
+        ann_index = None
+        # 用户数较多时用 LSH 索引找候选相似用户，不再逐个计算所有用户。
+        # 评分相似度只在共同歌曲上计算，是否有共同歌曲比评分高低更重要，所以对 0/1 指示向量做哈希
+        if interactions.user_count >= current_app.config.get('RECOMMEND_ANN_MIN_USERS', 100000):
+            ann_index = RandomProjectionLSH(**current_app.config.get('RECOMMEND_ANN_PARAMS', {}))
+            ann_index.build(interactions.indicator)
+        return cls(interactions, get_preference_index(), ann_index)
+
+    def with_user_rows(self, scores):
+        """交互矩阵替换了部分用户的行之后的新引擎；LSH 索引沿用并加入这些用户
+        （用户原来所在的桶不删除，只会多出一些候选，由精确计算排除）"""
+        interactions = self.interactions.with_user_rows(scores)
+        if self.ann_index is not None:
+            for row in sorted({interactions.user_index[userid] for userid, _ in scores}):
+                self.ann_index.insert(row, interactions.indicator[row])
+        return UserCFEngine(interactions, self.preferences, self.ann_index)
+
+    def preference_similarities(self, userid):
+        similarities = np.zeros(self.interactions.user_count)
+        # 流派、艺术家、时段的 Jaccard 相似度加权，对所有用户一次性计算
+        preference_similarities = self.preferences.similarities(userid)
+        if preference_similarities is None:
+            return similarities
+
+        known = self.preference_rows >= 0
+        known &= self.preference_rows < len(preference_similarities)
+        similarities[known] = preference_similarities[self.preference_rows[known]]
+        return similarities
+
+    def similarities(self, userid):
+        # 最终相似度：评分相似度和偏好相似度的加权平均
+        return (self.interactions.rating_similarities(userid) * 0.6 +
+                self.preference_similarities(userid) * 0.4)
+
+    def candidate_similarities(self, userid, rows):
+        """只对指定的用户行号计算最终相似度"""
+        user_ids = [self.interactions.user_ids[row] for row in rows]
+        return (self.interactions.rating_similarities(userid, rows) * 0.6 +
+                self.preferences.pair_similarities(userid, user_ids) * 0.4)
+
+    def similar_users(self, userid, k=NEIGHBOR_COUNT):
+        """返回 [(用户行号, 相似度)]，按相似度从高到低"""
+        u = self.interactions.user_index.get(userid)
+        if self.ann_index is not None and u is not None:
+            candidate_rows = self.ann_index.query(self.interactions.indicator[u])
+            candidate_rows = candidate_rows[candidate_rows != u]
+            # 候选太少时退回精确计算
+            if len(candidate_rows) >= k:
+                return top_k_rows(candidate_rows, self.candidate_similarities(userid, candidate_rows), k)
+
+        similarities = self.similarities(userid)
+        candidates = np.ones(len(similarities), dtype=bool)
+        if u is not None:
+            candidates[u] = False
+        candidate_rows = np.flatnonzero(candidates)
+        return top_k_rows(candidate_rows, similarities[candidate_rows], k)
+
+    def preference_similarity_block(self, rows):
+        """一批用户（交互矩阵行号）与所有用户的偏好相似度矩阵，离线批量计算使用"""
+        block = np.zeros((len(rows), self.interactions.user_count))
+        preference_rows = self.preference_rows[rows]
+        known_rows = np.flatnonzero(preference_rows >= 0)
+        known_columns = np.flatnonzero(self.preference_rows >= 0)
+        if len(known_rows) and len(known_columns):
+            preference_block = self.preferences.similarity_block(preference_rows[known_rows])
+            block[np.ix_(known_rows, known_columns)] = preference_block[:, self.preference_rows[known_columns]]
+        return block
+
+    def similarity_block(self, rows):
+        return (self.interactions.rating_similarity_block(rows) * 0.6 +
+                self.preference_similarity_block(rows) * 0.4)
+
+    def recommend(self, userid, k=NEIGHBOR_COUNT):
+        """按 相似度×评分 汇总相似用户听过、目标用户没听过的歌曲，返回排序后的歌曲ID"""
+        return self.recommend_with_neighbors(userid, k)[0]
+
+    def recommend_with_neighbors(self, userid, k=NEIGHBOR_COUNT):
+        """返回 (排序后的歌曲ID, 用到的相似用户ID)"""
+        neighbors = self.similar_users(userid, k)
+        if not neighbors:
+            return [], []
+
+        matrix = self.interactions.matrix
+        song_ids = rank_neighbor_songs(
+            matrix.indptr, matrix.indices, matrix.data, self.interactions.sequence, self.interactions.song_ids,
+            [row for row, _ in neighbors], [similarity for _, similarity in neighbors],
+            exclude_row=self.interactions.user_index.get(userid)
+        )
+        return song_ids, [self.interactions.user_ids[row] for row, _ in neighbors]
+
+
+def top_k_rows(rows, scores, k):
+    """返回 [(行号, 分数)] 中分数最高的 k 个，从高到低"""
+    if len(rows) == 0:
+        return []
+    k = min(k, len(rows))
+    # argpartition 找出第k大的分数，再对不低于它的行做稳定排序，保证并列时取靠前的行
+    kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    top = np.flatnonzero(scores >= kth)
+    top = top[np.lexsort((rows[top], -scores[top]))][:k]
+    return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+def rank_neighbor_songs(indptr, indices, data, sequence, song_ids, rows, weights, exclude_row=None):
+    """直接在 CSR 的三个数组上汇总相似用户的歌曲，便于同时服务内存矩阵和磁盘上的内存映射数组
+
+    分数为 相似度×评分 之和；分数相同的歌曲按在相似用户中首次出现的先后排列（先比较相似用户的名次，再比较写入顺序）
+    """
+    if len(rows) == 0:
+        return []
+
+    columns, values, keys = [], [], []
+    for position, (row, weight) in enumerate(zip(rows, weights)):
+        start, end = indptr[row], indptr[row + 1]
+        columns.append(indices[start:end])
+        values.append(np.asarray(data[start:end], dtype=np.float64) * weight)
+        keys.append(position * (len(sequence) + 1) + sequence[start:end])
+
+    candidate_columns, inverse = np.unique(np.concatenate(columns), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(values), minlength=len(candidate_columns))
+    first_seen = np.full(len(candidate_columns), np.iinfo(np.int64).max)
+    np.minimum.at(first_seen, inverse, np.concatenate(keys))
+
+    # 跳过用户已经听过的歌
+    keep = np.ones(len(candidate_columns), dtype=bool)
+    if exclude_row is not None:
+        own_columns = indices[indptr[exclude_row]:indptr[exclude_row + 1]]
+        keep = ~np.isin(candidate_columns, own_columns)
+
+    candidate_columns, scores, first_seen = candidate_columns[keep], scores[keep], first_seen[keep]
+    order = np.lexsort((first_seen, -scores))
+    return [int(song_id) for song_id in song_ids[candidate_columns[order]]]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+# 交互发生变化、还没有并入进程内矩阵的用户
+_changed_users = set()
+_refreshed_at = 0
+
+
+def get_user_cf_engine():
+    """进程内共享的在线协同过滤引擎（没有离线模型时使用）
+
+    交互矩阵和 LSH 索引首次使用或超过 USER_CF_MATRIX_MAX_AGE 秒后从数据库整体重建；期间播放、评分过的用户
+    每隔 USER_CF_REFRESH_INTERVAL 秒只重新读取这些用户的交互，替换矩阵中对应的行并加入 LSH 索引。
+    偏好索引重新加载或有新用户时重新对应行号。
+    """
+    global _engine, _refreshed_at
+    config = current_app.config
+    with _engine_lock:
+        now = time.time()
+        if _engine is None or now - _engine.loaded_at > config.get('USER_CF_MATRIX_MAX_AGE', 3600):
+            _changed_users.clear()
+            _engine = UserCFEngine.from_db()
+            _engine.loaded_at = _refreshed_at = now
+        elif _changed_users and now - _refreshed_at >= config.get('USER_CF_REFRESH_INTERVAL', 10):
+            changed = list(_changed_users)
+            _changed_users.clear()
+            # 交互只增不减，重新读取这些用户的全部交互即可替换整行
+            scores = load_interaction_scores(changed)
+            loaded_at = _engine.loaded_at
+            _engine = _engine.with_user_rows(scores) if scores else _engine
+            _engine.loaded_at, _refreshed_at = loaded_at, now
+
+        preferences = get_preference_index()
+        if preferences is not _engine.preferences or preferences.user_count != _engine.preference_count:
+            loaded_at = _engine.loaded_at
+            _engine = UserCFEngine(_engine.interactions, preferences, _engine.ann_index)
+            _engine.loaded_at = loaded_at
+        return _engine
+
+
+def record_user_interaction(userid):
+    """用户播放或评分并提交后调用；引擎还没有建立时不做任何事（建立时会从数据库读到）"""
+    with _engine_lock:
+        if _engine is not None:
+            _changed_users.add(userid)
@@ -0,0 +1,308 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from app.models import Music
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+# 拉丁字母的查询词按前缀匹配时，最多展开的词数，以及前缀匹配（而非完整匹配）的词频折扣
+MAX_PREFIX_EXPANSIONS = 64
+PREFIX_WEIGHT = 0.5
+
+# 中日韩文字连续的一段，或一个由拉丁字母、数字组成的词
+_TOKEN_RE = re.compile(
+    r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+'
+    r'|[0-9a-z\u00c0-\u024f]+'
+)
+
+
+def _is_word(token):
+    return token[0].isascii() or '\u00c0' <= token[0] <= '\u024f'
+
+
+def tokenize(text, query=False):
+    """中文等按相邻两字切分（并保留单字），拉丁字母和数字按词切分，统一转为小写
+
+    建索引时同时收录单字和双字；查询时只有单独一个汉字才用单字，其余用双字，
+    这样“晴天”只匹配含有“晴天”的歌，而不是分别含有“晴”和“天”的歌。
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if _is_word(run):
+            tokens.append(run)
+            continue
+        if not query or len(run) == 1:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class SearchIndex:
+    """歌名和歌手名的倒排索引，按 BM25 排序
+
+    主体是建立时生成的压缩数组：词（取 hash 后排序）-> 倒排表（歌曲ID、词频），与 CSR 矩阵的布局相同，
+    查找一个词是一次二分查找，100 万首歌也只占几百 MB 以内。之后新增或修改的歌曲写入一个小的增量索引，
+    修改前的版本在主体中标记为删除，查询时两部分合并；定期整体重建把增量并入主体。
+    查询的多个词之间是“与”的关系，从最短的倒排表开始求交集，再对交集计算 BM25 分数。
+    按热度搜索时用建立索引时的播放次数对整个交集排序后再截取，播放次数的变化到下次重建才反映。
+    """
+
+    def __init__(self):
+        self.hashes = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.play_counts = np.zeros(0, dtype=np.float64)
+        self.words = []
+        self.doc_count = 0
+        self.total_length = 0.0
+        # 增量部分：词 hash -> {歌曲ID: 词频}，以及每首歌的词、长度和播放次数
+        self.delta = {}
+        self.delta_docs = {}
+        self.delta_words = set()
+        # 主体中已经失效（被修改）的歌曲
+        self.removed = set()
+        self.removed_array = np.zeros(0, dtype=np.int32)
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def build(self, rows):
+        """rows: [(歌曲ID, 歌名, 歌手, 播放次数)]"""
+        rows = list(rows)
+        max_id = max((row[0] for row in rows), default=-1)
+        lengths = np.zeros(max_id + 1, dtype=np.float32)
+        play_counts = np.zeros(max_id + 1, dtype=np.float64)
+        hashes, doc_ids, tfs = [], [], []
+        words = set()
+        for song_id, title, artist, play_count in rows:
+            tokens = tokenize(title) + tokenize(artist)
+            lengths[song_id] = len(tokens)
+            play_counts[song_id] = play_count or 0
+            for token, count in Counter(tokens).items():
+                hashes.append(hash(token))
+                doc_ids.append(song_id)
+                tfs.append(count)
+                if _is_word(token):
+                    words.add(token)
+
+        hashes = np.array(hashes, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        order = np.lexsort((doc_ids, hashes))
+        hashes = hashes[order]
+        unique, starts = np.unique(hashes, return_index=True)
+
+        self.hashes = unique
+        self.indptr = np.append(starts, len(hashes)).astype(np.int64)
+        self.doc_ids = doc_ids[order]
+        self.tfs = np.array(tfs, dtype=np.float32)[order]
+        self.lengths = lengths
+        self.play_counts = play_counts
+        self.words = sorted(words)
+        self.doc_count = len(rows)
+        self.total_length = float(lengths.sum())
+        self.loaded_at = time.time()
+        return self
+
+    def load(self):
+        """从数据库建立；100 万首歌约需半分钟，由 get_search_index 在后台线程中调用"""
+        return self.build(db.session.query(Music.id, Music.title, Music.artist_name, Music.play_count).all())
+
+    def update(self, song_id, title, artist, play_count=0):
+        """新增或修改一首歌后调用"""
+        tokens = tokenize(title) + tokenize(artist)
+        with self.lock:
+            self._remove(song_id)
+            counts = Counter(tokens)
+            for token, count in counts.items():
+                self.delta.setdefault(hash(token), {})[song_id] = count
+                if _is_word(token):
+                    self.delta_words.add(token)
+            self.delta_docs[song_id] = ([hash(token) for token in counts], len(tokens), play_count or 0)
+            self.doc_count += 1
+            self.total_length += len(tokens)
+
+    def _remove(self, song_id):
+        if song_id in self.delta_docs:
+            token_hashes, length, _ = self.delta_docs.pop(song_id)
+            for token_hash in token_hashes:
+                postings = self.delta[token_hash]
+                del postings[song_id]
+                if not postings:
+                    del self.delta[token_hash]
+        elif song_id < len(self.lengths) and self.lengths[song_id] > 0 and song_id not in self.removed:
+            length = float(self.lengths[song_id])
+            self.removed.add(song_id)
+            self.removed_array = np.array(sorted(self.removed), dtype=np.int32)
+        else:
+            return
+        self.doc_count -= 1
+        self.total_length -= length
+
+    def _postings(self, token_hash):
+        """一个词的 (歌曲ID数组, 词频数组)，按歌曲ID排序"""
+        position = int(np.searchsorted(self.hashes, token_hash))
+        if position < len(self.hashes) and self.hashes[position] == token_hash:
+            start, end = self.indptr[position], self.indptr[position + 1]
+            docs, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            if len(self.removed_array):
+                keep = ~np.isin(docs, self.removed_array)
+                docs, tfs = docs[keep], tfs[keep]
+        else:
+            docs, tfs = self.doc_ids[:0], self.tfs[:0]
+
+        delta = self.delta.get(token_hash)
+        if delta:
+            docs = np.concatenate([docs, np.fromiter(delta.keys(), dtype=np.int32, count=len(delta))])
+            tfs = np.concatenate([tfs, np.fromiter(delta.values(), dtype=np.float32, count=len(delta))])
+            order = np.argsort(docs, kind='stable')
+            docs, tfs = docs[order], tfs[order]
+        return docs, tfs
+
+    def _word_postings(self, word):
+        """拉丁字母的词按前缀匹配，合并所有以它开头的词的倒排表"""
+        position = bisect.bisect_left(self.words, word)
+        expansions = []
+        while position < len(self.words) and self.words[position].startswith(word) \
+                and len(expansions) < MAX_PREFIX_EXPANSIONS:
+            expansions.append(self.words[position])
+            position += 1
+        expansions.extend(w for w in self.delta_words if w.startswith(word) and w not in expansions)
+        if expansions == [word]:
+            return self._postings(hash(word))
+
+        # 只是前缀相同的词按 PREFIX_WEIGHT 计词频，完整匹配的歌排在前面
+        postings = [
+            (docs, tfs if w == word else tfs * PREFIX_WEIGHT)
+            for w in expansions
+            for docs, tfs in [self._postings(hash(w))]
+        ]
+        docs = np.concatenate([docs for docs, _ in postings] or [self.doc_ids[:0]])
+        tfs = np.concatenate([tfs for _, tfs in postings] or [self.tfs[:0]])
+        docs, inverse = np.unique(docs, return_inverse=True)
+        return docs, np.bincount(inverse, weights=tfs, minlength=len(docs)).astype(np.float32)
+
+    def _doc_lengths(self, docs):
+        lengths = np.zeros(len(docs), dtype=np.float32)
+        in_base = docs < len(self.lengths)
+        lengths[in_base] = self.lengths[docs[in_base]]
+        # 增量部分的歌曲数很少，逐个在（已排序的）候选中二分查找
+        for doc, (_, length, _) in self.delta_docs.items():
+            position = int(np.searchsorted(docs, doc))
+            if position < len(docs) and docs[position] == doc:
+                lengths[position] = length
+        return lengths
+
+    def _play_counts(self, docs):
+        play_counts = np.zeros(len(docs), dtype=np.float64)
+        in_base = docs < len(self.play_counts)
+        play_counts[in_base] = self.play_counts[docs[in_base]]
+        for doc, (_, _, play_count) in self.delta_docs.items():
+            position = int(np.searchsorted(docs, doc))
+            if position < len(docs) and docs[position] == doc:
+                play_counts[position] = play_count
+        return play_counts
+
+    def search(self, query, limit=100, order='relevance'):
+        """返回 ([(歌曲ID, 分数)] 按 BM25 分数从高到低、最多 limit 个, 命中总数)；查询中没有可检索的词时返回 None
+
+        order 为 popularity 时先按播放次数从高到低、再按分数排序，截取之前对整个交集排序。
+        """
+        tokens = list(dict.fromkeys(tokenize(query, query=True)))
+        if not tokens:
+            return None
+
+        with self.lock:
+            postings = [
+                self._word_postings(token) if _is_word(token) else self._postings(hash(token))
+                for token in tokens
+            ]
+            postings.sort(key=lambda x: len(x[0]))
+            docs = postings[0][0]
+            for other, _ in postings[1:]:
+                if not len(docs):
+                    break
+                docs = np.intersect1d(docs, other, assume_unique=True)
+            if not len(docs):
+                return [], 0
+
+            doc_count = max(self.doc_count, 1)
+            average_length = self.total_length / doc_count or 1.0
+            norm = K1 * (1 - B + B * self._doc_lengths(docs) / average_length)
+            scores = np.zeros(len(docs), dtype=np.float64)
+            for token_docs, token_tfs in postings:
+                tf = token_tfs[np.searchsorted(token_docs, docs)]
+                df = len(token_docs)
+                idf = np.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                scores += idf * tf * (K1 + 1) / (tf + norm)
+            play_counts = self._play_counts(docs) if order == 'popularity' else None
+
+        total = len(docs)
+        if play_counts is not None:
+            top = np.lexsort((docs, -scores, -play_counts))[:limit]
+        else:
+            if total > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+                docs, scores = docs[top], scores[top]
+            top = np.lexsort((docs, -scores))
+        return [(int(docs[i]), float(scores[i])) for i in top], total
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+# 后台重建期间的修改，重建完成后补到新索引上
+_updates_during_rebuild = []
+
+
+def _rebuild(app):
+    global _index, _rebuilding
+    try:
+        with app.app_context():
+            index = SearchIndex().load()
+            db.session.remove()
+        with _index_lock:
+            for update in _updates_during_rebuild:
+                index.update(*update)
+            _index = index
+    except Exception as e:
+        print(f"Error rebuilding search index: {str(e)}")
+    finally:
+        with _index_lock:
+            _rebuilding = False
+            _updates_during_rebuild.clear()
+
+
+def get_search_index():
+    """进程内共享的搜索索引，还没有建好时返回 None（调用方改用 LIKE 查询）
+
+    首次使用或超过 SEARCH_INDEX_MAX_AGE 秒后在后台线程建立（100 万首歌约需半分钟），期间继续使用旧索引。
+    """
+    global _rebuilding
+    max_age = current_app.config.get('SEARCH_INDEX_MAX_AGE', 3600)
+    with _index_lock:
+        if (_index is None or time.time() - _index.loaded_at > max_age) and not _rebuilding:
+            _rebuilding = True
+            threading.Thread(target=_rebuild, args=(current_app._get_current_object(),), daemon=True).start()
+        return _index
+
+
+def index_song(music):
+    """新增或修改歌曲并提交后调用；索引还没有建立时不做任何事（建立时会从数据库读到）"""
+    update = (music.id, music.title, music.artist_name, music.play_count)
+    with _index_lock:
+        index = _index
+        if _rebuilding:
+            _updates_during_rebuild.append(update)
+    if index is not None:
+        index.update(*update)
@@ -0,0 +1,148 @@
+import base64
+import binascii
+import secrets
+import threading
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from app import db
+from app.models import Music
+from app.services.cache import LRUCache
+from app.services.fuzzy_index import get_fuzzy_index
+from app.services.search_index import get_search_index
+
+# 搜索结果的排序方式：relevance 为相关度（LIKE 查询时退化为歌曲ID顺序），popularity 为播放次数
+SEARCH_ORDERS = ('relevance', 'popularity')
+# LIKE 模式中的转义字符
+LIKE_ESCAPE = '\\'
+
+
+def escape_like(text):
+    """把用户输入中的 %、_、转义字符本身（以及 SQL Server 的 [）转义，放进 LIKE 模式后按普通字符匹配；
+    使用时需要同时传 escape=LIKE_ESCAPE"""
+    return ''.join(LIKE_ESCAPE + c if c in '\\%_[' else c for c in text)
+
+
+class SearchCandidates:
+    """一次搜索的全部候选歌曲ID（已排序，最多 SEARCH_MAX_CANDIDATES 个）和命中总数，翻页时从缓存中读取"""
+
+    __slots__ = ('song_ids', 'total', 'estimated')
+
+    def __init__(self, song_ids, total, estimated=False):
+        self.song_ids = song_ids
+        self.total = total
+        self.estimated = estimated
+
+
+def find_candidates(query, order, max_candidates, fuzzy=False):
+    """优先使用内存倒排索引（命中总数是求交集时顺便得到的准确值），索引不可用时用 LIKE 查询
+
+    fuzzy 为 True 时在模糊匹配索引中按编辑距离查找，容忍拼写错误；模糊匹配索引还在建立时按普通搜索处理。
+    按热度排序时各条路径都在截取 max_candidates 个之前按播放次数排序（索引中是建立时的播放次数），
+    截取后再按数据库中当前的播放次数调整顺序。
+    """
+    candidates = None
+    if fuzzy:
+        try:
+            index = get_fuzzy_index()
+            found = index.search(query, max_candidates, current_app.config.get('SEARCH_FUZZY_MAX_DISTANCE', 2),
+                                 order) if index else None
+            if found is not None:
+                candidates = SearchCandidates(*found)
+        except Exception as e:
+            print(f"Error in fuzzy index, falling back to exact search: {str(e)}")
+    if candidates is None and current_app.config.get('SEARCH_INDEX_ENABLED', True):
+        try:
+            index = get_search_index()
+            found = index.search(query, max_candidates, order) if index else None
+            if found is not None:
+                ranked, total = found
+                candidates = SearchCandidates([song_id for song_id, _ in ranked], total)
+        except Exception as e:
+            print(f"Error in search index, falling back to LIKE: {str(e)}")
+    if candidates is None:
+        candidates = _like_candidates(query, order, max_candidates)
+
+    if order == 'popularity' and candidates.song_ids:
+        play_counts = dict(db.session.query(Music.id, Music.play_count).filter(Music.id.in_(candidates.song_ids)))
+        # 播放次数相同时保持相关度顺序
+        candidates.song_ids.sort(key=lambda song_id: -(play_counts.get(song_id) or 0))
+    return candidates
+
+
+def _like_candidates(query, order, max_candidates):
+    """按歌曲ID顺序取前 max_candidates + 1 个匹配；超出时按最后一个匹配的ID占最大ID的比例估计总数，不做 COUNT
+
+    按热度排序时数据库本来就要读出全部匹配再排序，总数用窗口函数在同一个查询中得到。
+    """
+    pattern = f'%{escape_like(query)}%'
+    matches = or_(
+        Music.title.like(pattern, escape=LIKE_ESCAPE),
+        Music.artist_name.like(pattern, escape=LIKE_ESCAPE)
+    )
+    if order == 'popularity':
+        rows = db.session.query(Music.id, func.count().over()).filter(matches) \
+            .order_by(Music.play_count.desc(), Music.id).limit(max_candidates).all()
+        return SearchCandidates([row[0] for row in rows], rows[0][1] if rows else 0)
+
+    rows = db.session.query(Music.id).filter(matches).order_by(Music.id).limit(max_candidates + 1).all()
+    song_ids = [row.id for row in rows]
+    if len(song_ids) <= max_candidates:
+        return SearchCandidates(song_ids, len(song_ids))
+
+    song_ids = song_ids[:max_candidates]
+    max_id = db.session.query(func.max(Music.id)).scalar() or song_ids[-1]
+    estimate = int(max_candidates * max_id / max(song_ids[-1], 1))
+    return SearchCandidates(song_ids, max(estimate, max_candidates + 1), estimated=True)
+
+
+def encode_cursor(key, offset):
+    return base64.urlsafe_b64encode(f'{key}:{offset}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """返回 (缓存键, 偏移)，格式不对时抛出 ValueError"""
+    try:
+        key, offset = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+        offset = int(offset)
+    except (UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+    if offset < 0:
+        raise ValueError('negative offset')
+    return key, offset
+
+
+def search_page(query, order='relevance', limit=20, cursor=None, fuzzy=False):
+    """一页搜索结果，返回 (歌曲ID列表, 候选集, 下一页的游标或 None)
+
+    第一页计算候选集并放入短期缓存，游标中只有缓存键和偏移；后续页直接从缓存切片，不再重新检索。
+    缓存过期后按同样的查询重新计算，从游标中的偏移继续。
+    """
+    config = current_app.config
+    cache = get_search_cache()
+    key, offset = decode_cursor(cursor) if cursor else (None, 0)
+    candidates = cache.get((key, query, order, fuzzy)) if key else None
+    if candidates is None:
+        candidates = find_candidates(query, order, config.get('SEARCH_MAX_CANDIDATES', 1000), fuzzy)
+        key = secrets.token_urlsafe(9)
+        cache.put((key, query, order, fuzzy), candidates)
+
+    song_ids = candidates.song_ids[offset:offset + limit]
+    next_offset = offset + len(song_ids)
+    next_cursor = encode_cursor(key, next_offset) if next_offset < len(candidates.song_ids) else None
+    return song_ids, candidates, next_cursor
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    """进程内共享的候选集缓存，容量和过期时间见 SEARCH_CURSOR_CACHE_SIZE、SEARCH_CURSOR_TTL"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LRUCache(current_app.config.get('SEARCH_CURSOR_CACHE_SIZE', 1000),
+                              current_app.config.get('SEARCH_CURSOR_TTL', 300))
+        return _cache
@@ -0,0 +1,244 @@
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from app.models import Music
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    # 没有安装 pypinyin 时只能按原文前缀补全
+    lazy_pinyin = None
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower().strip()
+
+
+def suggestion_keys(text):
+    """一个歌名或歌手名可以被补全的键：原文，以及含有汉字时的全拼（qingtian）和首字母（qt）"""
+    text = normalize(text)
+    if not text:
+        return []
+    keys = [text]
+    if lazy_pinyin is not None and any('\u4e00' <= char <= '\u9fff' for char in text):
+        syllables = [syllable for syllable in lazy_pinyin(text) if syllable.strip()]
+        full = ''.join(syllables).replace(' ', '')
+        initials = ''.join(syllable[0] for syllable in syllables if syllable[0].isalnum())
+        keys.extend(key for key in (full, initials) if key and key not in keys)
+    return keys
+
+
+class SuggestIndex:
+    """歌名、歌手名的前缀补全索引
+
+    所有键按 UTF-8 字节序排好后拼成一整块 bytes，另存偏移和对应的补全目标，前缀查询是一次二分查找，
+    比每个键一个 Python 字符串省得多。短前缀（前 depth 个字符）是字典树的节点，预先算好按播放次数
+    排序的前 top_n 个补全；depth 按 max_nodes（内存预算）尽量取大。更长的前缀命中的键很少，
+    直接在二分查找得到的区间里取播放次数最多的几个。
+    新增或修改的歌曲写入小的增量部分，修改前的歌曲标记为删除，查询时合并；定期整体重建。
+    """
+
+    def __init__(self, top_n=10, max_nodes=200000):
+        self.top_n = top_n
+        self.max_nodes = max_nodes
+        # 补全目标：(类型 song/artist, 显示文字, 歌曲ID)，以及权重（播放次数，歌手为其所有歌曲之和）
+        self.targets = []
+        self.weights = np.zeros(0, dtype=np.float64)
+        self.target_songs = np.zeros(0, dtype=np.int64)
+        self.blob = b''
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.key_targets = np.zeros(0, dtype=np.int32)
+        self.nodes = {}
+        self.depth = 0
+        self.artists = {}
+        # 增量部分：[(键, 目标)]、目标的权重；以及主体中已失效的歌曲
+        self.delta = []
+        self.removed = set()
+        self.removed_array = np.zeros(0, dtype=np.int64)
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def build(self, songs):
+        """songs: [(歌曲ID, 歌名, 歌手, 播放次数)]"""
+        targets, weights, artists = [], [], {}
+        entries = []
+        for song_id, title, artist, play_count in songs:
+            target = len(targets)
+            targets.append(('song', title, song_id))
+            weights.append(play_count or 0)
+            entries.extend((key.encode('utf-8'), target) for key in suggestion_keys(title))
+            if artist:
+                if artist not in artists:
+                    artists[artist] = len(targets)
+                    targets.append(('artist', artist, None))
+                    weights.append(0)
+                    entries.extend((key.encode('utf-8'), artists[artist]) for key in suggestion_keys(artist))
+                weights[artists[artist]] += play_count or 0
+        entries.sort()
+
+        lengths = np.fromiter((len(key) for key, _ in entries), dtype=np.int64, count=len(entries))
+        self.targets = targets
+        self.weights = np.array(weights, dtype=np.float64)
+        self.target_songs = np.array([-1 if song_id is None else song_id for _, _, song_id in targets], dtype=np.int64)
+        self.artists = artists
+        self.blob = b''.join(key for key, _ in entries)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.key_targets = np.fromiter((target for _, target in entries), dtype=np.int32, count=len(entries))
+        self._build_nodes([key for key, _ in entries])
+        self.loaded_at = time.time()
+        return self
+
+    def _build_nodes(self, keys):
+        """逐层加深，直到节点数超出 max_nodes；节点为前缀字符串，值为前 top_n 个补全目标"""
+        self.nodes, self.depth = {}, 0
+        texts = [key.decode('utf-8') for key in keys]
+        for depth in range(1, 64):
+            ranges = {}
+            for position, text in enumerate(texts):
+                if len(text) >= depth:
+                    prefix = text[:depth]
+                    start, _ = ranges.get(prefix, (position, position))
+                    ranges[prefix] = (start, position + 1)
+            if not ranges or len(self.nodes) + len(ranges) > self.max_nodes:
+                break
+            for prefix, (start, end) in ranges.items():
+                self.nodes[prefix] = self._top_targets(start, end, self.top_n)
+            self.depth = depth
+
+    def _top_targets(self, start, end, n):
+        """键区间 [start, end) 中权重最大的 n 个不同目标，跳过已失效的歌曲"""
+        candidates = self._live(np.unique(self.key_targets[start:end]))
+        if len(candidates) > n:
+            top = np.argpartition(-self.weights[candidates], n - 1)[:n]
+            candidates = candidates[top]
+        order = np.lexsort((candidates, -self.weights[candidates]))
+        return candidates[order].astype(np.int32)
+
+    def _key(self, position):
+        return self.blob[self.offsets[position]:self.offsets[position + 1]]
+
+    def _range(self, prefix):
+        """以 prefix 开头的键所在的区间"""
+        prefix = prefix.encode('utf-8')
+        low, high = 0, len(self.key_targets)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        start, high = low, len(self.key_targets)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle)[:len(prefix)] == prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return start, low
+
+    def _live(self, candidates):
+        if len(self.removed_array):
+            candidates = candidates[~np.isin(self.target_songs[candidates], self.removed_array)]
+        return candidates
+
+    def update(self, song_id, title, artist, play_count=0):
+        """新增或修改一首歌后调用"""
+        with self.lock:
+            if song_id not in self.removed:
+                self.removed.add(song_id)
+                self.removed_array = np.array(sorted(self.removed), dtype=np.int64)
+            self.delta = [(key, entry) for key, entry in self.delta if entry[0][2] != song_id]
+            target = ('song', title, song_id)
+            self.delta.extend((key, (target, play_count or 0)) for key in suggestion_keys(title))
+            if artist and artist not in self.artists and not any(t[0][1] == artist for _, t in self.delta):
+                self.delta.extend((key, (('artist', artist, None), play_count or 0)) for key in suggestion_keys(artist))
+
+    def suggest(self, prefix, limit=10):
+        """返回 [(类型, 显示文字, 歌曲ID)]，按播放次数从高到低"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            node = self.nodes.get(prefix) if len(prefix) <= self.depth else None
+            if node is not None:
+                # 前 top_n 个去掉已失效的歌曲后，仍是其余目标中最靠前的
+                node = self._live(node)
+            if node is not None and len(node) >= limit:
+                base = node[:limit]
+            else:
+                start, end = self._range(prefix)
+                base = self._top_targets(start, end, limit)
+            results = [(self.weights[t], self.targets[t]) for t in base.tolist()]
+            seen = {target for _, target in results}
+            for key, (target, weight) in self.delta:
+                if key.startswith(prefix) and target not in seen:
+                    seen.add(target)
+                    results.append((weight, target))
+        results.sort(key=lambda x: -x[0])
+        return [target for _, target in results[:limit]]
+
+
+def _load_songs():
+    return db.session.query(Music.id, Music.title, Music.artist_name, Music.play_count).all()
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+# 后台重建期间的修改，重建完成后补到新索引上
+_updates_during_rebuild = []
+
+
+def _rebuild(app):
+    global _index, _rebuilding
+    try:
+        with app.app_context():
+            config = app.config
+            index = SuggestIndex(config.get('SUGGEST_TOP_N', 10), config.get('SUGGEST_MAX_NODES', 200000))
+            index.build(_load_songs())
+            db.session.remove()
+        with _index_lock:
+            for update in _updates_during_rebuild:
+                index.update(*update)
+            _index = index
+    except Exception as e:
+        print(f"Error building suggest index: {str(e)}")
+    finally:
+        with _index_lock:
+            _rebuilding = False
+            _updates_during_rebuild.clear()
+
+
+def start_suggest_index(app):
+    """在后台线程建立（或重建）补全索引，应用启动时调用"""
+    global _rebuilding
+    with _index_lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=_rebuild, args=(app,), daemon=True).start()
+
+
+def get_suggest_index():
+    """进程内共享的补全索引，还没有建好时返回 None；超过 SUGGEST_MAX_AGE 秒后在后台重建以更新播放次数权重"""
+    with _index_lock:
+        index = _index
+    if index is None or time.time() - index.loaded_at > current_app.config.get('SUGGEST_MAX_AGE', 3600):
+        start_suggest_index(current_app._get_current_object())
+    return index
+
+
+def suggest_song(music):
+    """新增或修改歌曲并提交后调用"""
+    update = (music.id, music.title, music.artist_name, music.play_count)
+    with _index_lock:
+        index = _index
+        if _rebuilding:
+            _updates_during_rebuild.append(update)
+    if index is not None:
+        index.update(*update)
@@ -0,0 +1,291 @@
+import heapq
+import json
+import threading
+import time
+from datetime import datetime, UTC
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import DailyUserSongPlay, Music, UserPlayHistory, UserTasteProfile
+
+# 更新画像时遇到并发修改的最多重试次数
+MAX_RETRIES = 3
+
+
+class TasteProfile:
+    """一个用户各音乐类型、歌手的衰减播放量
+
+    t 时刻的一次播放在 now 时的权重为 2^(-(now - t) / half_life)。与实时热门榜一样采用前向衰减：
+    记录时按 2^((t - landmark) / half_life) 放大，读取时统一缩小，记一次播放只改两个计数，是 O(1) 的。
+    衰减计数是可加的，两个画像（例如数据库中的画像和进程内尚未写入的增量）可以直接合并。
+    built_at 为从播放记录计算画像的时间，在此之前写入数据库的播放都已计入。
+    """
+
+    __slots__ = ('landmark', 'total', 'genres', 'artists', 'built_at')
+
+    # 前向衰减的指数超过该值时重新选取 landmark
+    RESCALE_EXPONENT = 30
+
+    def __init__(self, landmark, total=0.0, genres=None, artists=None, built_at=0):
+        self.landmark = landmark
+        self.total = total
+        self.genres = genres or {}
+        self.artists = artists or {}
+        self.built_at = built_at
+
+    def _scale(self, factor):
+        self.total *= factor
+        for counts in (self.genres, self.artists):
+            for key in counts:
+                counts[key] *= factor
+
+    def rebase(self, landmark, half_life):
+        """把 landmark 移到新的时间点，计数同比例换算"""
+        self._scale(2.0 ** ((self.landmark - landmark) / half_life))
+        self.landmark = landmark
+
+    def add(self, genre, artist, played_at, half_life, count=1):
+        if (played_at - self.landmark) / half_life > self.RESCALE_EXPONENT:
+            self.rebase(played_at, half_life)
+        weight = count * 2.0 ** ((played_at - self.landmark) / half_life)
+        self.total += weight
+        if genre:
+            self.genres[genre] = self.genres.get(genre, 0.0) + weight
+        if artist:
+            self.artists[artist] = self.artists.get(artist, 0.0) + weight
+
+    def merge(self, other, half_life):
+        other = other.copy()
+        if other.landmark > self.landmark:
+            self.rebase(other.landmark, half_life)
+        else:
+            other.rebase(self.landmark, half_life)
+        self.total += other.total
+        for counts, others in ((self.genres, other.genres), (self.artists, other.artists)):
+            for key, value in others.items():
+                counts[key] = counts.get(key, 0.0) + value
+
+    def copy(self):
+        return TasteProfile(self.landmark, self.total, dict(self.genres), dict(self.artists), self.built_at)
+
+    def decayed(self, now, half_life):
+        """返回 (总量, {类型: 值}, {歌手: 值})，均为衰减到 now 的值"""
+        factor = 2.0 ** (-(now - self.landmark) / half_life)
+        return (
+            self.total * factor,
+            {genre: value * factor for genre, value in self.genres.items()},
+            {artist: value * factor for artist, value in self.artists.items()},
+        )
+
+    def to_json(self, max_artists):
+        """只保留计数最大的 max_artists 个歌手，数值保留三位小数"""
+        artists = heapq.nlargest(max_artists, self.artists.items(), key=lambda x: x[1])
+        return json.dumps({
+            't': self.landmark,
+            'n': round(self.total, 3),
+            'g': {genre: round(value, 3) for genre, value in self.genres.items()},
+            'a': {artist: round(value, 3) for artist, value in artists},
+            'b': self.built_at,
+        }, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(data['t'], data['n'], data['g'], data['a'], data.get('b', 0))
+
+
+def build_profile(userid, half_life, now=None):
+    """从播放记录（已归档的部分读每日统计）计算画像，只看最近 8 个半衰期，更早的权重不到 0.4%"""
+    now = now or time.time()
+    since = datetime.fromtimestamp(now - 8 * half_life, UTC)
+    profile = TasteProfile(now, built_at=now)
+    for genre, artist, played_at in db.session.query(
+        Music.genre,
+        Music.artist_name,
+        UserPlayHistory.played_at
+    ).join(
+        Music, Music.id == UserPlayHistory.music_id
+    ).filter(
+        UserPlayHistory.userid == userid,
+        UserPlayHistory.played_at >= since
+    ):
+        profile.add(genre, artist, _timestamp(played_at), half_life)
+    for genre, artist, last_played, play_count in db.session.query(
+        Music.genre,
+        Music.artist_name,
+        DailyUserSongPlay.last_played,
+        DailyUserSongPlay.play_count
+    ).join(
+        Music, Music.id == DailyUserSongPlay.music_id
+    ).filter(
+        DailyUserSongPlay.userid == userid,
+        DailyUserSongPlay.day >= since.date()
+    ):
+        profile.add(genre, artist, _timestamp(last_played), half_life, play_count)
+    return profile
+
+
+def _timestamp(value):
+    # 数据库读出的不带时区的时间按 UTC 处理
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.timestamp()
+
+
+class TasteProfileStore:
+    """进程内攒下的画像增量，定期合并进 user_taste_profiles
+
+    播放写入数据库后调用 record_play，在内存中记下这次播放和记录的时间；每隔 flush_interval 秒把有变化的用户的增量
+    合并到数据库中的画像（乐观锁，并发修改时重读重试）。数据库中还没有画像的用户直接从播放记录计算。
+    画像从播放记录计算之前就已经记下的播放都已写入数据库、包含在画像中，合并增量时跳过，避免重复计算；
+    这同样适用于别的进程刚刚计算好的画像。读取时返回数据库中的画像加上本进程尚未写入的增量。
+    """
+
+    def __init__(self, half_life, max_artists=50, flush_interval=30):
+        self.half_life = half_life
+        self.max_artists = max_artists
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flushed_at = time.time()
+        self.lock = threading.Lock()
+
+    def record_play(self, userid, genre, artist, played_at):
+        with self.lock:
+            self.pending.setdefault(userid, []).append((time.time(), genre, artist, played_at))
+
+    def _delta(self, plays, built_at):
+        """plays 中在画像计算之后才记下的播放组成的增量，没有这样的播放时返回 None"""
+        delta = None
+        for recorded_at, genre, artist, played_at in plays:
+            if recorded_at < built_at:
+                continue
+            if delta is None:
+                delta = TasteProfile(played_at)
+            delta.add(genre, artist, played_at, self.half_life)
+        return delta
+
+    def flush_due(self):
+        return time.time() - self.flushed_at >= self.flush_interval
+
+    def flush(self):
+        """把增量写入数据库并提交，返回写入的用户数"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.time()
+        try:
+            for userid, plays in pending.items():
+                self._save(userid, plays)
+            db.session.commit()
+        except Exception:
+            # 写入失败时把增量放回去，下次再写
+            db.session.rollback()
+            with self.lock:
+                for userid, plays in pending.items():
+                    self.pending[userid] = plays + self.pending.get(userid, [])
+            raise
+        return len(pending)
+
+    def _save(self, userid, plays):
+        for _ in range(MAX_RETRIES):
+            row = db.session.get(UserTasteProfile, userid, populate_existing=True)
+            if row is None:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(self._new_row(userid))
+                    return
+                except IntegrityError:
+                    # 另一个进程刚刚创建了画像，改为合并
+                    continue
+            profile = TasteProfile.from_json(row.profile)
+            delta = self._delta(plays, profile.built_at)
+            if delta is None:
+                return
+            profile.merge(delta, self.half_life)
+            updated = UserTasteProfile.query.filter_by(userid=userid, version=row.version).update({
+                'profile': profile.to_json(self.max_artists),
+                'version': row.version + 1,
+                'updated_at': datetime.now(UTC),
+            }, synchronize_session=False)
+            if updated:
+                return
+        print(f"Error saving taste profile for {userid}: too many concurrent updates")
+
+    def _new_row(self, userid):
+        profile = build_profile(userid, self.half_life)
+        return UserTasteProfile(userid=userid, profile=profile.to_json(self.max_artists),
+                                version=0, updated_at=datetime.now(UTC))
+
+    def get(self, userid):
+        """数据库中的画像加上本进程尚未写入的增量；还没有画像时从播放记录计算并保存"""
+        row = db.session.get(UserTasteProfile, userid)
+        if row is None:
+            row = self._new_row(userid)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(row)
+                db.session.commit()
+                # 新画像已经包含了本进程尚未写入的增量
+                with self.lock:
+                    self.pending.pop(userid, None)
+            except IntegrityError:
+                db.session.rollback()
+                row = db.session.get(UserTasteProfile, userid)
+        profile = TasteProfile.from_json(row.profile)
+        with self.lock:
+            delta = self._delta(self.pending.get(userid, ()), profile.built_at)
+        if delta is not None:
+            profile.merge(delta, self.half_life)
+        return profile
+
+    def features(self, userid, now=None):
+        """用户特征：衰减后的总播放量，以及各音乐类型、歌手所占的比例（和为 1）"""
+        total, genres, artists = self.get(userid).decayed(now or time.time(), self.half_life)
+        if total <= 0:
+            return {'total': 0.0, 'genres': {}, 'artists': {}}
+        return {
+            'total': total,
+            'genres': {genre: value / total for genre, value in genres.items()},
+            'artists': {artist: value / total for artist, value in artists.items()},
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_taste_profiles():
+    """进程内共享的画像存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = current_app.config
+            _store = TasteProfileStore(
+                config.get('TASTE_PROFILE_HALF_LIFE_DAYS', 21) * 24 * 3600,
+                config.get('TASTE_PROFILE_MAX_ARTISTS', 50),
+                config.get('TASTE_PROFILE_FLUSH_INTERVAL', 30)
+            )
+        return _store
+
+
+def record_taste_plays(plays):
+    """plays: [(userid, 类型, 歌手, 播放时间)]，在播放写入数据库之后调用；到了写入间隔时顺便写入画像"""
+    store = get_taste_profiles()
+    for userid, genre, artist, played_at in plays:
+        store.record_play(userid, genre, artist, _timestamp(played_at))
+    if store.flush_due():
+        flush_taste_profiles()
+
+
+def flush_taste_profiles():
+    """立即写入本进程攒下的画像增量（进程退出前调用）；失败时增量保留到下次"""
+    try:
+        get_taste_profiles().flush()
+    except Exception as e:
+        print(f"Error flushing taste profiles: {str(e)}")
+
+
+def get_taste_features(userid):
+    """供其他模块使用的用户口味特征，见 TasteProfileStore.features"""
+    return get_taste_profiles().features(userid)
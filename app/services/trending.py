@@ -0,0 +1,288 @@
+import atexit
+import glob
+import heapq
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+
+
+class DecayedSpaceSaving:
+    """带时间衰减的 Space-Saving 流式 Top-K（Metwally 等 2005），最多保存 capacity 个计数器
+
+    时间衰减：t 时刻的一次播放权重为 2^(-(当前时间 - t) / half_life)。实现上采用“前向衰减”，
+    记录时按 2^((t - landmark) / half_life) 放大，查询时统一乘 2^(-(now - landmark) / half_life)，
+    所有计数同比例缩放，排名不变；指数过大时把 landmark 移到当前时间并整体缩小，避免溢出。
+
+    误差界（对衰减后的权重同样成立，因为衰减只是对所有计数同比例缩放）：
+      设 N 为全部播放的衰减权重之和，m = capacity，
+      1. 每个被保存的元素：真实值 ≤ 估计值 ≤ 真实值 + error，其中 error ≤ 最小计数 ≤ N / m；
+      2. 真实值大于 N / m 的元素一定在保存的计数器中；
+      3. 估计值减去 error 是真实值的下界，可据此判断某个元素是否确定进入前 K。
+    内存只与 capacity 有关，与歌曲总数无关。
+    """
+
+    # 前向衰减的指数超过该值时重新选取 landmark
+    RESCALE_EXPONENT = 30
+
+    def __init__(self, capacity=200, half_life=1800, now=None):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.landmark = time.time() if now is None else now
+        # item -> [计数, 误差]，均为相对 landmark 放大后的值
+        self.counters = {}
+        self.heap = []
+        self.total = 0.0
+
+    def _rescale(self, now):
+        factor = 2.0 ** (-(now - self.landmark) / self.half_life)
+        for counter in self.counters.values():
+            counter[0] *= factor
+            counter[1] *= factor
+        self.total *= factor
+        self.landmark = now
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self.heap = [(counter[0], item) for item, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def _pop_min(self):
+        """堆中同一元素可能有多个过期的旧计数，弹出时跳过与当前计数不一致的项"""
+        while True:
+            count, item = heapq.heappop(self.heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                return item, count
+
+    def add(self, item, now=None):
+        now = time.time() if now is None else now
+        if (now - self.landmark) / self.half_life > self.RESCALE_EXPONENT:
+            self._rescale(now)
+        weight = 2.0 ** ((now - self.landmark) / self.half_life)
+        self.total += weight
+
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[item] = [weight, 0.0]
+        else:
+            # 替换计数最小的元素，新元素继承它的计数，并把它记为误差
+            evicted, count = self._pop_min()
+            del self.counters[evicted]
+            counter = self.counters[item] = [count + weight, count]
+        heapq.heappush(self.heap, (counter[0], item))
+        if len(self.heap) > 4 * self.capacity + 16:
+            self._rebuild_heap()
+
+    def top(self, n, now=None):
+        """返回 [(元素, 衰减后的估计值, 误差上界)]，按估计值从高到低"""
+        now = time.time() if now is None else now
+        scale = 2.0 ** (-(now - self.landmark) / self.half_life)
+        ranked = heapq.nlargest(n, self.counters.items(), key=lambda x: x[1][0])
+        return [(item, count * scale, error * scale) for item, (count, error) in ranked]
+
+    def error_bound(self, now=None):
+        """任何元素估计值的最大误差 N / m（衰减后）"""
+        now = time.time() if now is None else now
+        return self.total * 2.0 ** (-(now - self.landmark) / self.half_life) / self.capacity
+
+    def merge(self, other):
+        """并入另一个计数器（可合并摘要，Agarwal 等 2012）：两边的计数和误差相加，只在一边出现的元素
+        按另一边的最小计数补上（另一边已满时，它在那边的真实值最多为最小计数），最后保留计数最大的 capacity 个。
+        合并后误差界仍为 N / m，N 为两边播放的衰减权重之和。"""
+        if other.landmark > self.landmark:
+            self._rescale(other.landmark)
+        scale = 2.0 ** ((other.landmark - self.landmark) / self.half_life)
+        floor = min((counter[0] for counter in self.counters.values()), default=0.0) \
+            if len(self.counters) >= self.capacity else 0.0
+        other_floor = min((counter[0] for counter in other.counters.values()), default=0.0) * scale \
+            if len(other.counters) >= other.capacity else 0.0
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, (floor, floor))
+            counter = other.counters.get(item)
+            other_count, other_error = (counter[0] * scale, counter[1] * scale) if counter is not None \
+                else (other_floor, other_floor)
+            merged[item] = [count + other_count, error + other_error]
+        self.total += other.total * scale
+        self.counters = dict(heapq.nlargest(self.capacity, merged.items(), key=lambda x: x[1][0]))
+        self._rebuild_heap()
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'half_life': self.half_life,
+            'landmark': self.landmark,
+            'total': self.total,
+            'counters': [[item, count, error] for item, (count, error) in self.counters.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data, capacity=None, half_life=None):
+        """从快照恢复；capacity 变小时只保留计数最大的那些"""
+        sketch = cls(capacity or data['capacity'], half_life or data['half_life'], data['landmark'])
+        sketch.total = data['total']
+        counters = sorted(data['counters'], key=lambda x: x[1], reverse=True)[:sketch.capacity]
+        sketch.counters = {item: [count, error] for item, count, error in counters}
+        sketch._rebuild_heap()
+        return sketch
+
+
+def snapshot_path(path, pid=None):
+    """每个进程一个快照文件：TRENDING_SNAPSHOT_PATH 的文件名加上进程号"""
+    root, ext = os.path.splitext(path)
+    return f'{root}.{os.getpid() if pid is None else pid}{ext}'
+
+
+class TrendingChart:
+    """实时热门歌曲和歌手，由播放接口逐条更新，定期把状态快照到磁盘，重启后从快照恢复
+
+    每个进程只把自己记录的播放（own_songs、own_artists）写入自己的快照文件，榜单（songs、artists）是本进程的计数
+    加上其他进程快照的合并，这样同一次播放只出现在一个快照中，合并时不会重复计算。
+    其他进程的播放要等它们保存快照、本进程重新合并（refresh）之后才会出现在榜单中。
+    """
+
+    def __init__(self, capacity=200, half_life=1800):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.songs = DecayedSpaceSaving(capacity, half_life)
+        self.artists = DecayedSpaceSaving(capacity, half_life)
+        self.own_songs = DecayedSpaceSaving(capacity, half_life)
+        self.own_artists = DecayedSpaceSaving(capacity, half_life)
+        self.saved_at = time.time()
+        self.merged_at = time.time()
+        self.lock = threading.Lock()
+
+    def record_play(self, song_id, artist, snapshot_interval=None):
+        """记录一次播放；距上次快照超过 snapshot_interval 秒时返回 True，由调用方保存快照"""
+        with self.lock:
+            self.songs.add(song_id)
+            self.own_songs.add(song_id)
+            if artist:
+                self.artists.add(artist)
+                self.own_artists.add(artist)
+            if snapshot_interval is not None and time.time() - self.saved_at > snapshot_interval:
+                self.saved_at = time.time()
+                return True
+        return False
+
+    def top(self, n=10):
+        """返回 (歌曲 [(歌曲ID, 分数, 误差)], 歌手 [(歌手, 分数, 误差)], 歌曲误差上界, 歌手误差上界)"""
+        with self.lock:
+            return self.songs.top(n), self.artists.top(n), self.songs.error_bound(), self.artists.error_bound()
+
+    def save(self, path):
+        """把本进程记录的播放写入本进程的快照文件；先写（带进程号的）临时文件再替换，崩溃时不会留下写了一半的快照"""
+        with self.lock:
+            data = {'songs': self.own_songs.to_dict(), 'artists': self.own_artists.to_dict()}
+            self.saved_at = time.time()
+        path = snapshot_path(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def refresh(self, path):
+        """重新合并其他进程的快照：榜单换成本进程的计数加上其他进程最新快照的合并
+
+        读文件在锁外进行，锁内只做合并（与快照个数和 capacity 成正比），不阻塞播放记录。
+        """
+        others = [
+            (songs, artists)
+            for snapshot, songs, artists in read_snapshots(path, self.capacity, self.half_life)
+            if snapshot != snapshot_path(path)
+        ]
+        with self.lock:
+            songs = DecayedSpaceSaving.from_dict(self.own_songs.to_dict())
+            artists = DecayedSpaceSaving.from_dict(self.own_artists.to_dict())
+            for other_songs, other_artists in others:
+                songs.merge(other_songs)
+                artists.merge(other_artists)
+            self.songs, self.artists = songs, artists
+            self.merged_at = time.time()
+
+    @classmethod
+    def load(cls, path, capacity=200, half_life=1800):
+        """合并所有进程的快照，不存在或损坏的快照跳过
+
+        进程号与某个旧快照相同时，那个快照并入本进程自己的计数，之后由本进程覆盖。
+        """
+        chart = cls(capacity, half_life)
+        own_path = snapshot_path(path)
+        for snapshot, songs, artists in read_snapshots(path, capacity, half_life):
+            chart.songs.merge(songs)
+            chart.artists.merge(artists)
+            if snapshot == own_path:
+                chart.own_songs, chart.own_artists = songs, artists
+        return chart
+
+
+def read_snapshots(path, capacity, half_life):
+    """读取所有进程的快照，返回 [(快照文件, 歌曲计数器, 歌手计数器)]，不存在或损坏的快照跳过
+
+    超过 8 个半衰期没有更新的快照（权重已不到 0.4%）不再合并并删除，避免已退出进程的快照越积越多。
+    """
+    snapshots = []
+    root, ext = os.path.splitext(path)
+    for snapshot in sorted(glob.glob(glob.escape(root) + '.*' + ext)):
+        try:
+            if time.time() - os.path.getmtime(snapshot) > 8 * half_life:
+                os.remove(snapshot)
+                continue
+            with open(snapshot, encoding='utf-8') as f:
+                data = json.load(f)
+            songs = DecayedSpaceSaving.from_dict(data['songs'], capacity, half_life)
+            artists = DecayedSpaceSaving.from_dict(data['artists'], capacity, half_life)
+        except (OSError, ValueError, KeyError):
+            continue
+        snapshots.append((snapshot, songs, artists))
+    return snapshots
+
+
+_chart = None
+_chart_path = None
+_chart_lock = threading.Lock()
+
+
+def _save_on_exit():
+    if _chart is not None:
+        _chart.save(_chart_path)
+
+
+def get_trending_chart():
+    """进程内共享的实时热门榜，首次使用时合并各进程的快照，之后每隔 TRENDING_SNAPSHOT_INTERVAL 秒重新合并其他进程的快照"""
+    global _chart, _chart_path
+    interval = current_app.config.get('TRENDING_SNAPSHOT_INTERVAL', 60)
+    with _chart_lock:
+        if _chart is None:
+            _chart_path = current_app.config['TRENDING_SNAPSHOT_PATH']
+            _chart = TrendingChart.load(_chart_path, current_app.config.get('TRENDING_CAPACITY', 200),
+                                        current_app.config.get('TRENDING_HALF_LIFE', 1800))
+            atexit.register(_save_on_exit)
+            return _chart
+        chart = _chart
+        stale = time.time() - chart.merged_at > interval
+        if stale:
+            # 先更新时间，其他线程不会同时重新合并
+            chart.merged_at = time.time()
+    if stale:
+        try:
+            chart.refresh(_chart_path)
+        except OSError as e:
+            print(f"Error merging trending snapshots: {str(e)}")
+    return chart
+
+
+def record_trending_play(song_id, artist):
+    """记录一次播放，距上次快照超过 TRENDING_SNAPSHOT_INTERVAL 秒时顺便保存快照"""
+    chart = get_trending_chart()
+    if chart.record_play(song_id, artist, current_app.config.get('TRENDING_SNAPSHOT_INTERVAL', 60)):
+        try:
+            chart.save(_chart_path)
+        except OSError as e:
+            # 快照失败不影响播放记录，下个周期再试
+            print(f"Error saving trending snapshot: {str(e)}")
@@ -0,0 +1,128 @@
+import numpy as np
+from flask import current_app
+
+from app.services.model_store import write_artifact, get_artifact_store, id_lookup_arrays, find_row
+from app.services.preference_index import get_preference_index
+from app.services.recommender import NEIGHBOR_COUNT, rank_neighbor_songs
+
+ARTIFACT_KIND = 'user_cf'
+
+# 离线保存的候选邻居数，比线上使用的 NEIGHBOR_COUNT 多，留给在线重排
+CANDIDATE_COUNT = 20
+
+# 每批相似度矩阵的元素个数上限（约 64MB 的 float64）
+BLOCK_BUDGET = 2 ** 23
+
+
+def build_neighbor_table(engine, k=CANDIDATE_COUNT, block_budget=BLOCK_BUDGET):
+    """分批计算每个用户的前 k 个相似用户，返回 (邻居行号, 最终相似度, 评分相似度)"""
+    n = engine.interactions.user_count
+    k = min(k, max(n - 1, 0))
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k))
+    rating_scores = np.zeros((n, k))
+    if k == 0:
+        return neighbors, scores, rating_scores
+
+    block_rows = max(1, block_budget // n)
+    for start in range(0, n, block_rows):
+        rows = np.arange(start, min(n, start + block_rows))
+        rating = engine.interactions.rating_similarity_block(rows)
+        similarities = rating * 0.6 + engine.preference_similarity_block(rows) * 0.4
+        # 排除自己
+        similarities[np.arange(len(rows)), rows] = -np.inf
+
+        # 与在线计算一致：argpartition 找出第k大的相似度，并列时取行号靠前的用户
+        kth = np.take_along_axis(similarities, np.argpartition(-similarities, k - 1, axis=1)[:, k - 1:k], axis=1)
+        for i, row in enumerate(rows):
+            top = np.flatnonzero(similarities[i] >= kth[i])
+            top = top[np.argsort(-similarities[i, top], kind='stable')][:k]
+            neighbors[row] = top
+            scores[row] = similarities[i, top]
+            rating_scores[row] = rating[i, top]
+    return neighbors, scores, rating_scores
+
+
+def build_user_cf_artifact(engine, root, k=CANDIDATE_COUNT):
+    """把交互矩阵、用户/歌曲ID映射和邻居表写成一个新版本的模型，返回版本号"""
+    interactions = engine.interactions
+    neighbors, scores, rating_scores = build_neighbor_table(engine, k)
+
+    matrix = interactions.matrix
+    arrays = {
+        'matrix_indptr': matrix.indptr.astype(np.int64),
+        'matrix_indices': matrix.indices.astype(np.int32),
+        'matrix_data': matrix.data.astype(np.float32),
+        'matrix_sequence': interactions.sequence,
+        'song_ids': interactions.song_ids,
+        **id_lookup_arrays(interactions.user_ids),
+        'neighbors': neighbors,
+        'neighbor_scores': scores,
+        'neighbor_rating_scores': rating_scores,
+    }
+    meta = {
+        'user_count': interactions.user_count,
+        'song_count': len(interactions.song_ids),
+        'interaction_count': int(matrix.nnz),
+        'neighbor_count': int(neighbors.shape[1]),
+    }
+    return write_artifact(root, ARTIFACT_KIND, arrays, meta)
+
+
+class UserCFModel:
+    """基于离线模型的推荐：查出离线算好的候选邻居，用最新的偏好相似度重排后汇总歌曲
+
+    preferences 为 None 时直接使用构建模型时算好的相似度，不需要数据库（供批量预计算的子进程使用）。
+    """
+
+    def __init__(self, artifact, preferences):
+        self.artifact = artifact
+        self.preferences = preferences
+
+    def similar_users(self, row, userid, k=NEIGHBOR_COUNT):
+        """返回 [(用户行号, 相似度)]"""
+        candidates = np.asarray(self.artifact['neighbors'][row])
+        valid = candidates >= 0
+        candidates = candidates[valid]
+        if len(candidates) == 0:
+            return []
+
+        if self.preferences is None:
+            scores = np.asarray(self.artifact['neighbor_scores'][row])[valid]
+            return [(int(c), float(score)) for c, score in zip(candidates[:k], scores[:k])]
+
+        rating = np.asarray(self.artifact['neighbor_rating_scores'][row])[valid]
+        user_ids = self.artifact['user_ids']
+        preference = self.preferences.pair_similarities(userid, [str(user_ids[c]) for c in candidates])
+        similarities = rating * 0.6 + preference * 0.4
+        top = np.lexsort((candidates, -similarities))[:k]
+        return [(int(candidates[i]), float(similarities[i])) for i in top]
+
+    def recommend(self, userid, k=NEIGHBOR_COUNT):
+        """返回排序后的歌曲ID；用户不在模型中（例如模型生成后才注册）时返回 None"""
+        result = self.recommend_with_neighbors(userid, k)
+        return None if result is None else result[0]
+
+    def recommend_with_neighbors(self, userid, k=NEIGHBOR_COUNT):
+        """返回 (排序后的歌曲ID, 用到的相似用户ID)；用户不在模型中时返回 None"""
+        row = find_row(self.artifact, userid)
+        if row is None:
+            return None
+
+        neighbors = self.similar_users(row, userid, k)
+        artifact = self.artifact
+        song_ids = rank_neighbor_songs(
+            artifact['matrix_indptr'], artifact['matrix_indices'], artifact['matrix_data'],
+            artifact['matrix_sequence'], artifact['song_ids'],
+            [r for r, _ in neighbors], [similarity for _, similarity in neighbors],
+            exclude_row=row
+        )
+        return song_ids, [str(artifact['user_ids'][r]) for r, _ in neighbors]
+
+
+def get_user_cf_model():
+    """当前版本的离线模型，还没有生成过模型时返回 None"""
+    artifact = get_artifact_store(current_app, ARTIFACT_KIND).get()
+    if artifact is None:
+        return None
+    return UserCFModel(artifact, get_preference_index())
@@ -0,0 +1,104 @@
+"""LSH 近似最近邻索引与精确计算的对比：recall@K、每秒查询数，以及建立和增量插入索引的开销
+
+python -m benchmarks.ann_recall --users 50000 --songs 20000
+
+索引在进程内只建立一次，之后靠 insert 加入交互变化的用户；break_even_queries 为建立索引的耗时
+需要多少次查询节省的时间才能抵消（查询不比精确计算快时为 null）。
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.ann import RandomProjectionLSH
+from app.services.preference_index import PreferenceIndex
+from app.services.recommender import NEIGHBOR_COUNT, UserCFEngine, UserSongMatrix
+
+
+def synthetic_interactions(users, songs, clusters=50, per_user=30, seed=0):
+    """按口味分组生成用户×歌曲评分：每个用户主要听自己组内的歌，歌曲热度服从 Zipf 分布"""
+    rng = np.random.default_rng(seed)
+    cluster_songs = [rng.choice(songs, size=max(songs // clusters * 2, per_user), replace=False)
+                     for _ in range(clusters)]
+    scores = {}
+    for u in range(users):
+        pool = cluster_songs[rng.integers(clusters)]
+        ranks = np.minimum(rng.zipf(1.3, size=per_user), len(pool)) - 1
+        for song in pool[ranks]:
+            scores[(f'user{u}', int(song))] = int(rng.integers(1, 6))
+    return UserSongMatrix.from_scores(scores)
+
+
+def measure(engine, user_ids, k):
+    started = time.perf_counter()
+    results = [engine.similar_users(userid, k) for userid in user_ids]
+    return results, len(user_ids) / (time.perf_counter() - started)
+
+
+def recall_at_k(approximate, exact, k):
+    """相似度并列很常见（只有一首共同歌曲且评分成比例时相似度就是1），
+    因此只要近似结果中的用户相似度不低于精确结果的第k名，就算命中"""
+    if not exact:
+        return 1.0
+    kth = exact[-1][1]
+    return sum(1 for _, score in approximate if score >= kth - 1e-12) / min(k, len(exact))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--songs', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=NEIGHBOR_COUNT)
+    parser.add_argument('--tables', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--bits', type=int, nargs='+', default=[8, 12])
+    parser.add_argument('--probes', type=int, nargs='+', default=[0, 2])
+    args = parser.parse_args()
+
+    interactions = synthetic_interactions(args.users, args.songs)
+    preferences = PreferenceIndex()
+    rng = np.random.default_rng(1)
+    user_ids = [interactions.user_ids[i] for i in rng.choice(interactions.user_count, args.queries, replace=False)]
+
+    exact, exact_qps = measure(UserCFEngine(interactions, preferences), user_ids, args.k)
+    report = {
+        'users': interactions.user_count,
+        'songs': len(interactions.song_ids),
+        'interactions': int(interactions.matrix.nnz),
+        'k': args.k,
+        'exact_qps': round(exact_qps, 1),
+        'exact_query_ms': round(1000 / exact_qps, 3),
+        'ann': [],
+    }
+    for n_tables in args.tables:
+        for n_bits in args.bits:
+            for probes in args.probes:
+                started = time.perf_counter()
+                index = RandomProjectionLSH(n_tables, n_bits, probes).build(interactions.indicator)
+                build_seconds = time.perf_counter() - started
+                approximate, qps = measure(UserCFEngine(interactions, preferences, index), user_ids, args.k)
+                recall = np.mean([recall_at_k(a, e, args.k) for a, e in zip(approximate, exact)])
+                # 把查询用户重新插入一次，模拟他们的交互发生变化
+                rows = [interactions.user_index[userid] for userid in user_ids]
+                started = time.perf_counter()
+                for row in rows:
+                    index.insert(row, interactions.indicator[row])
+                insert_ms = (time.perf_counter() - started) / len(rows) * 1000
+                saved_ms = 1000 / exact_qps - 1000 / qps
+                report['ann'].append({
+                    'n_tables': n_tables,
+                    'n_bits': n_bits,
+                    'probes': probes,
+                    'build_seconds': round(build_seconds, 3),
+                    'insert_ms': round(insert_ms, 3),
+                    'qps': round(qps, 1),
+                    'query_ms': round(1000 / qps, 3),
+                    'break_even_queries': int(build_seconds * 1000 / saved_ms) if saved_ms > 0 else None,
+                    'recall_at_k': round(float(recall), 4),
+                })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""常驻内存的歌曲目录（CatalogStore）与 ORM 对象的对比：内存占用、建立时间和按ID取歌的延迟
+
+python -m benchmarks.catalog_memory --songs 1000000
+
+只生成 music 表（保存在 benchmarks/data 下，已存在时直接复用）。内存用 tracemalloc 统计建立后仍然占用的字节数；
+ORM 一侧是 Music.query.all() 后保留在 session 中的全部对象（包括 identity map 和属性状态）。
+"""
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app import db
+from app.models import Music
+from app.services.catalog import CATALOG_COLUMNS, CatalogStore
+from benchmarks.datagen import GENRES, _insert, create_benchmark_app
+
+# 按ID取歌的次数，每次取的歌曲数（与推荐、排行榜一页的数量相当）
+LOOKUPS = 200
+LOOKUP_SIZE = 20
+
+
+def generate_music(songs, seed=0):
+    """歌名长短不一、中英文混合，歌手数约为歌曲数的1/10，大多数歌曲使用默认封面"""
+    rng = np.random.default_rng(seed)
+    db.drop_all()
+    db.create_all()
+    artists = [f'歌手{i}' for i in range(max(1, songs // 10))]
+    rows = []
+    for song_id in range(1, songs + 1):
+        genres = rng.choice(GENRES, size=rng.integers(1, 3), replace=False)
+        rows.append({
+            'id': song_id,
+            'title': f'歌曲{song_id}' if rng.random() < 0.5 else f'Song {song_id} ' + 'la' * int(rng.integers(1, 10)),
+            'artist_name': artists[rng.integers(len(artists))],
+            'genre': ','.join(genres),
+            'play_count': 0,
+            'cover_url': f'/static/music_img/{song_id}.jpg' if rng.random() < 0.1
+            else '/static/music_img/default_cover.jpg',
+        })
+    _insert(Music, rows)
+    db.session.commit()
+
+
+def retained(build):
+    """调用 build()，返回 (结果, 调用结束后仍然占用的字节数, 耗时秒数)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - started
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, seconds
+
+
+def lookup_ms(lookup, batches):
+    started = time.perf_counter()
+    for batch in batches:
+        lookup(batch)
+    return round((time.perf_counter() - started) / len(batches) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--songs', type=int, default=100000)
+    parser.add_argument('--db', default=None, help='默认为 benchmarks/data/catalog_<歌曲数>.db')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(os.path.dirname(__file__), 'data', f'catalog_{args.songs}.db')
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    exists = os.path.exists(db_path)
+    app = create_benchmark_app(db_path)
+    with app.app_context():
+        if not exists or db.session.query(func.count(Music.id)).scalar() != args.songs:
+            generate_music(args.songs)
+        rng = np.random.default_rng(1)
+        batches = [rng.integers(1, args.songs + 1, size=LOOKUP_SIZE).tolist() for _ in range(LOOKUPS)]
+
+        catalog, catalog_bytes, catalog_seconds = retained(lambda: CatalogStore().load())
+        catalog_ms = lookup_ms(lambda ids: [catalog.get(song_id) for song_id in ids], batches)
+        del catalog
+
+        tuples, tuple_bytes, tuple_seconds = retained(lambda: db.session.execute(select(*CATALOG_COLUMNS)).all())
+        del tuples
+
+        db.session.expunge_all()
+        orm, orm_bytes, orm_seconds = retained(lambda: Music.query.all())
+        del orm
+        db.session.expunge_all()
+        orm_ms = lookup_ms(lambda ids: Music.query.filter(Music.id.in_(ids)).all(), batches)
+
+    report = {
+        'songs': args.songs,
+        'catalog': {'mb': round(catalog_bytes / 2 ** 20, 1), 'build_seconds': round(catalog_seconds, 2),
+                    'lookup_ms': catalog_ms},
+        'row_tuples': {'mb': round(tuple_bytes / 2 ** 20, 1), 'load_seconds': round(tuple_seconds, 2)},
+        'orm': {'mb': round(orm_bytes / 2 ** 20, 1), 'load_seconds': round(orm_seconds, 2), 'lookup_ms': orm_ms},
+        'lookup_size': LOOKUP_SIZE,
+        'db': db_path,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
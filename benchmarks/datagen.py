@@ -0,0 +1,160 @@
+"""生成模拟数据写入本地 SQLite：用户、歌曲、偏好、Zipf 分布的播放记录和评分
+
+python -m benchmarks.datagen --users 10000 --songs 5000 --db benchmarks/data/bench_10000.db
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta, UTC
+
+import numpy as np
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.models import Music, Rating, User, UserPlayHistory, UserPreference
+from app.services.interactions import reconcile_interactions
+from config import Config
+
+GENRES = ['流行', '摇滚', '民谣', '电子', '古典', '说唱', '爵士', '乡村', 'R&B', '轻音乐']
+LISTENING_TIMES = ['早上', '中午', '下午', '晚上', '深夜']
+
+# 每批插入的行数
+BATCH_SIZE = 20000
+
+
+def create_benchmark_app(db_path, **config):
+    """使用 SQLite 文件的应用实例，config 覆盖其他配置项（例如 MODEL_DIR）；不在后台建立搜索补全索引，以免影响测量"""
+    settings = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(db_path),
+                'SUGGEST_BUILD_ON_STARTUP': False, **config}
+    benchmark_config = type('BenchmarkConfig', (Config,), settings)
+    return create_app(benchmark_config)
+
+
+def zipf_cdf(n, exponent):
+    """第 i 名的概率与 1/i^exponent 成正比，返回累积分布，用 searchsorted 抽样"""
+    cdf = np.cumsum(1.0 / np.arange(1, n + 1) ** exponent)
+    return cdf / cdf[-1]
+
+
+def zipf_sample(rng, cdf, size):
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), len(cdf) - 1)
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def generate(users, songs, plays_per_user=40, rating_ratio=0.3, preference_ratio=0.7, days=90,
+             exponent=1.1, seed=0):
+    """在当前应用上下文的数据库中重建所有表并写入模拟数据，返回数据规模统计
+
+    每首歌属于1-2个类型，歌手数约为歌曲数的1/10。每个用户偏爱1-3个类型：约80%的播放来自偏爱类型，
+    其余来自全部歌曲；两部分都按歌曲热度的 Zipf 分布抽样，每人的播放次数服从几何分布（均值 plays_per_user）。
+    """
+    rng = np.random.default_rng(seed)
+    started = time.time()
+    db.drop_all()
+    db.create_all()
+
+    artists = [f'歌手{i}' for i in range(max(1, songs // 10))]
+    song_genres = []
+    music_rows = []
+    for song_id in range(1, songs + 1):
+        genres = list(rng.choice(GENRES, size=rng.integers(1, 3), replace=False))
+        song_genres.append(genres)
+        music_rows.append({
+            'id': song_id,
+            'title': f'歌曲{song_id}',
+            'artist_name': artists[rng.integers(len(artists))],
+            'genre': ','.join(genres),
+            'play_count': 0,
+            'cover_url': '/static/music_img/default_cover.jpg',
+        })
+
+    # 全局热度排名随机打乱，每个类型内部沿用全局的相对顺序
+    popularity_order = rng.permutation(songs) + 1
+    global_cdf = zipf_cdf(songs, exponent)
+    genre_songs = {genre: [] for genre in GENRES}
+    for song_id in popularity_order.tolist():
+        for genre in song_genres[song_id - 1]:
+            genre_songs[genre].append(song_id)
+    genre_songs = {genre: np.array(ids) for genre, ids in genre_songs.items() if ids}
+    genre_cdfs = {genre: zipf_cdf(len(ids), exponent) for genre, ids in genre_songs.items()}
+
+    now = datetime.now(UTC)
+    user_rows, preference_rows, play_rows, rating_rows = [], [], [], []
+    play_counts = np.zeros(songs + 1, dtype=np.int64)
+    for u in range(users):
+        userid = f'user{u}'
+        user_rows.append({'userid': userid, 'username': f'用户{u}', 'login_id': f'login{u}',
+                          'password': 'benchmark', 'user_identity': 0})
+        favorite = [g for g in rng.choice(GENRES, size=rng.integers(1, 4), replace=False) if g in genre_cdfs]
+        if rng.random() < preference_ratio:
+            preference_rows.append({
+                'userid': userid,
+                'favorite_genres': ','.join(favorite),
+                'favorite_artists': ','.join(rng.choice(artists, size=min(2, len(artists)), replace=False)),
+                'listening_times': ','.join(rng.choice(LISTENING_TIMES, size=2, replace=False)),
+            })
+
+        n_plays = int(rng.geometric(1 / plays_per_user))
+        from_favorite = rng.random(n_plays) < 0.8 if favorite else np.zeros(n_plays, dtype=bool)
+        played = popularity_order[zipf_sample(rng, global_cdf, int((~from_favorite).sum()))].tolist()
+        if favorite:
+            genres, counts = np.unique(rng.choice(favorite, size=int(from_favorite.sum())), return_counts=True)
+            for genre, count in zip(genres.tolist(), counts.tolist()):
+                played.extend(genre_songs[genre][zipf_sample(rng, genre_cdfs[genre], count)].tolist())
+        offsets = rng.integers(0, days * 24 * 3600, size=len(played))
+        for song_id, offset in zip(played, offsets.tolist()):
+            play_rows.append({'userid': userid, 'music_id': int(song_id),
+                              'played_at': now - timedelta(seconds=offset)})
+            play_counts[song_id] += 1
+        for song_id in set(int(s) for s in played):
+            if rng.random() < rating_ratio:
+                rating_rows.append({'userid': userid, 'music_id': song_id,
+                                    'rating_value': int(rng.integers(1, 6))})
+
+    for row in music_rows:
+        row['play_count'] = int(play_counts[row['id']])
+    _insert(Music, music_rows)
+    _insert(User, user_rows)
+    _insert(UserPreference, preference_rows)
+    _insert(UserPlayHistory, play_rows)
+    _insert(Rating, rating_rows)
+    db.session.commit()
+    # 回填用户-歌曲交互汇总表
+    aggregated = reconcile_interactions()
+
+    return {
+        'users': users,
+        'songs': songs,
+        'preferences': len(preference_rows),
+        'plays': len(play_rows),
+        'ratings': len(rating_rows),
+        'interactions': aggregated['inserted'],
+        'seed': seed,
+        'generate_seconds': round(time.time() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--songs', type=int, default=None, help='默认为用户数的一半')
+    parser.add_argument('--plays-per-user', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', default=None, help='默认为 benchmarks/data/bench_<用户数>.db')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(os.path.dirname(__file__), 'data', f'bench_{args.users}.db')
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    app = create_benchmark_app(db_path)
+    with app.app_context():
+        report = generate(args.users, args.songs or max(1, args.users // 2), args.plays_per_user, seed=args.seed)
+    print(json.dumps(dict(report, db=db_path), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""/recommendations 在不同数据规模下各推荐方式的延迟（p50/p95）、内存峰值和 SQL 查询数
+
+python -m benchmarks.recommend_latency --scales 1000 10000 100000 --output report.json
+
+每个规模在单独的子进程中运行（进程内的索引和模型缓存互不影响，内存峰值也分开统计）；
+模拟数据库保存在 benchmarks/data 下，已存在时直接复用。输出 JSON，可以直接 diff 两次运行的结果。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from sqlalchemy import event
+
+from app import db
+from app.models import User, UserRecommendation
+from app.services.als import ImplicitALS, load_implicit_feedback, train_mf_artifact
+from app.services.precompute import precompute_recommendations
+from app.services.preference_index import PreferenceIndex
+from app.services.recommender import UserCFEngine, UserSongMatrix
+from app.services.user_cf_model import build_user_cf_artifact
+from benchmarks.datagen import create_benchmark_app, generate
+
+# 依次运行的推荐方式；顺序有意义：online（现场计算）必须在生成离线模型之前，precomputed 必须在最后
+ENGINES = ['online', 'offline', 'item', 'mf', 'precomputed']
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+class QueryCounter:
+    """统计数据库执行的 SQL 语句数"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def prepare(app, name, workers):
+    """生成该推荐方式需要的离线模型或预计算结果，返回耗时（秒）"""
+    started = time.perf_counter()
+    if name == 'offline':
+        engine = UserCFEngine(UserSongMatrix.from_db(), PreferenceIndex().load())
+        build_user_cf_artifact(engine, app.config['MODEL_DIR'])
+    elif name == 'mf':
+        train_mf_artifact(app, load_implicit_feedback(), ImplicitALS(factors=32, iterations=5, workers=workers),
+                          warm_start=False)
+    elif name == 'precomputed':
+        precompute_recommendations(app, 'user', days=3650, workers=workers)
+    return time.perf_counter() - started
+
+
+def measure(client, queries, mode, counter, memory_requests):
+    """先请求一次作为冷启动（加载索引/模型），再逐个请求统计延迟，最后开启 tracemalloc 统计内存峰值"""
+    started = time.perf_counter()
+    client.get(f'/recommendations?userid={queries[0]}&mode={mode}')
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    failures = 0
+    counter.count = 0
+    for userid in queries:
+        started = time.perf_counter()
+        response = client.get(f'/recommendations?userid={userid}&mode={mode}').get_json()
+        latencies.append((time.perf_counter() - started) * 1000)
+        failures += not response['success']
+    queries_per_request = counter.count / len(queries)
+
+    # tracemalloc 会拖慢执行，单独用少量请求测内存
+    tracemalloc.start()
+    for userid in queries[:memory_requests]:
+        client.get(f'/recommendations?userid={userid}&mode={mode}')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'requests': len(queries),
+        'failures': failures,
+        'cold_ms': round(cold_ms, 3),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'mean_ms': round(float(np.mean(latencies)), 3),
+        'peak_memory_mb': round(peak / 2 ** 20, 3),
+        'sql_queries_per_request': round(queries_per_request, 2),
+    }
+
+
+def run_scale(users, songs, requests, engines, workers, data_dir, seed):
+    db_path = os.path.join(data_dir, f'bench_{users}_{songs}_{seed}.db')
+    with tempfile.TemporaryDirectory() as model_dir:
+        # 每次请求都重新计算：关闭结果缓存
+        app = create_benchmark_app(db_path, MODEL_DIR=model_dir, RECOMMEND_CACHE_SIZE=0, MODEL_RELOAD_INTERVAL=0)
+        report = {'users': users, 'songs': songs}
+        with app.app_context():
+            if os.path.exists(db_path):
+                # 复用已生成的数据，清掉上次运行留下的预计算结果
+                UserRecommendation.query.delete()
+                db.session.commit()
+            else:
+                report['data'] = generate(users, songs, seed=seed)
+
+            rng = np.random.default_rng(seed)
+            userids = [row.userid for row in db.session.query(User.userid).order_by(User.userid)]
+            queries = [userids[i] for i in rng.choice(len(userids), min(requests, len(userids)), replace=False)]
+            # 约十分之一的请求来自没有任何记录的新用户
+            queries[::10] = [f'new_user_{i}' for i in range(len(queries[::10]))]
+            counter = QueryCounter(db.engine)
+
+        client = app.test_client()
+        report['engines'] = {}
+        for name in ENGINES:
+            if name not in engines:
+                continue
+            with app.app_context():
+                prepare_seconds = prepare(app, name, workers)
+            mode = {'online': 'user', 'offline': 'user', 'precomputed': 'user'}.get(name, name)
+            result = measure(client, queries, mode, counter, max(1, len(queries) // 5))
+            report['engines'][name] = dict(result, prepare_seconds=round(prepare_seconds, 3))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000], help='用户数，例如 1000 10000 100000')
+    parser.add_argument('--songs-ratio', type=float, default=0.5, help='歌曲数 = 用户数 × 该比例')
+    parser.add_argument('--requests', type=int, default=100, help='每种推荐方式的请求数')
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--workers', type=int, default=2, help='ALS 训练和批量预计算使用的线程/进程数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), 'data'))
+    parser.add_argument('--output', default=None, help='同时写入该 JSON 文件')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    options = ['--requests', str(args.requests), '--workers', str(args.workers), '--seed', str(args.seed),
+               '--data-dir', os.path.abspath(args.data_dir), '--songs-ratio', str(args.songs_ratio), '--engines', *args.engines]
+    if args.single:
+        users = args.scales[0]
+        report = run_scale(users, max(1, int(users * args.songs_ratio)), args.requests, args.engines,
+                           args.workers, args.data_dir, args.seed)
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    report = {'requests': args.requests, 'seed': args.seed, 'scales': []}
+    for users in args.scales:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.recommend_latency', '--single', '--scales', str(users), *options],
+            check=True, stdout=subprocess.PIPE, text=True, encoding='utf-8',
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout
+        report['scales'].append(json.loads(output.strip().splitlines()[-1]))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()